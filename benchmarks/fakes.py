@@ -0,0 +1,171 @@
+"""Offline stand-ins for Gemini, Google Sheets and (optionally) Chrome, for the benchmark harness."""
+import io
+import os
+import random
+import asyncio
+from typing import Optional
+import aiohttp
+import PIL.Image
+from src.data_models import AiProductInfo, FetchMode, FetchResult
+from src.interfaces import FetcherInterface, ParserInterface
+from src.metrics import metrics
+from src.sheets_client import SheetsApiError
+from src.writers import GoogleSheetWriter
+
+
+def _latency(mean: float, jitter: float) -> float:
+    return max(0.0, random.uniform(mean - jitter, mean + jitter))
+
+
+class FakeGeminiParser(ParserInterface):
+    """
+    Pretends to be GeminiImageParser: waits a configurable time per call and
+    fails a configurable fraction of calls. Captures of the fixture CAPTCHA
+    page are recognised by their URL.
+    """
+    def __init__(self, api_key: str, latency: float = 1.5, jitter: float = 0.5, error_rate: float = 0.0, client=None):
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+
+    async def parse(self, content: str | FetchResult, user_message: str, use_cache: bool = True) -> AiProductInfo:
+        # Awaits like the real client.aio call, so it occupies no thread.
+        with metrics.span("llm_call"):
+            await asyncio.sleep(_latency(self._latency, self._jitter))
+        metrics.inc("llm_calls_total")
+        return self._answer(content)
+
+    def _answer(self, content: str | FetchResult) -> AiProductInfo:
+        source = content.url if isinstance(content, FetchResult) else content
+        values = {name: None for name in AiProductInfo.model_fields}
+        if random.random() < self._error_rate:
+            metrics.inc("llm_errors_total")
+            return AiProductInfo(**{**values, "is_captcha": False, "item_name": "ERROR_API_CALL"})
+        if "/captcha/" in source or "captcha" in os.path.basename(source):
+            return AiProductInfo(**{**values, "is_captcha": True})
+        return AiProductInfo(**{
+            **values,
+            "is_captcha": False,
+            "item_name": "NEMA 17 Stepper Motor",
+            "category": "Motor",
+            "price_per_unit": 1299.0,
+            "is_gst_included": True,
+            "availability": "In Stock",
+            "platform": "Fixture Electronics",
+        })
+
+    async def parse_many(self, contents: list[str | FetchResult], user_message: str) -> list[AiProductInfo]:
+        """One multi-image request: a single latency for the whole batch."""
+        with metrics.span("llm_call"):
+            await asyncio.sleep(_latency(self._latency, self._jitter))
+        metrics.inc("llm_calls_total")
+        metrics.inc("llm_batched_images_total", len(contents))
+        return [self._answer(content) for content in contents]
+
+
+class FakeSheetsClient:
+    """
+    Stands in for AsyncSheetsClient: the same calls, answered after `latency`
+    seconds, against an in-memory grid (rows numbered from 1, like the sheet).
+    """
+    def __init__(self, latency: float = 0.4, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.rows = 0
+        self.grid: list[list] = [list(GoogleSheetWriter.HEADER)]
+
+    async def get_values(self, spreadsheet_id: str, range_: str, **_) -> dict:
+        await self._respond(0)
+        return self._read(range_)
+
+    async def batch_get_values(self, spreadsheet_id: str, ranges: list[str], **_) -> dict:
+        await self._respond(0)
+        return {"valueRanges": [self._read(range_) for range_ in ranges]}
+
+    async def update_values(self, spreadsheet_id: str, range_: str, rows: list[list], **_) -> dict:
+        await self._respond(0)
+        self._put(range_, rows)
+        return {}
+
+    async def batch_update_values(self, spreadsheet_id: str, data: list[dict], **_) -> dict:
+        await self._respond(len({_start(entry["range"])[0] for entry in data}))
+        for entry in data:
+            self._put(entry["range"], entry["values"])
+        return {}
+
+    async def append_values(self, spreadsheet_id: str, range_: str, rows: list[list], **_) -> dict:
+        await self._respond(len(rows))
+        self.grid.extend(list(row) for row in rows)
+        return {}
+
+    async def close(self):
+        pass
+
+    def _read(self, range_: str) -> dict:
+        first_row, first_column = _start(range_)
+        # A single cell ("N5") reads just that cell, an open range ("A2:N") every row from there down.
+        single = ":" not in range_.split("!")[-1]
+        rows = self.grid[first_row - 1:first_row] if single else self.grid[first_row - 1:]
+        values = [list(row[first_column:first_column + 1] if single else row[first_column:]) for row in rows]
+        while values and not values[-1]:
+            values.pop()
+        return {"values": values} if values else {}
+
+    def _put(self, range_: str, rows: list[list]):
+        first_row, first_column = _start(range_)
+        for offset, row in enumerate(rows):
+            while len(self.grid) < first_row + offset:
+                self.grid.append([])
+            target = self.grid[first_row + offset - 1]
+            target.extend([""] * (first_column + len(row) - len(target)))
+            target[first_column:first_column + len(row)] = row
+
+    async def _respond(self, rows: int):
+        await asyncio.sleep(_latency(self.latency, self.latency / 4))
+        if random.random() < self.error_rate:
+            raise SheetsApiError(500, "Fake Sheets backend error")
+        self.requests += 1
+        self.rows += rows
+
+
+def _start(range_: str) -> tuple[int, int]:
+    """The first (1-based row, 0-based column) of an A1 range like "Sheet!H12:I12" (row 1 when it has none)."""
+    start = range_.split("!")[-1].split(":")[0]
+    letters = "".join(ch for ch in start if ch.isalpha())
+    digits = "".join(ch for ch in start if ch.isdigit())
+    return (int(digits) if digits else 1), (ord(letters.upper()) - ord("A") if letters else 0)
+
+
+class FakeBrowserFetcher(FetcherInterface):
+    """
+    For machines without Chrome: downloads the fixture page over HTTP, waits
+    `render_latency` seconds as a stand-in for the browser, and returns a
+    placeholder JPEG capture in memory.
+    """
+    def __init__(self, render_latency: float = 2.0, jitter: float = 0.5):
+        self._render_latency = render_latency
+        self._jitter = jitter
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def fetch(self, url: str, headless: bool = True, mode: Optional[FetchMode] = None) -> FetchResult | str:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        with metrics.span("navigation"):
+            async with self._session.get(url) as response:
+                await response.text()
+            await asyncio.sleep(_latency(self._render_latency, self._jitter))
+        image = await asyncio.to_thread(self._capture)
+        return FetchResult(url=url, image=image, mime_type="image/jpeg")
+
+    @staticmethod
+    def _capture() -> bytes:
+        with metrics.span("screenshot"):
+            image = PIL.Image.new("RGB", (1280, 1080), (random.randint(0, 255), 200, 200))
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=80)
+        return buffer.getvalue()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,58 @@
+"""A local HTTP server that serves the fixture product pages in benchmarks/fixtures/."""
+import os
+import asyncio
+import logging
+from typing import Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# URL prefix -> fixture page. Product numbers in the URL keep every page distinct.
+PAGES = {
+    "product": "product_jsonld.html", # Complete schema.org markup: the structured-data fast path
+    "item": "product_plain.html",     # No markup: needs the screenshot + LLM path
+    "captcha": "captcha.html",        # A bot wall
+}
+
+
+class FixtureServer:
+    """Serves /product/<n>, /item/<n> and /captcha/<n>, optionally after `latency` seconds."""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self._host = host
+        self._port = port
+        self._latency = latency
+        self._runner: Optional[web.AppRunner] = None
+        self._templates = {}
+        for kind, filename in PAGES.items():
+            with open(os.path.join(FIXTURE_DIR, filename), encoding="utf-8") as f:
+                self._templates[kind] = f.read()
+        self.base_url = ""
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/static/product.svg", self._image)
+        app.router.add_get("/{kind}/{n}", self._page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self._host}:{port}"
+        logger.info(f"Fixture server listening on {self.base_url}")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _page(self, request: web.Request) -> web.Response:
+        template = self._templates.get(request.match_info["kind"])
+        if template is None:
+            raise web.HTTPNotFound()
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return web.Response(text=template.replace("{n}", request.match_info["n"]), content_type="text/html")
+
+    async def _image(self, request: web.Request) -> web.FileResponse:
+        return web.FileResponse(os.path.join(FIXTURE_DIR, "product.svg"))
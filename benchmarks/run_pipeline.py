@@ -0,0 +1,263 @@
+"""
+Offline throughput benchmark for the whole pipeline.
+
+Synthetic WorkItems go through the durable queue, queue_consumer, the
+DomainScheduler and the real ProcessingWorker, against a local fixture
+server, a fake Gemini parser and the real batching sheet writer on a fake
+Sheets client. Each concurrency setting reports jobs/s, p50/p95/p99 per
+stage and the peak RSS of the process tree (Chrome included).
+
+    python -m benchmarks.run_pipeline --jobs 100 --fetch-workers 1 2 4
+    python -m benchmarks.run_pipeline --browser chrome --fetch-workers 2 --parse-workers 4 8
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import tempfile
+from collections import Counter, defaultdict
+from typing import Optional
+from main import queue_consumer, run_and_acknowledge
+from src.concurrency import AdaptiveConcurrency
+from src.data_models import JobResult, WorkItem
+from src.driver_pool import ChromeDriverPool, process_tree_rss_mb
+from src.durable_queue import DurableWorkQueue
+from src.fetchers import BasicHtmlFetcher, SeleniumFetcher
+from src.image_preprocessing import ImagePreprocessor, PreprocessSettings
+from src.metrics import metrics
+from src.readiness import DomainSettleTracker, PageReadinessWaiter
+from src.scheduler import DomainScheduler, HostLimits
+from src.worker import ProcessingWorker
+from src.writers import GoogleSheetWriter
+from .fakes import FakeBrowserFetcher, FakeGeminiParser, FakeSheetsClient
+from .fixture_server import FixtureServer
+
+logger = logging.getLogger(__name__)
+
+# Spans shown in the report, in pipeline order.
+REPORT_SPANS = (
+    "queue_wait", "html_fetch", "browser_launch", "navigation", "readiness_wait", "screenshot",
+    "preprocess", "llm_call", "retry", "sheet_write", "sheets_write", "job",
+)
+
+
+def synthetic_items(base_url: str, count: int, captcha_rate: float, structured_rate: float, users: int):
+    """WorkItems over the fixture pages, mixed by the given rates, as if posted by `users` people."""
+    for n in range(count):
+        roll = random.random()
+        if roll < captcha_rate:
+            kind = "captcha"
+        elif roll < captcha_rate + structured_rate:
+            kind = "product"
+        else:
+            kind = "item"
+        quantity = random.randint(1, 10)
+        yield WorkItem(
+            url=f"{base_url}/{kind}/{n}",
+            message_content=f"we need {quantity} of these {base_url}/{kind}/{n}",
+            user_name=f"bench-user-{n % users}",
+        )
+
+
+def percentile(samples: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+async def run_once(args, base_url: str, fetch_workers: int, parse_workers: int) -> dict:
+    """Pushes `args.jobs` items through a freshly assembled pipeline and measures it."""
+    metrics.reset()
+    samples: dict[str, list[float]] = defaultdict(list)
+    listener = lambda name, seconds: samples[name].append(seconds)
+    metrics.add_span_listener(listener)
+
+    workdir = tempfile.mkdtemp(prefix="discprod-bench-")
+    driver_pool = None
+    if args.browser == "chrome":
+        driver_pool = ChromeDriverPool(max_headless=fetch_workers, max_headed=1)
+        fetcher_class = SeleniumFetcher
+        fetcher_options = {
+            "driver_pool": driver_pool,
+            "readiness": PageReadinessWaiter(settle_tracker=DomainSettleTracker(path=None)),
+            "preprocessor": ImagePreprocessor(PreprocessSettings()),
+        }
+    else:
+        fetcher_class = FakeBrowserFetcher
+        fetcher_options = {"render_latency": args.render_latency}
+
+    sheets = FakeSheetsClient(latency=args.sheets_latency, error_rate=args.sheets_error_rate)
+    component_config = {
+        "fetcher_options": fetcher_options,
+        "html_fetcher": BasicHtmlFetcher() if args.fast_path else None,
+        # No result cache or learned fetch modes: every run should do the same work.
+        "result_cache": None,
+        "screenshot_store": None,
+        "fetch_strategy": None,
+        "parser_options": {"latency": args.llm_latency, "error_rate": args.llm_error_rate},
+        "writer_options": {"sheets_client": sheets, "batch_size": args.batch_size, "flush_interval": args.flush_interval},
+        "api_key": "offline",
+        "creds_path": "offline",
+        "sheet_id": "offline",
+        "sheet_name": "Benchmark",
+    }
+    stage_concurrency = {"fetch": fetch_workers, "parse": parse_workers, "write": args.write_in_flight}
+    max_concurrent_jobs = fetch_workers + parse_workers
+    concurrency = AdaptiveConcurrency(
+        initial=max_concurrent_jobs, max_limit=args.adaptive_max, interval=args.adaptive_interval,
+    ) if args.adaptive_max else None
+    worker_limit = concurrency.max_limit if concurrency else max_concurrent_jobs
+    worker = ProcessingWorker(
+        fetcher_class=fetcher_class,
+        parser_class=FakeGeminiParser,
+        writer_class=GoogleSheetWriter,
+        component_config=component_config,
+        max_concurrent_jobs=worker_limit,
+        stage_concurrency=stage_concurrency,
+    )
+    # One attempt per item, so every item is processed exactly once.
+    work_queue = DurableWorkQueue(path=os.path.join(workdir, "queue.sqlite3"), max_in_flight=args.queue_window, max_attempts=1)
+
+    outcomes: Counter = Counter()
+    done = asyncio.Event()
+
+    async def run_job(item: WorkItem) -> JobResult:
+        result = await run_and_acknowledge(work_queue, worker, item)
+        outcomes[result.outcome.value] += 1
+        if sum(outcomes.values()) >= args.jobs:
+            done.set()
+        return result
+
+    # Every fixture page lives on one host, so it gets the whole pipeline to itself.
+    scheduler = DomainScheduler(
+        run_job=run_job,
+        max_concurrent_jobs=max_concurrent_jobs,
+        default_limits=HostLimits(concurrency=worker_limit, rate_per_minute=args.host_rate, burst=worker_limit),
+        captcha_backoff_base=args.captcha_backoff,
+        concurrency=concurrency,
+    )
+
+    peak_rss = 0.0
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, process_tree_rss_mb(os.getpid()) or 0.0)
+            await asyncio.sleep(0.25)
+
+    tasks = [
+        asyncio.create_task(scheduler.run()),
+        asyncio.create_task(queue_consumer(work_queue, scheduler)),
+        asyncio.create_task(sample_rss()),
+    ]
+    started = time.perf_counter()
+    try:
+        for item in synthetic_items(base_url, args.jobs, args.captcha_rate, args.structured_rate, args.users):
+            await work_queue.put(item)
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    finally:
+        elapsed = time.perf_counter() - started
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await worker.close()
+        if driver_pool:
+            await asyncio.to_thread(driver_pool.close)
+        work_queue.close()
+        metrics.remove_span_listener(listener)
+
+    return {
+        "fetch_workers": fetch_workers,
+        "parse_workers": parse_workers,
+        "jobs": sum(outcomes.values()),
+        "seconds": round(elapsed, 2),
+        "jobs_per_second": round(sum(outcomes.values()) / elapsed, 3),
+        "outcomes": dict(outcomes),
+        "sheets_requests": sheets.requests,
+        "peak_rss_mb": round(peak_rss, 1),
+        "final_concurrency": concurrency.limit if concurrency else max_concurrent_jobs,
+        "spans": {
+            name: {
+                "count": len(samples[name]),
+                "p50": percentile(samples[name], 0.50),
+                "p95": percentile(samples[name], 0.95),
+                "p99": percentile(samples[name], 0.99),
+            }
+            for name in REPORT_SPANS
+            if samples.get(name)
+        },
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"\n=== fetch={report['fetch_workers']} parse={report['parse_workers']}: "
+        f"{report['jobs']} jobs in {report['seconds']}s = {report['jobs_per_second']} jobs/s, "
+        f"peak RSS {report['peak_rss_mb']} MB, {report['sheets_requests']} Sheets requests, "
+        f"job limit {report['final_concurrency']} ==="
+    )
+    print(f"outcomes: {report['outcomes']}")
+    print(f"{'stage':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in report["spans"].items():
+        print(f"{name:<16}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+
+
+async def main(args):
+    random.seed(args.seed)
+    server = FixtureServer(latency=args.server_latency)
+    base_url = await server.start()
+    reports = []
+    try:
+        for fetch_workers, parse_workers in itertools.product(args.fetch_workers, args.parse_workers):
+            report = await run_once(args, base_url, fetch_workers, parse_workers)
+            print_report(report)
+            reports.append(report)
+    finally:
+        await server.stop()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=60, help="Work items per run.")
+    parser.add_argument("--fetch-workers", type=int, nargs="+", default=[2], help="Fetch stage sizes to try.")
+    parser.add_argument("--parse-workers", type=int, nargs="+", default=[8], help="Parse stage sizes to try.")
+    parser.add_argument("--write-in-flight", type=int, default=20)
+    parser.add_argument("--browser", choices=("fake", "chrome"), default="fake", help="'chrome' needs a local Chrome.")
+    parser.add_argument("--render-latency", type=float, default=2.0, help="Seconds the fake browser takes per page.")
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--sheets-latency", type=float, default=0.4)
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0)
+    parser.add_argument("--server-latency", type=float, default=0.05, help="Fixture server delay per page.")
+    parser.add_argument("--captcha-rate", type=float, default=0.1, help="Share of items pointing at the CAPTCHA page.")
+    parser.add_argument("--structured-rate", type=float, default=0.3, help="Share of items with complete markup.")
+    parser.add_argument("--no-fast-path", dest="fast_path", action="store_false", help="Skip the structured-data tier.")
+    parser.add_argument("--users", type=int, default=3, help="Distinct Discord users posting the items.")
+    parser.add_argument("--host-rate", type=float, default=1e6, help="Scheduler rate limit per minute for the fixture host.")
+    parser.add_argument("--captcha-backoff", type=float, default=0.0, help="Scheduler CAPTCHA pause; 0 keeps runs comparable.")
+    parser.add_argument("--adaptive-max", type=int, default=0, help="Let the job limit adapt up to this (0 keeps it fixed).")
+    parser.add_argument("--adaptive-interval", type=float, default=2.0, help="Seconds between adaptive limit changes.")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--flush-interval", type=float, default=2.0)
+    parser.add_argument("--queue-window", type=int, default=20, help="Durable queue max_in_flight.")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="Give up on a run after this many seconds.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the reports to this JSON file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's INFO logs.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=logging.INFO if arguments.verbose else logging.WARNING)
+    asyncio.run(main(arguments))
@@ -1,114 +1,466 @@
+from __future__ import annotations
 import os
+import json
 import asyncio
 import sys # Import sys to exit gracefully
 import logging
+from contextlib import AsyncExitStack
+from dataclasses import replace
+from functools import partial
+from typing import TYPE_CHECKING, Optional
+# First, so the startup clock starts before anything heavy is imported.
+from src.startup import startup
 from dotenv import load_dotenv
-from src.worker import ProcessingWorker
 
-# Import our components
-from src.discord_reader import DiscordReader
-from src.fetchers import SeleniumFetcher
-from src.interfaces import FetcherInterface, ParserInterface, WriterInterface
-from src.logging_config import setup_logging
-from src.parsers import GeminiImageParser
-from src.worker import ProcessingWorker
-from src.writers import GoogleSheetWriter
+# Import our components. Only the light ones are imported here; the browser, Gemini,
+# Sheets, Discord and broker modules are imported when the process's role needs them.
+from src.data_models import JobOutcome, JobResult, WorkItem
+from src.durable_queue import DurableWorkQueue
+from src.governor import ApiGovernor
+from src.metrics import MetricsServer, summary_reporter
+from src.logging_config import parse_levels, setup_logging
+
+if TYPE_CHECKING:
+    from src.broker import RemoteWorkQueue
+    from src.interfaces import WriterInterface
+    from src.recheck import PriceRechecker
+    from src.scheduler import DomainScheduler
+    from src.worker import ProcessingWorker
 
 logger = logging.getLogger(__name__)
 
+# How this process takes part (ROLE):
+#   all    - everything in one process (the default)
+#   broker - Discord reader, durable queue, broker endpoint and the single sheet writer
+#   worker - browsers and Gemini; leases jobs from the broker at BROKER_URL (run as many as you like)
+ROLES = ("all", "broker", "worker")
+
+def _env_int(name: str, default: int) -> int:
+    """Reads an optional integer setting from the environment."""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def _env_float(name: str, default: float) -> float:
+    """Reads an optional float setting from the environment."""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _required_env(name: str) -> str:
+    """Reads a required setting, exiting with an error if it is missing."""
+    value = os.getenv(name)
+    if not value:
+        logger.info(f"FATAL: {name} not found in .env file.")
+        sys.exit(1) # Exit the program with an error code
+    return value
+
+def _api_retry_options() -> dict:
+    """Retry and circuit-breaker settings shared by the API governors."""
+    return {
+        "max_attempts": _env_int("API_MAX_ATTEMPTS", 6),
+        "breaker_threshold": _env_int("API_BREAKER_THRESHOLD", 5),
+        "breaker_cooldown": _env_float("API_BREAKER_COOLDOWN_SECONDS", 30.0),
+    }
+
 # The worker task that consumes from the queue
-async def queue_consumer(work_queue: asyncio.Queue, worker: ProcessingWorker):
+async def queue_consumer(work_queue: DurableWorkQueue | RemoteWorkQueue, scheduler: DomainScheduler):
     logger.info("Queue consumer started.")
     while True:
-        # We now get a WorkItem object from the queue.
+        # get() blocks while the in-flight window is full, so a burst stays on disk.
         work_item = await work_queue.get()
 
         # --- DEBUGGING LOG ---
-        logger.info(f"Got object of type {type(work_item).__name__} from queue.")
+        logger.debug(f"Got object of type {type(work_item).__name__} from queue.")
 
-        logger.info(f"Got item from queue for URL: {work_item.url}. Creating task.")
-        asyncio.create_task(worker.process_url(work_item))
-        # We mark the task as done immediately for the queue.
-        # The actual work happens in the background.
-        work_queue.task_done()
+        logger.info(f"Got item from queue for URL: {work_item.url}. Handing it to the scheduler.")
+        # The scheduler decides when the job runs, based on its host's limits.
+        await scheduler.submit(work_item)
 
-async def main():
-    setup_logging()  # Set up logging configuration
+async def run_and_acknowledge(work_queue: DurableWorkQueue | RemoteWorkQueue, worker: ProcessingWorker, item: WorkItem) -> JobResult:
+    """Runs one job and only then acknowledges it, so unfinished work survives a restart."""
+    result = JobResult(JobOutcome.ERROR)
+    try:
+        result = await worker.process_url(item)
+    finally:
+        # Always settle, or the job's in-flight slot would never be released.
+        await work_queue.complete(item, result)
+    startup.mark("first_job_completed")
+    return result
 
-    # --- Configuration and Secret Loading ---
-    
-    # Build a path to the .env file inside the 'config' directory.
-    # os.path.dirname(__file__) gets the directory of the current script (our root).
-    # os.path.join() correctly combines them into a path like 'D:/.../product_scraper_bot/config/.env'.
-    project_root = os.path.dirname(__file__)
-    dotenv_path = os.path.join(project_root, 'config', '.env')
-    
-    # Load the .env file from the specified path.
-    load_dotenv(dotenv_path=dotenv_path)
-    
-    discord_token = os.getenv("DISCORD_BOT_TOKEN")
-    if not discord_token:
-        logger.info("FATAL: DISCORD_BOT_TOKEN not found in .env file.")
-        sys.exit(1) # Exit the program with an error code
+def sheet_writer_options(stack: AsyncExitStack, sheets_creds_path: str) -> dict:
+    """Options for the deployment's one GoogleSheetWriter, with its process-wide Sheets client."""
+    from src.sheets_client import AsyncSheetsClient, ServiceAccountTokenSource
+    # One keep-alive connection pool and one cached OAuth token for every Sheets request.
+    sheets_client = AsyncSheetsClient(
+        ServiceAccountTokenSource(sheets_creds_path), pool_size=_env_int("SHEETS_POOL_SIZE", 10)
+    )
+    # Closed after the writer has flushed (the stack unwinds in reverse).
+    stack.push_async_callback(sheets_client.close)
+    return {
+        "sheets_client": sheets_client,
+        "governor": ApiGovernor(
+            "sheets", requests_per_minute=_env_float("SHEETS_REQUESTS_PER_MINUTE", 60), **_api_retry_options()
+        ),
+        "batch_size": _env_int("SHEETS_BATCH_SIZE", 20),
+        "flush_interval": _env_float("SHEETS_FLUSH_SECONDS", 2.0),
+        "refresh_interval": _env_float("SHEETS_INDEX_REFRESH_SECONDS", 60),
+        "reload_interval": _env_float("SHEETS_INDEX_RELOAD_SECONDS", 3600),
+        "fresh_for": _env_float("SHEET_FRESH_HOURS", 24) * 3600,
+    }
 
-    ai_studio_key = os.getenv("AI_STUDIO_API_KEY")
-    if not ai_studio_key:
-        logger.info("FATAL: AI_STUDIO_API_KEY not found in .env file.")
-        sys.exit(1)
+def build_processing(
+    stack: AsyncExitStack,
+    work_queue: DurableWorkQueue | RemoteWorkQueue,
+    ai_studio_key: str,
+    writer_class: type,
+    writer_options: dict,
+    sheet_settings: dict,
+    writer: Optional[WriterInterface] = None,
+) -> DomainScheduler:
+    """Builds the browsers, the Gemini parser, the caches and the ProcessingWorker, and the scheduler that feeds it."""
+    import google.genai as genai
+    from src.driver_pool import ChromeDriverPool
+    from src.fetch_strategy import DomainFetchStrategy
+    from src.fetchers import BasicHtmlFetcher, SeleniumFetcher
+    from src.image_preprocessing import ImagePreprocessor, PreprocessSettings
+    from src.parsers import GeminiImageParser
+    from src.perceptual_cache import PerceptualHashCache
+    from src.readiness import PageReadinessWaiter
+    from src.resource_blocking import BlockingRules, ResourceBlocker
+    from src.result_cache import ResultCache
+    from src.concurrency import AdaptiveConcurrency
+    from src.scheduler import DomainScheduler, HostLimits
+    from src.screenshot_store import ScreenshotStore
+    from src.worker import ProcessingWorker
+    # --- Optional tuning knobs (all have sensible defaults) ---
+    # Ads, trackers, chat widgets, video and fonts are kept out of page loads. "0" loads pages in full.
+    resource_blocking = os.getenv("RESOURCE_BLOCKING", "1") != "0"
+    resource_stats = resource_blocking and os.getenv("RESOURCE_BLOCKING_STATS", "1") != "0"
+    driver_pool_headless = _env_int("CHROME_POOL_HEADLESS", 2)
+    driver_pool = ChromeDriverPool(
+        max_headless=driver_pool_headless,
+        max_headed=_env_int("CHROME_POOL_HEADED", 1),
+        max_uses=_env_int("CHROME_MAX_USES", 50),
+        max_memory_mb=_env_int("CHROME_MAX_MEMORY_MB", 1500),
+        performance_log=resource_stats,
+    )
+    # Quit the warm Chrome drivers so no browser processes outlive the bot.
+    stack.push_async_callback(asyncio.to_thread, driver_pool.close)
+    # Optional human-like pause after the page is ready, e.g. "1.5,3". Off by default.
+    human_jitter = os.getenv("FETCH_HUMAN_JITTER")
+    readiness = PageReadinessWaiter(
+        max_wait=_env_float("FETCH_MAX_WAIT_SECONDS", 12.0),
+        human_jitter=tuple(float(x) for x in human_jitter.split(",")) if human_jitter else None,
+    )
 
-    sheets_creds_path = os.getenv("GOOGLE_SHEETS_CREDENTIALS_JSON_PATH")
-    if not sheets_creds_path:
-        logger.info("FATAL: GOOGLE_SHEETS_CREDENTIALS_JSON_PATH not found in .env file.")
-        sys.exit(1)
-    
-    sheet_id = os.getenv("GOOGLE_SHEET_ID")
-    if not sheet_id:
-        logger.info("FATAL: GOOGLE_SHEET_ID not found in .env file.")
-        sys.exit(1)
+    # Screenshots are cropped, downscaled and re-encoded before they reach Gemini.
+    # IMAGE_PREPROCESS_CONFIG optionally points to a JSON file of per-domain overrides.
+    preprocess_defaults = PreprocessSettings(
+        crop=os.getenv("IMAGE_CROP", "focus"),
+        max_width=_env_int("IMAGE_MAX_WIDTH", 1280),
+        image_format=os.getenv("IMAGE_FORMAT", "JPEG").upper(),
+        quality=_env_int("IMAGE_QUALITY", 80),
+    )
+    preprocess_config_path = os.getenv("IMAGE_PREPROCESS_CONFIG")
+    if preprocess_config_path:
+        preprocessor = ImagePreprocessor.from_json_file(preprocess_config_path, preprocess_defaults)
+    else:
+        preprocessor = ImagePreprocessor(preprocess_defaults)
 
-    sheet_name = os.getenv("GOOGLE_SHEET_NAME")
-    if not sheet_name:
-        logger.info("FATAL: GOOGLE_SHEET_NAME not found in .env file.")
-        sys.exit(1)
+    # RESOURCE_BLOCKING_BLOCK lists categories (or URL patterns) to block; RESOURCE_BLOCKING_CONFIG
+    # optionally points to a JSON file of per-domain overrides.
+    resource_blocker = None
+    if resource_blocking:
+        blocked = os.getenv("RESOURCE_BLOCKING_BLOCK")
+        blocking_defaults = BlockingRules(
+            block=tuple(x.strip() for x in blocked.split(",") if x.strip())
+        ) if blocked else BlockingRules()
+        blocking_config_path = os.getenv("RESOURCE_BLOCKING_CONFIG")
+        if blocking_config_path:
+            resource_blocker = ResourceBlocker.from_json_file(blocking_config_path, blocking_defaults, resource_stats)
+        else:
+            resource_blocker = ResourceBlocker(blocking_defaults, collect_stats=resource_stats)
 
-    # By this point, Pylance KNOWS that each of these variables must be a string.
-    # The "None" timeline was terminated by sys.exit().
+    # Cached AI results per canonical product URL. A TTL of 0 disables the cache.
+    result_cache_ttl = _env_float("RESULT_CACHE_TTL_SECONDS", 24 * 3600)
+    result_cache = ResultCache(ttl_seconds=result_cache_ttl) if result_cache_ttl > 0 else None
+    if result_cache:
+        stack.callback(result_cache.close)
+
+    # Screenshots within PHASH_MAX_DISTANCE bits of a cached one reuse its result. -1 disables it.
+    phash_max_distance = _env_int("PHASH_MAX_DISTANCE", 6)
+    hash_cache = PerceptualHashCache(max_distance=phash_max_distance) if phash_max_distance >= 0 else None
+    if hash_cache:
+        stack.callback(hash_cache.close)
+        stack.callback(lambda: logger.info(f"Perceptual cache stats: {hash_cache.stats()}"))
+
+    # Screenshots reach the parser in memory. For debugging, captures are also kept in a
+    # deduplicated, size-capped store under logs/screenshots. SCREENSHOT_STORE_MB=0 disables it.
+    screenshot_store_mb = _env_int("SCREENSHOT_STORE_MB", 500)
+    screenshot_store = ScreenshotStore(
+        max_bytes=screenshot_store_mb * 1024 * 1024,
+        max_age_seconds=_env_float("SCREENSHOT_STORE_MAX_AGE_DAYS", 7) * 24 * 3600,
+        image_format=os.getenv("SCREENSHOT_STORE_FORMAT", "WEBP"),
+    ) if screenshot_store_mb > 0 else None
+    if screenshot_store:
+        stack.callback(screenshot_store.close)
+        stack.callback(lambda: logger.info(f"Screenshot store: {screenshot_store.stats()}"))
+
+    # One process-wide Gemini client (one keep-alive connection pool), behind a quota-aware governor.
+    gemini_governor = ApiGovernor(
+        "gemini",
+        requests_per_minute=_env_float("GEMINI_REQUESTS_PER_MINUTE", 15),
+        tokens_per_minute=_env_int("GEMINI_TOKENS_PER_MINUTE", 1_000_000),
+        tokens_per_call=_env_int("GEMINI_TOKENS_PER_CALL", 1500),
+        **_api_retry_options(),
+    )
 
     # --- Create a single config dictionary ---
     component_config = {
+        "fetcher_options": {
+            "driver_pool": driver_pool,
+            "readiness": readiness,
+            "preprocessor": preprocessor,
+            "resource_blocker": resource_blocker,
+        },
+        "result_cache": result_cache,
+        "screenshot_store": screenshot_store,
+        # Learned per-domain fetch mode (headless / pinned UA + stealth / headed). "0" disables it.
+        "fetch_strategy": DomainFetchStrategy(
+            reprobe_interval=_env_float("FETCH_STRATEGY_REPROBE_SECONDS", 24 * 3600),
+        ) if os.getenv("FETCH_STRATEGY", "1") != "0" else None,
+        # Pages with complete schema.org/OpenGraph markup skip the browser and LLM. "0" disables it.
+        "html_fetcher": BasicHtmlFetcher() if os.getenv("STRUCTURED_DATA_FAST_PATH", "1") != "0" else None,
+        "parser_options": {
+            "hash_cache": hash_cache,
+            "client": genai.Client(api_key=ai_studio_key),
+            "governor": gemini_governor,
+        },
+        # Screenshots of one multi-URL message share a Gemini request. PARSE_BATCH_MAX_IMAGES=0 disables it.
+        "parse_batch": {
+            "max_images": _env_int("PARSE_BATCH_MAX_IMAGES", 10),
+            "max_wait": _env_float("PARSE_BATCH_WAIT_SECONDS", 3.0),
+        } if _env_int("PARSE_BATCH_MAX_IMAGES", 10) > 0 else None,
+        "writer_options": writer_options,
+        # The process's one sheet writer, if main already built it; otherwise the worker builds its own.
+        "writer": writer,
         "api_key": ai_studio_key,
-        "creds_path": sheets_creds_path,
-        "sheet_id": sheet_id,
-        "sheet_name": sheet_name,
+        **sheet_settings,
     }
 
-    # --- Assemble by passing CLASSES and CONFIG ---
-    logger.info("Assembling V4 components...")
-    work_queue = asyncio.Queue()
-    
+    # Workers per pipeline stage. The browser stage should match the Chrome pool size.
+    stage_concurrency = {
+        "fetch": _env_int("PIPELINE_FETCH_WORKERS", driver_pool_headless),
+        "parse": _env_int("PIPELINE_PARSE_WORKERS", 8),
+        "write": _env_int("PIPELINE_WRITE_IN_FLIGHT", 20),
+    }
+    # Enough jobs in flight to keep the browser and LLM stages busy at the same time.
+    max_concurrent_jobs = stage_concurrency["fetch"] + stage_concurrency["parse"]
+    # By default the scheduler starts there and resizes the limit at runtime from job latency,
+    # CPU load, free memory and error/CAPTCHA rates. CONCURRENCY_ADAPTIVE=0 keeps it fixed.
+    concurrency = AdaptiveConcurrency(
+        initial=max_concurrent_jobs,
+        min_limit=_env_int("CONCURRENCY_MIN", 1),
+        max_limit=_env_int("CONCURRENCY_MAX", 2 * max_concurrent_jobs),
+        interval=_env_float("CONCURRENCY_INTERVAL_SECONDS", 15.0),
+        max_load_per_cpu=_env_float("CONCURRENCY_MAX_LOAD_PER_CPU", 0.9),
+        min_available_mb=_env_float("CONCURRENCY_MIN_FREE_MB", 1024),
+    ) if os.getenv("CONCURRENCY_ADAPTIVE", "1") != "0" else None
     worker = ProcessingWorker(
         fetcher_class=SeleniumFetcher,
         parser_class=GeminiImageParser,
-        writer_class=GoogleSheetWriter,
+        writer_class=writer_class,
         component_config=component_config,
-        max_concurrent_jobs=3
+        # The scheduler enforces the (possibly adaptive) limit; this is only the ceiling.
+        max_concurrent_jobs=concurrency.max_limit if concurrency else max_concurrent_jobs,
+        stage_concurrency=stage_concurrency,
+    )
+    # Write out any rows still sitting in the sheet writer's buffer.
+    stack.push_async_callback(worker.close)
+
+    # Per-host limits. SCHEDULER_HOST_LIMITS optionally overrides them per host as JSON,
+    # e.g. {"amazon.in": {"concurrency": 1, "rate_per_minute": 3}}.
+    # With several worker processes, each one applies these limits on its own.
+    default_limits = HostLimits(
+        concurrency=_env_int("SCHEDULER_HOST_CONCURRENCY", 1),
+        rate_per_minute=_env_float("SCHEDULER_HOST_RATE_PER_MINUTE", 6.0),
+        burst=_env_int("SCHEDULER_HOST_BURST", 2),
+    )
+    host_limits = {
+        host: replace(default_limits, **limits)
+        for host, limits in json.loads(os.getenv("SCHEDULER_HOST_LIMITS") or "{}").items()
+    }
+    return DomainScheduler(
+        run_job=partial(run_and_acknowledge, work_queue, worker),
+        max_concurrent_jobs=max_concurrent_jobs,
+        default_limits=default_limits,
+        host_limits=host_limits,
+        captcha_backoff_base=_env_float("SCHEDULER_CAPTCHA_BACKOFF_SECONDS", 60.0),
+        concurrency=concurrency,
+    )
+
+def build_rechecker(stack: AsyncExitStack, work_queue: DurableWorkQueue, writer) -> PriceRechecker:
+    """Background re-checks that keep the price and availability of rows already in the sheet current."""
+    from src.recheck import PriceRechecker, RecheckStore
+    store = RecheckStore()
+    stack.callback(store.close)
+    rechecker = PriceRechecker(
+        store,
+        writer,
+        work_queue,
+        min_interval=_env_float("RECHECK_MIN_HOURS", 6) * 3600,
+        max_interval=_env_float("RECHECK_MAX_HOURS", 168) * 3600,
+        sync_interval=_env_float("RECHECK_SYNC_MINUTES", 60) * 60,
+        batch_size=_env_int("RECHECK_BATCH_SIZE", 20),
+    )
+    stack.push_async_callback(rechecker.close)
+    return rechecker
+
+def open_durable_queue(stack: AsyncExitStack) -> DurableWorkQueue:
+    """A persistent queue: jobs survive restarts and are only removed once written."""
+    work_queue = DurableWorkQueue(
+        max_in_flight=_env_int("QUEUE_MAX_IN_FLIGHT", 20),
+        visibility_timeout=_env_float("QUEUE_VISIBILITY_TIMEOUT_SECONDS", 900.0),
+        max_attempts=_env_int("QUEUE_MAX_ATTEMPTS", 3),
+    )
+    stack.callback(work_queue.close)
+    stack.callback(lambda: logger.info(f"{work_queue.pending_count()} unfinished jobs stay queued for the next start."))
+    return work_queue
+
+async def main():
+    # --- Configuration and Secret Loading ---
+
+    # Build a path to the .env file inside the 'config' directory.
+    # os.path.dirname(__file__) gets the directory of the current script (our root).
+    # os.path.join() correctly combines them into a path like 'D:/.../product_scraper_bot/config/.env'.
+    project_root = os.path.dirname(__file__)
+    dotenv_path = os.path.join(project_root, 'config', '.env')
+
+    # Load the .env file from the specified path.
+    # Variables already set in the environment win, so ROLE etc. can differ per process.
+    load_dotenv(dotenv_path=dotenv_path)
+
+    # Set up logging configuration. LOG_LEVELS quiets chatty loggers, e.g. "src.worker=WARNING,discord=WARNING".
+    setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        logger_levels=parse_levels(os.getenv("LOG_LEVELS", "")),
+        json_format=os.getenv("LOG_FORMAT", "text").lower() == "json",
+        max_bytes=_env_int("LOG_MAX_MB", 20) * 1024 * 1024,
+        backup_count=_env_int("LOG_BACKUP_COUNT", 5),
+        rotate_when=os.getenv("LOG_ROTATE_WHEN") or None,
     )
-    
-    discord_reader = DiscordReader(bot_token=discord_token, work_queue=work_queue)
+
+    role = os.getenv("ROLE", "all").lower()
+    if role not in ROLES:
+        logger.info(f"FATAL: ROLE must be one of {', '.join(ROLES)}, not '{role}'.")
+        sys.exit(1)
+
+    # Each role only needs the secrets for the services it talks to.
+    discord_token = _required_env("DISCORD_BOT_TOKEN") if role != "worker" else None
+    ai_studio_key = _required_env("AI_STUDIO_API_KEY") if role != "broker" else None
+    sheets_creds_path: Optional[str] = None
+    sheet_settings = {"creds_path": None, "sheet_id": None, "sheet_name": None}
+    if role != "worker":
+        sheets_creds_path = _required_env("GOOGLE_SHEETS_CREDENTIALS_JSON_PATH")
+        sheet_settings = {
+            "creds_path": sheets_creds_path,
+            "sheet_id": _required_env("GOOGLE_SHEET_ID"),
+            "sheet_name": _required_env("GOOGLE_SHEET_NAME"),
+        }
+    broker_token = os.getenv("BROKER_TOKEN") or None
 
     # --- Start All Services ---
-    try:
-        logger.info("Starting all services...")
-        # Start the queue consumer in the background
-        consumer_task = asyncio.create_task(queue_consumer(work_queue, worker))
-        # Start the Discord bot in the foreground. This will run forever.
-        await discord_reader.start()
-    except KeyboardInterrupt:
-        logger.info("Shutdown signal received.")
-    finally:
-        logger.info("Application shutting down.")
-        # In a real app, you might have more cleanup here.
-        # For now, tasks will be cancelled when the program exits.
+    # Everything registers its own cleanup on the stack, which unwinds in reverse on shutdown.
+    tasks: list[asyncio.Task] = []
+    async with AsyncExitStack() as stack:
+        try:
+            logger.info(f"Assembling V4 components (role: {role})...")
+            # Local Prometheus endpoint (/metrics, /summary). METRICS_PORT=0 disables it.
+            # Worker processes sharing a host each need their own port.
+            metrics_port = _env_int("METRICS_PORT", 9108)
+            if metrics_port:
+                metrics_server = MetricsServer(host=os.getenv("METRICS_HOST", "127.0.0.1"), port=metrics_port)
+                await metrics_server.start()
+                stack.push_async_callback(metrics_server.stop)
+            # Periodic metrics summary in the log and in logs/metrics_summary.json.
+            tasks.append(asyncio.create_task(summary_reporter(_env_float("METRICS_SUMMARY_SECONDS", 60.0))))
+
+            if role == "worker":
+                from src.broker import RemoteWorkQueue
+                from src.writers import BrokerResultWriter
+                work_queue = RemoteWorkQueue(
+                    broker_url=_required_env("BROKER_URL"),
+                    token=broker_token,
+                    max_in_flight=_env_int("QUEUE_MAX_IN_FLIGHT", 20),
+                    heartbeat_interval=_env_float("BROKER_HEARTBEAT_SECONDS", 15.0),
+                )
+                stack.push_async_callback(work_queue.close)
+                # Finished rows go back to the broker, which owns the only sheet writer.
+                writer_class, writer_options = BrokerResultWriter, {"broker": work_queue}
+                writer = None
+            else:
+                from src.writers import GoogleSheetWriter
+                work_queue = open_durable_queue(stack)
+                writer_class, writer_options = GoogleSheetWriter, sheet_writer_options(stack, sheets_creds_path)
+                # The process's only sheet writer: the broker's for rows from every worker, or the
+                # ProcessingWorker's; the re-checker shares it, so there is one index and one flusher.
+                writer = GoogleSheetWriter(
+                    credentials_path=sheets_creds_path,
+                    spreadsheet_id=sheet_settings["sheet_id"],
+                    sheet_name=sheet_settings["sheet_name"],
+                    **writer_options,
+                )
+                stack.push_async_callback(writer.close)
+                # RECHECK=1 keeps the price and availability of rows already in the sheet current.
+                recheck = os.getenv("RECHECK", "0") != "0"
+                if role == "broker":
+                    from src.broker import BrokerServer
+                    broker = BrokerServer(
+                        work_queue,
+                        writer,
+                        host=os.getenv("BROKER_HOST", "127.0.0.1"),
+                        port=_env_int("BROKER_PORT", 8765),
+                        token=broker_token,
+                        lease_timeout=_env_float("BROKER_LEASE_SECONDS", 60.0),
+                    )
+                    await broker.start()
+                    stack.push_async_callback(broker.stop)
+
+                # Discord comes up first; messages land in the durable queue while the
+                # processing modules are still loading.
+                discord_reader = startup.load("src.discord_reader").DiscordReader(
+                    bot_token=discord_token, work_queue=work_queue
+                )
+                discord_task = asyncio.create_task(discord_reader.start())
+                tasks.append(discord_task)
+                if recheck:
+                    # Changed pages go on the work queue as re-check jobs for the workers.
+                    tasks.append(asyncio.create_task(build_rechecker(stack, work_queue, writer).run()))
+
+            if role != "broker":
+                # Selenium, google-genai and PIL load on a thread so the event loop keeps serving Discord.
+                await asyncio.to_thread(startup.preload)
+                scheduler = build_processing(
+                    stack, work_queue, ai_studio_key, writer_class, writer_options, sheet_settings, writer=writer
+                )
+                logger.info("Starting all services...")
+                # Start the queue consumer in the background
+                tasks.append(asyncio.create_task(scheduler.run()))
+                tasks.append(asyncio.create_task(queue_consumer(work_queue, scheduler)))
+            startup.mark("components_ready")
+
+            if role == "worker":
+                # No Discord here: pull jobs from the broker until stopped.
+                await asyncio.gather(*tasks)
+            else:
+                # The Discord bot runs in the foreground. This will run forever.
+                await discord_task
+        except KeyboardInterrupt:
+            logger.info("Shutdown signal received.")
+        finally:
+            logger.info("Application shutting down.")
+            for task in tasks:
+                task.cancel()
+            logger.info(f"Startup report: {startup.report()}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
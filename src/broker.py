@@ -0,0 +1,263 @@
+import os
+import hmac
+import time
+import socket
+import asyncio
+import logging
+import ipaddress
+from typing import Optional
+import aiohttp
+from aiohttp import web
+from .data_models import EnrichedProductInfo, JobOutcome, JobResult, WorkItem
+from .durable_queue import DurableWorkQueue
+from .interfaces import WriterInterface
+from .metrics import metrics
+from .startup import startup
+
+logger = logging.getLogger(__name__)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False # A hostname could resolve anywhere
+
+
+class BrokerServer:
+    """
+    Serves the durable work queue to worker processes over HTTP, so the
+    browsers can run in separate processes on this host or on others.
+
+    Workers lease one job at a time with a short lease and keep their leases
+    alive with heartbeats. A worker that stops heartbeating is presumed dead
+    and its jobs are handed out again. Their finished rows come back here and
+    go through this process's sheet writer, so there is still exactly one
+    writer batching rows into the sheet.
+
+    Endpoints (JSON bodies, all POST except /workers):
+        /lease      {"worker"}                      -> a job, or 204 after `long_poll` seconds
+        /complete   {"worker", "job_id", "outcome"}
+        /heartbeat  {"worker", "job_ids"}
+        /results    {"worker", "record", "update"}  -> {"ok": bool} once the row is in the sheet
+        /workers                                    -> every known worker and its leases
+    """
+    def __init__(
+        self,
+        work_queue: DurableWorkQueue,
+        writer: WriterInterface,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        token: Optional[str] = None,
+        lease_timeout: float = 60.0,
+        long_poll: float = 20.0,
+        poll_interval: float = 1.0,
+    ):
+        if not token and not _is_loopback(host):
+            # Anyone who can reach the port could lease jobs or write rows into the sheet.
+            raise ValueError(f"The broker needs a token to listen on {host}; set BROKER_TOKEN or bind to 127.0.0.1.")
+        self._queue = work_queue
+        self._writer = writer
+        self._host = host
+        self._port = port
+        self._token = token
+        self._lease_timeout = lease_timeout
+        self._long_poll = long_poll
+        self._poll_interval = poll_interval
+        self._runner: Optional[web.AppRunner] = None
+        self._reaper: Optional[asyncio.Task] = None
+        # worker id -> {"last_seen": monotonic time, "jobs": set of leased job ids}
+        self._workers: dict[str, dict] = {}
+
+    async def start(self):
+        app = web.Application(middlewares=[self._authenticate])
+        app.router.add_post("/lease", self._lease)
+        app.router.add_post("/complete", self._complete)
+        app.router.add_post("/heartbeat", self._heartbeat)
+        app.router.add_post("/results", self._results)
+        app.router.add_get("/workers", self._list_workers)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        self._reaper = asyncio.create_task(self._reap_dead_workers())
+        logger.info(
+            f"Broker listening on http://{self._host}:{self._port} "
+            f"(lease {self._lease_timeout:.0f}s, {'token required' if self._token else 'no token'})."
+        )
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _authenticate(self, request: web.Request, handler):
+        expected = f"Bearer {self._token}".encode()
+        if self._token and not hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    def _seen(self, worker_id: str) -> dict:
+        worker = self._workers.get(worker_id)
+        if worker is None:
+            logger.info(f"Worker {worker_id} connected.")
+            worker = self._workers[worker_id] = {"last_seen": 0.0, "jobs": set()}
+        worker["last_seen"] = time.monotonic()
+        return worker
+
+    async def _lease(self, request: web.Request) -> web.Response:
+        worker_id = (await request.json())["worker"]
+        deadline = time.monotonic() + self._long_poll
+        while True:
+            worker = self._seen(worker_id)
+            item = await self._queue.lease(worker_id, self._lease_timeout)
+            if item is not None:
+                worker["jobs"].add(item.job_id)
+                metrics.inc("broker_leases_total")
+                logger.info(f"Leased job {item.job_id} ({item.url}) to {worker_id}.")
+                return web.json_response({
+                    "job_id": item.job_id, "url": item.url, "message_content": item.message_content,
+                    "user_name": item.user_name, "enqueued_at": item.enqueued_at,
+                    "batch_id": item.batch_id, "batch_size": item.batch_size, "recheck": item.recheck,
+                })
+            if time.monotonic() >= deadline:
+                return web.Response(status=204)
+            await asyncio.sleep(self._poll_interval)
+
+    async def _complete(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        worker = self._seen(body["worker"])
+        worker["jobs"].discard(body["job_id"])
+        await self._queue.settle(body["job_id"], JobResult(outcome=JobOutcome(body["outcome"])), body["worker"])
+        startup.mark("first_job_completed")
+        return web.json_response({})
+
+    async def _heartbeat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._seen(body["worker"])
+        extended = await self._queue.extend_leases(body["worker"], body["job_ids"], self._lease_timeout)
+        return web.json_response({"extended": extended})
+
+    async def _results(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._seen(body["worker"])
+        record = EnrichedProductInfo.model_validate(body["record"])
+        # Re-checks overwrite the product's existing row instead of appending one.
+        ok = await (self._writer.update(record) if body.get("update") else self._writer.write(record))
+        return web.json_response({"ok": ok})
+
+    async def _list_workers(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        return web.json_response({
+            worker_id: {"seconds_since_heartbeat": round(now - worker["last_seen"], 1), "jobs": sorted(worker["jobs"])}
+            for worker_id, worker in self._workers.items()
+        })
+
+    async def _reap_dead_workers(self):
+        """Releases the leases of workers that missed their heartbeats for a whole lease period."""
+        while True:
+            await asyncio.sleep(self._lease_timeout / 2)
+            now = time.monotonic()
+            for worker_id, worker in list(self._workers.items()):
+                if now - worker["last_seen"] < self._lease_timeout:
+                    continue
+                released = await self._queue.release_worker(worker_id)
+                del self._workers[worker_id]
+                metrics.inc("broker_dead_workers_total")
+                logger.warning(
+                    f"Worker {worker_id} stopped heartbeating {now - worker['last_seen']:.0f}s ago. "
+                    f"Handing its {released} leased jobs out again."
+                )
+
+
+class RemoteWorkQueue:
+    """
+    The worker-process side of the broker. It has the same get()/complete()
+    shape as DurableWorkQueue, so queue_consumer and the scheduler work
+    unchanged. At most `max_in_flight` jobs are leased at a time, and a
+    background task heartbeats every lease this process holds.
+    """
+    def __init__(
+        self,
+        broker_url: str,
+        token: Optional[str] = None,
+        worker_id: Optional[str] = None,
+        max_in_flight: int = 10,
+        heartbeat_interval: float = 15.0,
+        retry_interval: float = 5.0,
+    ):
+        self._url = broker_url.rstrip("/")
+        self._headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._window = asyncio.Semaphore(max_in_flight)
+        self._heartbeat_interval = heartbeat_interval
+        self._retry_interval = retry_interval
+        self._held: set[int] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        logger.info(f"RemoteWorkQueue: worker {self.worker_id} pulling from {self._url} (max_in_flight={max_in_flight}).")
+
+    async def get(self) -> WorkItem:
+        """Waits for a free slot, then leases the next job from the broker (retrying while it is unreachable)."""
+        await self._window.acquire()
+        try:
+            while True:
+                try:
+                    job = await self._post("/lease", {})
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f"Broker unreachable ({e}). Retrying in {self._retry_interval:.0f}s.")
+                    await asyncio.sleep(self._retry_interval)
+                    continue
+                if job:
+                    self._held.add(job["job_id"])
+                    return WorkItem(**job)
+        except BaseException:
+            self._window.release()
+            raise
+
+    async def complete(self, item: WorkItem, result: JobResult):
+        """Reports the outcome. If the broker can't be told, the lease simply expires and the job runs again."""
+        try:
+            await self._post("/complete", {"job_id": item.job_id, "outcome": result.outcome.value})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Could not report job {item.job_id} to the broker ({e}). Its lease will expire.")
+        finally:
+            self._held.discard(item.job_id)
+            self._window.release()
+
+    async def write_result(self, record: EnrichedProductInfo, update: bool = False) -> bool:
+        """Sends a finished row to the broker's sheet writer and waits until it is written (or updated in place)."""
+        try:
+            response = await self._post("/results", {"record": record.model_dump(mode="json"), "update": update})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Could not hand the row for {record.source_url} to the broker: {e}")
+            return False
+        return bool(response and response.get("ok"))
+
+    def pending_count(self) -> int:
+        return len(self._held)
+
+    async def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+    async def _post(self, path: str, body: dict) -> Optional[dict]:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(headers=self._headers)
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        async with self._session.post(f"{self._url}{path}", json={"worker": self.worker_id, **body}) as response:
+            response.raise_for_status()
+            return None if response.status == 204 else await response.json()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            try:
+                await self._post("/heartbeat", {"job_ids": sorted(self._held)})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Heartbeat to the broker failed: {e}")
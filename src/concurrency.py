@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+from typing import Optional
+from .data_models import JobOutcome, JobResult
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def available_memory_mb() -> Optional[float]:
+    """MemAvailable from /proc/meminfo, or None where it can't be read. Linux only."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def load_per_cpu() -> Optional[float]:
+    """The one-minute load average divided by the number of CPUs, or None where it isn't available."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+
+class AdaptiveConcurrency:
+    """
+    Finds how many jobs this machine should run at once, instead of a fixed
+    number. Every `interval` seconds it looks at the jobs finished since the
+    last look and adjusts the limit AIMD style:
+
+    * cut it by `decrease_factor` when memory runs low, the CPUs are
+      overloaded, too many jobs fail or hit CAPTCHAs, or browser latency has
+      grown to `latency_tolerance` times its best recent level (work is
+      queueing rather than getting done);
+    * otherwise add one, but only if the limit was actually what held jobs
+      back.
+
+    Latency is judged on the screenshot + LLM tier alone: jobs answered from a
+    cache or from page markup take a fraction of a second and say nothing
+    about how loaded the browsers are. The best latency drifts toward the
+    current one by `best_latency_decay` per window, so one unusually fast
+    window can't pin the limit down.
+
+    The limit always stays within [min_limit, max_limit]. Every change is logged.
+    """
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        interval: float = 15.0,
+        min_samples: int = 3,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 2.0,
+        best_latency_decay: float = 0.3,
+        max_load_per_cpu: float = 0.9,
+        min_available_mb: float = 1024.0,
+        max_error_rate: float = 0.25,
+        max_captcha_rate: float = 0.25,
+    ):
+        if min_limit < 1 or max_limit < min_limit:
+            raise ValueError(f"Invalid concurrency bounds [{min_limit}, {max_limit}].")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(max_limit, initial))
+        self._interval = interval
+        self._min_samples = min_samples
+        self._decrease_factor = decrease_factor
+        self._latency_tolerance = latency_tolerance
+        self._best_latency_decay = best_latency_decay
+        self._max_load_per_cpu = max_load_per_cpu
+        self._min_available_mb = min_available_mb
+        self._max_error_rate = max_error_rate
+        self._max_captcha_rate = max_captcha_rate
+
+        # Jobs finished since the last adjustment: [count, failed, captcha, browser jobs, browser seconds].
+        self._window = [0, 0, 0, 0, 0.0]
+        self._saturated = False
+        self._last_adjusted = time.monotonic()
+        # Average browser latency per window, and the best one seen lately (drifts toward
+        # the current one so a site that got permanently slower doesn't pin the limit down).
+        self._latency: Optional[float] = None
+        self._best_latency: Optional[float] = None
+        logger.info(f"AdaptiveConcurrency initialized (limit {self.limit}, bounds [{min_limit}, {max_limit}]).")
+
+    def mark_saturated(self):
+        """Called by the scheduler when a job was ready to run but the limit held it back."""
+        self._saturated = True
+
+    def record(self, result: Optional[JobResult], seconds: float):
+        """
+        Feeds in one finished job (result None if it raised) and adjusts the
+        limit when the interval is up. Only the job's browser time counts
+        toward latency; `seconds` is used for jobs that raised.
+        """
+        self._window[0] += 1
+        if result is None or result.outcome != JobOutcome.SUCCESS:
+            self._window[1] += 1
+        if result is not None and result.captcha_seen:
+            self._window[2] += 1
+        browser_seconds = seconds if result is None else result.browser_seconds
+        if browser_seconds is not None:
+            self._window[3] += 1
+            self._window[4] += browser_seconds
+        if time.monotonic() - self._last_adjusted >= self._interval and self._window[0] >= self._min_samples:
+            self._adjust()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "latency": round(self._latency, 2) if self._latency is not None else None,
+            "best_latency": round(self._best_latency, 2) if self._best_latency is not None else None,
+        }
+
+    def _adjust(self):
+        jobs, failed, captchas, browser_jobs, browser_seconds = self._window
+        self._window = [0, 0, 0, 0, 0.0]
+        saturated, self._saturated = self._saturated, False
+        self._last_adjusted = time.monotonic()
+
+        # A window of cache hits only leaves the latency figures as they were.
+        latency = browser_seconds / browser_jobs if browser_jobs >= self._min_samples else None
+        if latency is not None:
+            self._latency = latency
+            if self._best_latency is None or latency < self._best_latency:
+                self._best_latency = latency
+            else:
+                self._best_latency += (latency - self._best_latency) * self._best_latency_decay
+
+        reasons = []
+        memory = available_memory_mb()
+        if memory is not None and memory < self._min_available_mb:
+            reasons.append(f"{memory:.0f} MB memory available")
+        load = load_per_cpu()
+        if load is not None and load > self._max_load_per_cpu:
+            reasons.append(f"load {load:.2f} per CPU")
+        if failed / jobs > self._max_error_rate:
+            reasons.append(f"{failed}/{jobs} jobs failed")
+        if captchas / jobs > self._max_captcha_rate:
+            reasons.append(f"{captchas}/{jobs} jobs hit CAPTCHAs")
+        if latency is not None and latency > self._best_latency * self._latency_tolerance:
+            reasons.append(f"latency {self._latency:.1f}s vs best {self._best_latency:.1f}s")
+
+        if reasons:
+            new_limit = max(self.min_limit, int(self.limit * self._decrease_factor))
+        elif saturated:
+            new_limit = min(self.max_limit, self.limit + 1)
+        else:
+            return
+        if new_limit == self.limit:
+            return
+        direction = "up" if new_limit > self.limit else "down"
+        metrics.inc("concurrency_changes_total", direction=direction)
+        logger.info(
+            f"Concurrency limit {self.limit} -> {new_limit} "
+            f"({'; '.join(reasons) if reasons else 'jobs were waiting on the limit'}; "
+            f"{jobs} jobs, {browser_jobs} in the browser{f', {latency:.1f}s average' if latency is not None else ''})."
+        )
+        self.limit = new_limit
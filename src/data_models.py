@@ -1,4 +1,5 @@
 # src/data_models.py
+from enum import Enum
 from typing import Optional
 from pydantic import BaseModel, Field
 from dataclasses import dataclass
@@ -9,6 +10,59 @@ class WorkItem:
     url: str
     message_content: str
     user_name: str
+    # Set by the durable queue so the job can be acknowledged once it is done.
+    job_id: Optional[int] = None
+    # Unix time the item was first queued, for the queue-wait metric.
+    enqueued_at: Optional[float] = None
+    # Items queued from the same Discord message share a batch id, so their
+    # screenshots can be parsed together. batch_size is how many URLs it had.
+    batch_id: Optional[str] = None
+    batch_size: int = 1
+    # Set by the scheduler at dispatch: how many of the batch's jobs can be in flight
+    # together given their hosts' limits. None means unknown. Not persisted.
+    batch_capacity: Optional[int] = None
+    # A background re-check of a row already in the sheet: skips the result cache
+    # and overwrites that row instead of appending a new one.
+    recheck: bool = False
+
+class JobOutcome(str, Enum):
+    """How a single job ended."""
+    SUCCESS = "success"
+    FETCH_FAILED = "fetch_failed"
+    PARSE_FAILED = "parse_failed"
+    WRITE_FAILED = "write_failed"
+    ERROR = "error"
+
+@dataclass
+class JobResult:
+    """What the worker reports back to whoever scheduled the job."""
+    outcome: JobOutcome
+    # True if any attempt hit a CAPTCHA, even if the headed retry got through.
+    captcha_seen: bool = False
+    # Seconds spent in the screenshot + LLM tier, None if the job never needed it (cache or markup hit).
+    browser_seconds: Optional[float] = None
+
+@dataclass
+class FetchResult:
+    """A browser capture handed straight from the fetcher to the parser, without a temp file."""
+    url: str
+    image: bytes
+    mime_type: str
+
+@dataclass(frozen=True)
+class FetchMode:
+    """How the browser is configured for one fetch."""
+    headless: bool = True
+    # Pinned User-Agent for this fetch. None keeps the driver's own random one.
+    user_agent: Optional[str] = None
+    # Extra fingerprint patches on top of the pool's default stealth script.
+    stealth: bool = False
+
+    @property
+    def key(self) -> str:
+        """Stable name for this mode, used in the persisted strategy table."""
+        ua = "ua:" + (self.user_agent or "default")
+        return f"{'headless' if self.headless else 'headed'}|{ua}|{'stealth' if self.stealth else 'plain'}"
 
 # MODEL 1: The AI's responsibility. This is the schema we send to Gemini.
 class AiProductInfo(BaseModel):
@@ -32,4 +86,6 @@ class EnrichedProductInfo(BaseModel):
     # Data from our trusted local context
     processed_timestamp: str
     requesting_user: str
-    source_url: str
\ No newline at end of file
+    source_url: str
+    # The queue's id for the request, so a redelivered job isn't counted into its row twice.
+    job_id: Optional[int] = None
\ No newline at end of file
@@ -1,8 +1,9 @@
 import discord
-import asyncio
 import logging
 from urllib.parse import urlparse
 from .data_models import WorkItem
+from .durable_queue import DurableWorkQueue
+from .startup import startup
 
 logger = logging.getLogger(__name__)
 
@@ -11,7 +12,7 @@ class DiscordReader:
     This class is responsible for connecting to Discord, listening for messages,
     and delegating valid product links to the BotOrchestrator.
     """
-    def __init__(self, bot_token: str, work_queue: asyncio.Queue):
+    def __init__(self, bot_token: str, work_queue: DurableWorkQueue):
         if not bot_token:
             raise ValueError("Discord bot token cannot be empty.")
         
@@ -36,6 +37,7 @@ class DiscordReader:
     async def on_ready(self):
         """Called when the bot successfully connects to Discord."""
         logger.info(f'Bot logged in as {self._client.user}')
+        startup.mark("discord_ready")
 
     async def on_message(self, message: discord.Message):
         """Called every time a message is sent in a channel the bot can see."""
@@ -44,23 +46,30 @@ class DiscordReader:
             return
 
         # Simple URL extraction logic
+        urls = []
         for word in message.content.split():
             try:
                 result = urlparse(word)
                 # A simple check if it looks like a real URL
                 if all([result.scheme, result.netloc]):
-                    logger.info(f"Found URL: {word} from user {message.author}, adding to work queue.")
-                    # Create a complete WorkItem
-                    item = WorkItem(
-                        url=word,
-                        message_content=message.content,
-                        user_name=message.author.name
-                    )
+                    urls.append(word)
+            except ValueError:
+                continue # Not a valid URL, ignore
 
-                    # --- DEBUGGING LOG ---
-                    logger.info(f"Putting object of type {type(item).__name__} onto queue for URL: {item.url}")
+        # The URLs of one message form a batch, so their screenshots can be parsed together.
+        for url in urls:
+            logger.info(f"Found URL: {url} from user {message.author}, adding to work queue.")
+            # Create a complete WorkItem
+            item = WorkItem(
+                url=url,
+                message_content=message.content,
+                user_name=message.author.name,
+                batch_id=str(message.id) if len(urls) > 1 else None,
+                batch_size=len(urls),
+            )
 
-                    await self._queue.put(item)
-                    logger.info(f"Work item for {word} added to queue.")
-            except ValueError:
-                continue # Not a valid URL, ignore
\ No newline at end of file
+            # --- DEBUGGING LOG ---
+            logger.debug(f"Putting object of type {type(item).__name__} onto queue for URL: {item.url}")
+
+            await self._queue.put(item)
+            logger.info(f"Work item for {url} added to queue.")
\ No newline at end of file
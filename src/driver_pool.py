@@ -0,0 +1,268 @@
+import os
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service as ChromeService
+from urllib.parse import urlparse
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
+]
+
+# Hides navigator.webdriver on every document the browser loads, not just the first one.
+STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+# Extra fingerprint patches, installed only for fetch modes that ask for stealth.
+EXTENDED_STEALTH_SCRIPT = """
+Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
+Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+window.chrome = window.chrome || {runtime: {}};
+const originalQuery = window.navigator.permissions && window.navigator.permissions.query;
+if (originalQuery) {
+    window.navigator.permissions.query = (parameters) => parameters.name === 'notifications'
+        ? Promise.resolve({state: Notification.permission})
+        : originalQuery(parameters);
+}
+"""
+
+
+class PooledDriver:
+    """Bookkeeping wrapper around one live Chrome instance."""
+    def __init__(self, driver: webdriver.Chrome, headless: bool):
+        self.driver = driver
+        self.headless = headless
+        self.uses = 0
+        self.created_at = time.monotonic()
+
+
+class ChromeDriverPool:
+    """
+    A bounded pool of long-lived Chrome drivers, split into headless and headed
+    sub-pools. Drivers are checked out for a single fetch, reset between uses,
+    health-checked on checkout and recycled after `max_uses` fetches or once
+    their process tree grows past `max_memory_mb`.
+
+    All methods are blocking and are meant to be called from the fetcher's
+    worker threads (inside asyncio.to_thread).
+    """
+    def __init__(
+        self,
+        max_headless: int = 2,
+        max_headed: int = 1,
+        max_uses: int = 50,
+        max_memory_mb: int = 1500,
+        checkout_timeout: float = 300.0,
+        performance_log: bool = False,
+    ):
+        if max_headless < 1 or max_headed < 1:
+            raise ValueError("Driver pool sizes must be at least 1.")
+        self._max_uses = max_uses
+        self._max_memory_mb = max_memory_mb
+        self._checkout_timeout = checkout_timeout
+        # Chrome's network events, read by the resource blocker for its per-fetch stats.
+        self._performance_log = performance_log
+        self._lock = threading.Lock()
+        # The semaphores bound how many drivers of each kind can exist at once.
+        self._slots = {
+            True: threading.BoundedSemaphore(max_headless),
+            False: threading.BoundedSemaphore(max_headed),
+        }
+        self._idle: dict[bool, list[PooledDriver]] = {True: [], False: []}
+        self._closed = False
+        logger.info(
+            f"ChromeDriverPool initialized (headless={max_headless}, headed={max_headed}, "
+            f"max_uses={max_uses}, max_memory_mb={max_memory_mb})."
+        )
+
+    @contextmanager
+    def checkout(self, headless: bool = True) -> Iterator[webdriver.Chrome]:
+        """Checks out a warm driver of the requested kind, launching one if none is idle."""
+        if self._closed:
+            raise RuntimeError("ChromeDriverPool is closed.")
+        mode = "HEADLESS" if headless else "HEADED"
+        if not self._slots[headless].acquire(timeout=self._checkout_timeout):
+            raise TimeoutError(f"Timed out waiting for a free {mode} Chrome driver.")
+
+        pooled: Optional[PooledDriver] = None
+        try:
+            pooled = self._take_idle(headless)
+            if pooled is None:
+                pooled = self._launch(headless)
+            else:
+                logger.info(f"Reusing warm {mode} Chrome driver (use #{pooled.uses + 1}).")
+            pooled.uses += 1
+            yield pooled.driver
+        finally:
+            if pooled is not None:
+                self._release(pooled)
+            self._slots[headless].release()
+
+    def close(self):
+        """Quits every idle driver. Drivers still checked out are quit when returned."""
+        with self._lock:
+            self._closed = True
+            idle = self._idle[True] + self._idle[False]
+            self._idle = {True: [], False: []}
+        for pooled in idle:
+            self._quit(pooled)
+        logger.info(f"ChromeDriverPool closed ({len(idle)} idle drivers shut down).")
+
+    # --- Internal helpers ---
+
+    def _take_idle(self, headless: bool) -> Optional[PooledDriver]:
+        while True:
+            with self._lock:
+                if not self._idle[headless]:
+                    return None
+                pooled = self._idle[headless].pop()
+            if self._is_healthy(pooled):
+                return pooled
+            logger.warning("Discarding unhealthy pooled Chrome driver.")
+            self._quit(pooled)
+
+    def _release(self, pooled: PooledDriver):
+        if self._closed:
+            self._quit(pooled)
+            return
+
+        if pooled.uses >= self._max_uses:
+            logger.info(f"Recycling Chrome driver after {pooled.uses} uses.")
+            self._quit(pooled)
+            return
+
+        memory_mb = self._memory_mb(pooled)
+        if memory_mb is not None and memory_mb > self._max_memory_mb:
+            logger.info(f"Recycling Chrome driver using {memory_mb:.0f} MB (ceiling {self._max_memory_mb} MB).")
+            self._quit(pooled)
+            return
+
+        try:
+            self._reset(pooled.driver)
+        except Exception as e:
+            logger.warning(f"Failed to reset Chrome driver, discarding it: {e}")
+            self._quit(pooled)
+            return
+
+        with self._lock:
+            self._idle[pooled.headless].append(pooled)
+
+    def _launch(self, headless: bool) -> PooledDriver:
+        mode = "HEADLESS" if headless else "HEADED"
+        logger.info(f"Launching new {mode} Chrome driver.")
+        with metrics.span("browser_launch"):
+            # Selenium Manager automatically handles the chromedriver.
+            driver = webdriver.Chrome(service=ChromeService(log_path=os.devnull), options=self._build_options(headless))
+            try:
+                driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": STEALTH_SCRIPT})
+            except Exception:
+                # Nobody else holds this driver yet, so its Chrome would be orphaned.
+                driver.quit()
+                raise
+        metrics.inc("browser_launches_total", mode="headless" if headless else "headed")
+        return PooledDriver(driver, headless)
+
+    def _build_options(self, headless: bool) -> Options:
+        chrome_options = Options()
+        if headless:
+            chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--window-size=1920,1080") # A standard desktop resolution
+
+        # --- STEALTH OPTIONS ---
+        chrome_options.add_argument(f'user-agent={random.choice(USER_AGENTS)}')
+        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+        chrome_options.add_experimental_option('useAutomationExtension', False)
+        # --- END STEALTH ---
+
+        # Silence Selenium DevTools logging. Both switches go in a single option,
+        # otherwise the second call overwrites the first.
+        chrome_options.add_argument("--log-level=3") # Only show fatal errors
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
+        if self._performance_log:
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        return chrome_options
+
+    @staticmethod
+    def _reset(driver: webdriver.Chrome):
+        """Returns a driver to a clean state: one tab, no cookies, no site storage."""
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        # Storage can only be cleared per origin, so clear the one we are still on.
+        parsed = urlparse(driver.current_url)
+        if parsed.scheme in ("http", "https"):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                "origin": f"{parsed.scheme}://{parsed.netloc}",
+                "storageTypes": "local_storage,session_storage,indexeddb,websql,service_workers,cache_storage",
+            })
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.get("about:blank")
+
+    @staticmethod
+    def _is_healthy(pooled: PooledDriver) -> bool:
+        try:
+            return pooled.driver.execute_script("return 1") == 1 and bool(pooled.driver.window_handles)
+        except Exception:
+            return False
+
+    @staticmethod
+    def _memory_mb(pooled: PooledDriver) -> Optional[float]:
+        """Resident memory of chromedriver and all its Chrome children, or None if unknown."""
+        try:
+            root_pid = pooled.driver.service.process.pid
+        except AttributeError:
+            return None
+        return process_tree_rss_mb(root_pid)
+
+    @staticmethod
+    def _quit(pooled: PooledDriver):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logger.warning(f"Error while quitting Chrome driver: {e}")
+
+
+def process_tree_rss_mb(root_pid: int) -> Optional[float]:
+    """Sums VmRSS over a process and its descendants using /proc. Linux only."""
+    if not os.path.isdir("/proc"):
+        return None
+
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name can contain spaces, so split after its closing paren.
+                fields = f.read().rsplit(")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total_kb = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024 if total_kb else None
@@ -0,0 +1,243 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional
+from .data_models import WorkItem, JobOutcome, JobResult
+
+logger = logging.getLogger(__name__)
+
+
+class DurableWorkQueue:
+    """
+    A persistent work queue backed by SQLite in WAL mode.
+
+    put() only writes to disk, so bursts don't grow memory. get() leases the
+    oldest pending item, but only while fewer than `max_in_flight` items are
+    leased, which gives the consumer natural backpressure. An item is removed
+    only when complete() reports success; failures go back to pending until
+    `max_attempts` is reached, waiting a little longer after each failure.
+    Leases older than `visibility_timeout` are treated as stuck and handed
+    out again, and on startup every item that was leased when the process
+    died is replayed. Items leased by get() and not completed yet (e.g.
+    still waiting in the scheduler) have their leases renewed in the
+    background, so only a dead process's leases ever expire.
+
+    In broker mode, remote workers lease through lease()/extend_leases()/
+    settle() instead of get()/complete(); their leases are short and kept
+    alive by heartbeats, and carry the worker's id.
+    """
+    def __init__(
+        self,
+        path: str = os.path.join("logs", "work_queue.sqlite3"),
+        max_in_flight: int = 20,
+        visibility_timeout: float = 900.0,
+        max_attempts: int = 3,
+        retry_delay: float = 60.0,
+        poll_interval: float = 1.0,
+        recover_on_start: bool = True,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._visibility_timeout = visibility_timeout
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._poll_interval = poll_interval
+        self._window = asyncio.Semaphore(max_in_flight)
+        self._new_work = asyncio.Event()
+        self._lock = threading.Lock()
+        # Job ids leased by get() and not completed yet, kept alive by the heartbeat.
+        self._held: set[int] = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, message_content TEXT NOT NULL, "
+            "user_name TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            "visible_at REAL, created_at REAL NOT NULL, last_error TEXT, leased_by TEXT, "
+            "batch_id TEXT, batch_size INTEGER NOT NULL DEFAULT 1, recheck INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "leased_by" not in columns: # Queues created before broker mode
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN leased_by TEXT")
+        if "batch_id" not in columns: # Queues created before multi-URL batches
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN batch_size INTEGER NOT NULL DEFAULT 1")
+        if "recheck" not in columns: # Queues created before price re-checks
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN recheck INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+        if recover_on_start:
+            recovered = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', visible_at = NULL, leased_by = NULL WHERE status = 'leased'"
+            ).rowcount
+            pending = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            if pending:
+                logger.info(f"DurableWorkQueue replaying {pending} unfinished jobs ({recovered} were in flight at shutdown).")
+        logger.info(f"DurableWorkQueue ready at {path} (max_in_flight={max_in_flight}).")
+
+    async def put(self, item: WorkItem):
+        """Persists a work item. Never blocks on the consumer."""
+        item.job_id = await asyncio.to_thread(self._blocking_put, item)
+        self._new_work.set()
+
+    async def get(self) -> WorkItem:
+        """Waits for a free slot in the in-flight window, then leases the next item."""
+        await self._window.acquire()
+        try:
+            while True:
+                self._new_work.clear()
+                item = await asyncio.to_thread(self._blocking_lease)
+                if item is not None:
+                    self._held.add(item.job_id)
+                    if self._heartbeat_task is None or self._heartbeat_task.done():
+                        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+                    return item
+                # Nothing ready; wake on a new put, or poll for expired leases.
+                try:
+                    await asyncio.wait_for(self._new_work.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._window.release()
+            raise
+
+    async def complete(self, item: WorkItem, result: JobResult):
+        """Acknowledges a leased item: removes it on success, otherwise schedules a retry."""
+        try:
+            if item.job_id is not None:
+                await self.settle(item.job_id, result)
+        finally:
+            self._held.discard(item.job_id)
+            self._window.release()
+            self._new_work.set()
+
+    # --- Broker mode: leases held by remote workers ---
+
+    async def lease(self, worker_id: str, lease_timeout: float) -> Optional[WorkItem]:
+        """Leases the next item to `worker_id` for `lease_timeout` seconds, or returns None. Ignores the in-flight window."""
+        return await asyncio.to_thread(self._blocking_lease, worker_id, lease_timeout)
+
+    async def extend_leases(self, worker_id: str, job_ids: list[int], lease_timeout: float) -> int:
+        """Heartbeat: pushes back the expiry of the given leases still held by `worker_id`. Returns how many."""
+        return await asyncio.to_thread(self._blocking_extend, worker_id, job_ids, lease_timeout)
+
+    async def release_worker(self, worker_id: str) -> int:
+        """Hands every lease held by `worker_id` (e.g. a dead worker) straight back out. Returns how many."""
+        return await asyncio.to_thread(self._blocking_release, worker_id)
+
+    async def settle(self, job_id: int, result: JobResult, worker_id: Optional[str] = None):
+        """
+        Removes a job on success, otherwise schedules a retry. With `worker_id`,
+        a failure is only recorded while that worker still holds the lease, so a
+        worker that was presumed dead can't undo someone else's attempt.
+        """
+        if result.outcome == JobOutcome.SUCCESS:
+            await asyncio.to_thread(self._blocking_ack, job_id)
+        else:
+            await asyncio.to_thread(self._blocking_nack, job_id, result.outcome.value, worker_id)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        with self._lock:
+            self._conn.close()
+
+    async def _heartbeat_loop(self):
+        """Renews the leases of held items well before they would expire."""
+        while True:
+            await asyncio.sleep(self._visibility_timeout / 3)
+            if self._held:
+                try:
+                    await asyncio.to_thread(self._blocking_extend, None, sorted(self._held), self._visibility_timeout)
+                except Exception as e:
+                    logger.warning(f"Could not renew {len(self._held)} leases: {e}")
+
+    # --- Blocking SQLite helpers (run in worker threads) ---
+
+    def _blocking_put(self, item: WorkItem) -> int:
+        item.enqueued_at = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (url, message_content, user_name, created_at, batch_id, batch_size, recheck) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (item.url, item.message_content, item.user_name, item.enqueued_at, item.batch_id, item.batch_size, int(item.recheck)),
+            )
+            return cursor.lastrowid
+
+    def _blocking_lease(self, worker_id: Optional[str] = None, lease_timeout: Optional[float] = None) -> Optional[WorkItem]:
+        now = time.time()
+        lease_timeout = self._visibility_timeout if lease_timeout is None else lease_timeout
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, url, message_content, user_name, status, created_at, batch_id, batch_size, recheck FROM jobs "
+                    "WHERE status IN ('pending', 'leased') AND (visible_at IS NULL OR visible_at <= ?) ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, url, message_content, user_name, status, created_at, batch_id, batch_size, recheck = row
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'leased', visible_at = ?, leased_by = ? WHERE id = ?",
+                    (now + lease_timeout, worker_id, job_id),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if status == "leased":
+            logger.warning(f"Lease for job {job_id} ({url}) expired. Handing it out again.")
+        return WorkItem(
+            url=url, message_content=message_content, user_name=user_name, job_id=job_id,
+            enqueued_at=created_at, batch_id=batch_id, batch_size=batch_size, recheck=bool(recheck),
+        )
+
+    def _blocking_ack(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _blocking_extend(self, worker_id: Optional[str], job_ids: list[int], lease_timeout: float) -> int:
+        if not job_ids:
+            return 0
+        placeholders = ", ".join("?" * len(job_ids))
+        with self._lock:
+            return self._conn.execute(
+                f"UPDATE jobs SET visible_at = ? WHERE status = 'leased' AND leased_by IS ? AND id IN ({placeholders})",
+                (time.time() + lease_timeout, worker_id, *job_ids),
+            ).rowcount
+
+    def _blocking_release(self, worker_id: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'pending', visible_at = NULL, leased_by = NULL WHERE status = 'leased' AND leased_by = ?",
+                (worker_id,),
+            ).rowcount
+
+    def _blocking_nack(self, job_id: int, error: str, worker_id: Optional[str] = None):
+        with self._lock:
+            # Retries back off linearly: 1x, 2x, ... retry_delay after each failure.
+            updated = self._conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, last_error = ?, visible_at = ? + (attempts + 1) * ?, leased_by = NULL, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ? AND (? IS NULL OR leased_by = ?)",
+                (error, time.time(), self._retry_delay, self._max_attempts, job_id, worker_id, worker_id),
+            ).rowcount
+            if not updated:
+                logger.warning(f"Ignoring a stale failure report for job {job_id} from {worker_id}; its lease has moved on.")
+                return
+            status = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if status and status[0] == "failed":
+            logger.error(f"Job {job_id} failed {self._max_attempts} times ({error}). Giving up on it.")
+        else:
+            logger.warning(f"Job {job_id} ended with {error}. It will be retried.")
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Optional
+from .data_models import FetchMode
+from .driver_pool import USER_AGENTS
+
+logger = logging.getLogger(__name__)
+
+# Candidate modes, cheapest first. Headed Chrome is the most expensive (and scarcest) option.
+FETCH_MODES = (
+    FetchMode(headless=True),
+    FetchMode(headless=True, user_agent=USER_AGENTS[1], stealth=True),
+    FetchMode(headless=False),
+)
+
+# Success rate assumed for a mode that has never been tried on a domain.
+UNTRIED_SUCCESS_RATE = 0.5
+
+
+class DomainFetchStrategy:
+    """
+    Learns, per domain, which fetch mode gets past bot checks. Every attempt
+    records whether the page came back as a CAPTCHA, as an exponentially
+    weighted success rate per (domain, mode), persisted to a small JSON file.
+
+    New jobs start in the mode most likely to succeed (the cheapest one on a
+    tie). A cheaper mode that lost out is re-probed once it has not been tried
+    for `reprobe_interval` seconds, so a site that stops blocking headless
+    Chrome gets the cheap path back.
+    """
+    def __init__(
+        self,
+        path: Optional[str] = os.path.join("logs", "fetch_strategy.json"),
+        modes: tuple[FetchMode, ...] = FETCH_MODES,
+        alpha: float = 0.3,
+        reprobe_interval: float = 24 * 3600,
+    ):
+        self._path = path
+        self._modes = modes
+        self._alpha = alpha
+        self._reprobe_interval = reprobe_interval
+        self._lock = threading.Lock()
+        # Serializes file writes, which run in threads.
+        self._save_lock = threading.Lock()
+        # domain -> mode key -> {"success_rate", "attempts", "last_tried"}
+        self._table: dict[str, dict[str, dict]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._table = json.load(f)
+                logger.info(f"Loaded fetch strategies for {len(self._table)} domains.")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load fetch strategies from {path}: {e}")
+
+    def choose(self, domain: str) -> FetchMode:
+        """The mode a new job for `domain` should start in."""
+        with self._lock:
+            stats = self._table.get(domain, {})
+            best = max(self._modes, key=lambda mode: (self._rate(stats, mode), -self._modes.index(mode)))
+            # Occasionally give a cheaper mode another chance.
+            now = time.time()
+            for mode in self._modes[: self._modes.index(best)]:
+                entry = stats.get(mode.key)
+                if entry and now - entry["last_tried"] >= self._reprobe_interval:
+                    # Claim the probe so concurrent jobs for this domain don't all take it.
+                    entry["last_tried"] = now
+                    logger.info(f"Re-probing {domain} with {mode.key} (current best {best.key}).")
+                    return mode
+        if best != self._modes[0]:
+            logger.info(f"Starting {domain} in learned fetch mode {best.key}.")
+        return best
+
+    def fallback(self, domain: str, failed: FetchMode) -> Optional[FetchMode]:
+        """The mode to retry in after `failed` hit a CAPTCHA, or None if nothing else is left."""
+        with self._lock:
+            stats = self._table.get(domain, {})
+            remaining = [mode for mode in self._modes if mode != failed]
+            if not remaining:
+                return None
+            # After a CAPTCHA, prefer the more robust (more expensive) mode on a tie.
+            return max(remaining, key=lambda mode: (self._rate(stats, mode), self._modes.index(mode)))
+
+    async def record(self, domain: str, mode: FetchMode, captcha: bool):
+        """Records the outcome of one fetch in `mode`. The table is saved in a thread, off the event loop."""
+        outcome = 0.0 if captcha else 1.0
+        with self._lock:
+            entry = self._table.setdefault(domain, {}).get(mode.key)
+            if entry is None:
+                entry = {"success_rate": outcome, "attempts": 0}
+                self._table[domain][mode.key] = entry
+            else:
+                entry["success_rate"] = round(self._alpha * outcome + (1 - self._alpha) * entry["success_rate"], 3)
+            entry["attempts"] += 1
+            entry["last_tried"] = time.time()
+        if self._path:
+            await asyncio.to_thread(self._save)
+
+    def _save(self):
+        with self._save_lock:
+            # Snapshot inside the save lock so the last write to land is also the newest.
+            with self._lock:
+                snapshot = json.dumps(self._table, indent=2, sort_keys=True)
+            try:
+                tmp_path = f"{self._path}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(snapshot)
+                os.replace(tmp_path, self._path)
+            except OSError as e:
+                logger.warning(f"Could not persist fetch strategies to {self._path}: {e}")
+
+    @staticmethod
+    def _rate(stats: dict[str, dict], mode: FetchMode) -> float:
+        entry = stats.get(mode.key)
+        return entry["success_rate"] if entry else UNTRIED_SUCCESS_RATE
@@ -1,146 +1,169 @@
-import requests
-import time
-import os
 import asyncio
 import logging
-import re
 import random
-from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service as ChromeService
+import aiohttp
+from contextlib import contextmanager
+from typing import Iterator, Optional
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from .data_models import FetchMode, FetchResult
 from .interfaces import FetcherInterface
+from .driver_pool import ChromeDriverPool, EXTENDED_STEALTH_SCRIPT, USER_AGENTS
+from .readiness import PageReadinessWaiter
+from .image_preprocessing import ImagePreprocessor
+from .resource_blocking import ResourceBlocker
+from .metrics import metrics
 
 # Each module should get its own logger instance.
 logger = logging.getLogger(__name__)
 
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
-]
-
-# The BasicHtmlFetcher is deprecated in favor of SeleniumFetcher and needs to be adapted to be async before using it in the future.
 class BasicHtmlFetcher(FetcherInterface):
-    async def fetch(self, url: str, headless: bool) -> str:
+    """
+    Fetches the raw HTML of a page over plain HTTP, without a browser.
+    It does not execute JavaScript, so it is only used as the cheap first tier
+    for reading structured product markup (JSON-LD, OpenGraph, microdata).
+    One aiohttp session is kept for connection reuse across jobs.
+    """
+    def __init__(self, timeout: float = 10.0):
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def fetch(self, url: str, headless: bool = True, mode: Optional[FetchMode] = None) -> str:
         """
-        Fetches the HTML content of a given URL using the requests library.
-        This is a simple fetcher that does not execute JavaScript.
+        Fetches the HTML content of a given URL. `headless` and `mode` are ignored.
+        Returns an empty string on failure.
         """
-        # We wrap the blocking requests call in asyncio.to_thread to avoid blocking the event loop.
-        return await asyncio.to_thread(self._blocking_fetch, url)
-    
-    def _blocking_fetch(self, url: str) -> str:
-        # This is a more convincing set of headers, mimicking a real browser on Windows.
+        # This is a more convincing set of headers, mimicking a real browser.
         headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-        'Connection': 'keep-alive'
+            'User-Agent': random.choice(USER_AGENTS),
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
         }
-        
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+
         try:
-            print(f"Fetching HTML from {url}...")
-            # We set a timeout to prevent our bot from hanging indefinitely on a slow website.
-            response = requests.get(url, headers=headers, timeout=10)
-            
-            # This is a critical line. It will automatically raise an exception if the
-            # website returns an error (e.g., 404 Not Found, 503 Service Unavailable).
-            response.raise_for_status()
-            
-            # If everything was successful, we return the page's HTML content.
-            return response.text
-        
-        # This will catch any network-related errors or the error from raise_for_status().
-        except requests.RequestException as e:
-            print(f"Error: Could not fetch URL {url}. Reason: {e}")
-            # We return an empty string to signal failure to the orchestrator.
-            # This is a predictable, safe value.
+            logger.info(f"Fetching HTML from {url}...")
+            with metrics.span("html_fetch"):
+                async with self._session.get(url, headers=headers) as response:
+                    # Raise on error statuses (e.g., 404 Not Found, 503 Service Unavailable).
+                    response.raise_for_status()
+                    return await response.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Could not fetch HTML for {url}: {e}")
+            # An empty string is a predictable, safe failure value for the orchestrator.
             return ""
 
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
 class SeleniumFetcher(FetcherInterface):
     """
     A fetcher that uses a real browser to load a page, take a screenshot,
-    and return the path to the screenshot file.
+    and hand the screenshot bytes to the parser in memory.
+    Browsers are borrowed from a shared ChromeDriverPool instead of being
+    launched and quit on every fetch. Keeping copies for debugging is up to
+    the worker's ScreenshotStore. An optional ResourceBlocker keeps ads,
+    trackers, media and the like out of the page load.
     """
-    def __init__(self):
-        self.screenshot_dir = os.path.join("logs", "screenshots")
-        os.makedirs(self.screenshot_dir, exist_ok=True)  # Ensure the directory exists
-        logger.info(f"Screenshots will be saved to: {self.screenshot_dir}")
+    def __init__(
+        self,
+        driver_pool: Optional[ChromeDriverPool] = None,
+        readiness: Optional[PageReadinessWaiter] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        resource_blocker: Optional[ResourceBlocker] = None,
+    ):
+        # A private pool keeps the fetcher usable on its own, but callers should share one.
+        self._pool = driver_pool or ChromeDriverPool()
+        self._readiness = readiness or PageReadinessWaiter()
+        # Without a preprocessor the raw PNG capture is handed to the parser.
+        self._preprocessor = preprocessor
+        # Without a blocker every page loads in full.
+        self._resource_blocker = resource_blocker
     
-    async def fetch(self, url: str, headless: bool = True) -> str:
+    async def fetch(self, url: str, headless: bool = True, mode: Optional[FetchMode] = None) -> FetchResult | str:
         """
         Asynchronously fetches a URL using Selenium.
         Cab be run in either headless (default) or headed mode.
+        A `mode` can also pin the User-Agent and add extra stealth patches.
+        Returns the capture as a FetchResult, or an empty string on failure.
         """
+        mode = mode or FetchMode(headless=headless)
         # We wrap the entire blocking selenium logic in asyncio.to_thread
-        return await asyncio.to_thread(self._blocking_fetch, url, headless)
+        return await asyncio.to_thread(self._blocking_fetch, url, mode)
     
-    def _blocking_fetch(self, url: str, headless: bool) -> str:
-        # Configure Chrome to run in "headless" mode (no visible UI)
-        chrome_options = Options()
-
-        if headless:
-            logger.info("Running Selenium in HEADLESS mode.")
-            chrome_options.add_argument("--headless")  # Run in headless mode
-        else:
-            logger.info("Running Selenium in HEADED mode.")
-
-        chrome_options.add_argument("--window-size=1920,1080") # A standard desktop resolution
-
-        # --- STEALTH OPTIONS ---
-        chrome_options.add_argument(f'user-agent={random.choice(USER_AGENTS)}')
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        # --- END STEALTH ---
-
-        # --- FIX: Silence Selenium DevTools logging ---
-        chrome_options.add_argument("--log-level=3") # Only show fatal errors
-        chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        service = ChromeService(log_path=os.devnull)
-
-        driver = None # Initialize to None
+    def _blocking_fetch(self, url: str, mode: FetchMode) -> FetchResult | str:
+        logger.info(f"Running Selenium in {'HEADLESS' if mode.headless else 'HEADED'} mode ({mode.key}).")
         try:
-            # Selenium Manager automatically handles the chromedriver. Magic!
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            # The pool resets the driver and takes it back (or recycles it) when we leave this block.
+            with self._pool.checkout(mode.headless) as driver, self._applied_mode(driver, mode), \
+                    self._blocked_resources(driver, url):
+                logger.info(f"StealthFetcher navigating to {url}")
+                with metrics.span("navigation"):
+                    driver.get(url)
+                    
+                    # --- INTELLIGENT WAIT ---
+                    # Wait up to 15 seconds for an element with the tag 'body' to be present.
+                    # This is much more reliable than time.sleep().
+                    WebDriverWait(driver, 15).until(
+                        EC.presence_of_element_located((By.TAG_NAME, "body"))
+                    )
+                # Then wait for the network and DOM to settle and the product details to render.
+                with metrics.span("readiness_wait"):
+                    readiness = self._readiness.wait(driver, url)
+                # --- END WAIT ---
 
-            logger.info(f"StealthFetcher navigating to {url}")
-            driver.get(url)
-            
-            # --- INTELLIGENT WAIT ---
-            # Wait up to 15 seconds for an element with the tag 'body' to be present.
-            # This is much more reliable than time.sleep().
-            WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            time.sleep(random.uniform(5, 8)) # A small, randomized sleep to mimic human pause
-            # --- END WAIT ---
-            
-            # --- NEW: Screenshot naming and logging ---
-            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            # Sanitize the URL to create a safe filename
-            sanitized_url = re.sub(r'https?://(www\.)?', '', url)
-            sanitized_url = re.sub(r'[\\/:*?"<>|]', '_', sanitized_url)[:75] # Keep it reasonably short
-            
-            filename = f"{timestamp}_{sanitized_url}.png"
-            screenshot_path = os.path.join(self.screenshot_dir, filename)
-            
-            driver.save_screenshot(screenshot_path)
-            logger.info(f"Screenshot saved to {screenshot_path}")
-            return screenshot_path
+                with metrics.span("screenshot"):
+                    screenshot = driver.get_screenshot_as_png()
+            # The driver is back in the pool here; image work shouldn't hold a browser.
+
+            # --- PREPROCESSING: crop, downscale and re-encode before the parser sees it ---
+            mime_type = "image/png"
+            if self._preprocessor:
+                with metrics.span("preprocess"):
+                    screenshot, _, mime_type = self._preprocessor.process(screenshot, url, readiness.focus_box)
+            return FetchResult(url=url, image=screenshot, mime_type=mime_type)
 
         except Exception as e:
             logger.error(f"Selenium failed to fetch {url}: {e}", exc_info=True)
+            metrics.inc("fetch_errors_total", mode="headless" if mode.headless else "headed")
             return "" # Return empty string on failure
-        
+
+    @contextmanager
+    def _blocked_resources(self, driver, url: str) -> Iterator[None]:
+        if self._resource_blocker is None:
+            yield
+            return
+        with self._resource_blocker.applied(driver, url):
+            yield
+
+    @staticmethod
+    @contextmanager
+    def _applied_mode(driver, mode: FetchMode) -> Iterator[None]:
+        """Applies the mode's UA override and stealth patches, and undoes them before the driver goes back."""
+        original_agent = None
+        stealth_id = None
+        try:
+            if mode.user_agent:
+                original_agent = driver.execute_script("return navigator.userAgent")
+                driver.execute_cdp_cmd("Network.setUserAgentOverride", {
+                    "userAgent": mode.user_agent,
+                    "acceptLanguage": "en-US,en;q=0.9",
+                })
+            if mode.stealth:
+                stealth_id = driver.execute_cdp_cmd(
+                    "Page.addScriptToEvaluateOnNewDocument", {"source": EXTENDED_STEALTH_SCRIPT}
+                )["identifier"]
+            yield
         finally:
-            # CRITICAL: Always close the browser to avoid memory leaks.
-            if driver:
-                driver.quit()
\ No newline at end of file
+            try:
+                if stealth_id is not None:
+                    driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument", {"identifier": stealth_id})
+                if original_agent is not None:
+                    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": original_agent})
+            except Exception as e:
+                # A half-configured driver must not be reused; once quit, the pool's reset fails and discards it.
+                logger.warning(f"Could not undo fetch mode {mode.key}, discarding the driver: {e}")
+                driver.quit()
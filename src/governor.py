@@ -0,0 +1,260 @@
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+import aiohttp
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, quota (429) and server-side trouble.
+TRANSIENT_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+# How long callers wait between checks while a half-open breaker's probe call is in flight.
+PROBE_POLL_SECONDS = 0.5
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Network trouble, or an API error whose HTTP status says trying again later may work."""
+    if isinstance(error, (TimeoutError, ConnectionError, aiohttp.ClientConnectionError)):
+        return True
+    # google-genai errors carry the HTTP status in `code`, SheetsApiError in `status`.
+    for attribute in ("code", "status"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status in TRANSIENT_STATUSES
+    return False
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """The server's requested delay: a `retry_after` attribute, or a Google RetryInfo detail like "27s"."""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            if str(detail.get("@type", "")).endswith("RetryInfo"):
+                match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+                if match:
+                    return float(match.group(1))
+    return None
+
+
+class MinuteQuota:
+    """Requests and tokens sent in the last 60 seconds, checked against per-minute limits."""
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[int] = None):
+        self._requests_per_minute = requests_per_minute
+        self._tokens_per_minute = tokens_per_minute
+        # [sent_at, tokens] per request; the token count is corrected once the real usage is known.
+        self._sent: deque[list] = deque()
+
+    def _expire(self, now: float):
+        while self._sent and self._sent[0][0] <= now - 60:
+            self._sent.popleft()
+
+    def usage(self) -> tuple[int, int]:
+        """(requests, tokens) in the last minute."""
+        self._expire(time.monotonic())
+        return len(self._sent), sum(tokens for _, tokens in self._sent)
+
+    def wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        self._expire(now)
+        wait = 0.0
+        if self._requests_per_minute and len(self._sent) >= self._requests_per_minute:
+            wait = self._sent[0][0] + 60 - now
+        if self._tokens_per_minute and self._sent:
+            # Wait until enough old requests drop out of the window to make room for this one.
+            excess = sum(t for _, t in self._sent) + tokens - self._tokens_per_minute
+            for sent_at, sent_tokens in self._sent:
+                if excess <= 0:
+                    break
+                excess -= sent_tokens
+                wait = max(wait, sent_at + 60 - now)
+        return max(0.0, wait)
+
+    def take(self, tokens: int) -> list:
+        entry = [time.monotonic(), tokens]
+        self._sent.append(entry)
+        return entry
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures and stays
+    open for a cooldown that doubles on each trip in a row (up to
+    `max_cooldown`). After the cooldown one probe call is let through: success
+    closes the breaker, failure opens it again.
+    """
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0):
+        self._threshold = failure_threshold
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._failures = 0
+        self._trips = 0
+        self._open_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if time.monotonic() < self._open_until:
+            return "open"
+        return "half_open" if self._trips else "closed"
+
+    def wait_time(self) -> float:
+        """How long until a call may go out (0 if now)."""
+        remaining = self._open_until - time.monotonic()
+        if remaining > 0:
+            return remaining
+        if self._trips and self.probing:
+            return PROBE_POLL_SECONDS
+        return 0.0
+
+    def record_success(self) -> bool:
+        """Returns True if this closed a tripped breaker."""
+        was_tripped = self._trips > 0
+        self._failures = 0
+        self._trips = 0
+        self.probing = False
+        return was_tripped
+
+    def record_failure(self) -> Optional[float]:
+        """Returns the cooldown if this failure opened the breaker."""
+        self.probing = False
+        if time.monotonic() < self._open_until:
+            return None # Calls that were already in flight when the breaker opened
+        self._failures += 1
+        # A failed probe re-opens straight away; otherwise wait for the threshold.
+        if self._trips == 0 and self._failures < self._threshold:
+            return None
+        cooldown = min(self._max_cooldown, self._cooldown * 2 ** self._trips)
+        self._trips += 1
+        self._failures = 0
+        self._open_until = time.monotonic() + cooldown
+        return cooldown
+
+
+class ApiGovernor:
+    """
+    Sits in front of one external API. Calls are held back so they stay
+    inside the configured requests/tokens per minute, transient failures are
+    retried with jittered exponential backoff (or the server's requested
+    delay), and a circuit breaker pauses every caller while the API keeps
+    failing, instead of letting each job fail on its own.
+
+    Waiting callers simply stay suspended, so a paused API backs up its
+    pipeline stage rather than producing failed rows.
+    """
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[int] = None,
+        tokens_per_call: int = 0,
+        max_attempts: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+        is_transient: Callable[[BaseException], bool] = is_transient_error,
+    ):
+        self.name = name
+        self._quota = MinuteQuota(requests_per_minute, tokens_per_minute)
+        self._breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        # Token estimate for the next call, learned from the usage the API reports.
+        self._tokens_per_call = float(tokens_per_call)
+        self._max_attempts = max(1, max_attempts)
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._is_transient = is_transient
+        logger.info(
+            f"ApiGovernor '{name}' initialized ({requests_per_minute or 'unlimited'} requests/min, "
+            f"{tokens_per_minute or 'unlimited'} tokens/min, {self._max_attempts} attempts)."
+        )
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args,
+        usage: Optional[Callable[[Any], Optional[int]]] = None,
+        units: int = 1,
+        **kwargs,
+    ) -> Any:
+        """
+        Awaits `func(*args, **kwargs)` under the quota and breaker, retrying
+        transient failures. `usage` may pull the real token count from the
+        result; `units` says how many calls' worth of tokens this one is
+        (e.g. images in one request). Non-transient errors, and the last
+        transient one, are raised.
+        """
+        attempt = 0
+        while True:
+            entry = await self._admit(units)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not self._is_transient(e):
+                    self._breaker.probing = False
+                    raise
+                attempt += 1
+                self._record_failure(e)
+                if attempt >= self._max_attempts:
+                    metrics.inc("api_gave_up_total", api=self.name)
+                    logger.error(f"{self.name}: giving up after {attempt} attempts: {e}")
+                    raise
+                delay = retry_after_of(e)
+                if delay is None:
+                    # "Full jitter": spreads retries out so callers don't come back in lockstep.
+                    delay = random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+                metrics.inc("api_retries_total", api=self.name)
+                logger.warning(f"{self.name}: transient error ({e}). Retry {attempt}/{self._max_attempts - 1} in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+
+            if self._breaker.record_success():
+                logger.info(f"{self.name}: call succeeded. Circuit breaker closed.")
+            tokens = usage(result) if usage else None
+            if tokens:
+                entry[1] = tokens
+                per_unit = tokens / max(1, units)
+                self._tokens_per_call = per_unit if not self._tokens_per_call else 0.8 * self._tokens_per_call + 0.2 * per_unit
+            return result
+
+    def stats(self) -> dict:
+        requests, tokens = self._quota.usage()
+        return {"breaker": self._breaker.state, "requests_last_minute": requests, "tokens_last_minute": tokens}
+
+    async def _admit(self, units: int = 1) -> list:
+        """Waits until the breaker and the quota allow one more call, then claims it."""
+        tokens = round(self._tokens_per_call * units)
+        waited = 0.0
+        while True:
+            breaker_wait = self._breaker.wait_time()
+            wait = breaker_wait or self._quota.wait_time(tokens)
+            if wait <= 0:
+                break
+            if not waited:
+                reason = "breaker" if breaker_wait else "quota"
+                metrics.inc("api_throttled_total", api=self.name, reason=reason)
+                requests, used = self._quota.usage()
+                logger.info(
+                    f"{self.name}: throttled by {reason}, waiting {wait:.1f}s "
+                    f"({requests} requests / {used} tokens in the last minute)."
+                )
+            waited += wait
+            await asyncio.sleep(wait)
+        if waited:
+            metrics.observe("api_throttle_seconds", waited, api=self.name)
+        if self._breaker.state == "half_open":
+            self._breaker.probing = True
+        return self._quota.take(tokens)
+
+    def _record_failure(self, error: BaseException):
+        cooldown = self._breaker.record_failure()
+        if cooldown is not None:
+            metrics.inc("api_breaker_trips_total", api=self.name)
+            logger.error(f"{self.name}: circuit breaker open after repeated failures ({error}). Pausing calls for {cooldown:.0f}s.")
@@ -0,0 +1,137 @@
+import io
+import json
+import time
+import logging
+import PIL.Image
+from dataclasses import dataclass, replace
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# File extension and MIME type for each output format we can encode.
+FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+    "PNG": ("png", "image/png"),
+}
+
+
+@dataclass(frozen=True)
+class PreprocessSettings:
+    """How a screenshot is prepared before it is sent to the LLM."""
+    # "none" keeps the whole capture, "fold" keeps the top `fold_height` pixels,
+    # "focus" keeps a padded band around the detected title/price (falling back to "fold").
+    crop: str = "focus"
+    fold_height: int = 1080
+    focus_padding: int = 350
+    # The focus band never shrinks below this fraction of the capture height,
+    # so the product image next to the title stays in frame.
+    focus_min_fraction: float = 0.6
+    max_width: int = 1280
+    image_format: str = "JPEG"
+    quality: int = 80
+
+
+class ImagePreprocessor:
+    """
+    Crops, downscales and re-encodes screenshots between fetch and parse.
+    Settings can be overridden per domain to trade accuracy against latency.
+    """
+    def __init__(
+        self,
+        default: Optional[PreprocessSettings] = None,
+        per_domain: Optional[dict[str, PreprocessSettings]] = None,
+    ):
+        self._default = default or PreprocessSettings()
+        self._per_domain = per_domain or {}
+        for settings in [self._default, *self._per_domain.values()]:
+            if settings.image_format not in FORMATS:
+                raise ValueError(f"Unsupported image format: {settings.image_format}")
+        logger.info(f"ImagePreprocessor initialized with {self._default} and {len(self._per_domain)} domain overrides.")
+
+    @classmethod
+    def from_json_file(cls, path: str, default: Optional[PreprocessSettings] = None) -> "ImagePreprocessor":
+        """Loads per-domain overrides, e.g. {"amazon.in": {"max_width": 1600, "quality": 85}}."""
+        default = default or PreprocessSettings()
+        with open(path) as f:
+            overrides = json.load(f)
+        per_domain = {domain.lower(): replace(default, **values) for domain, values in overrides.items()}
+        return cls(default, per_domain)
+
+    def settings_for(self, url: str) -> PreprocessSettings:
+        host = urlparse(url).netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        # "amazon.in" also matches subdomains such as "m.amazon.in".
+        for domain, settings in self._per_domain.items():
+            if host == domain or host.endswith(f".{domain}"):
+                return settings
+        return self._default
+
+    def process(
+        self,
+        image_bytes: bytes,
+        url: str,
+        focus_box: Optional[tuple[int, int, int, int]] = None,
+    ) -> tuple[bytes, str, str]:
+        """Returns the processed image bytes, its file extension and its MIME type."""
+        settings = self.settings_for(url)
+        start = time.perf_counter()
+
+        img = PIL.Image.open(io.BytesIO(image_bytes))
+        img.load()
+        original_size = img.size
+
+        crop_box = self._crop_box(img.size, settings, focus_box)
+        if crop_box is not None:
+            img = img.crop(crop_box)
+
+        if img.width > settings.max_width:
+            height = round(img.height * settings.max_width / img.width)
+            img = img.resize((settings.max_width, height), PIL.Image.Resampling.LANCZOS)
+
+        if settings.image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB") # JPEG has no alpha channel
+
+        out = io.BytesIO()
+        save_options = {} if settings.image_format == "PNG" else {"quality": settings.quality}
+        img.save(out, format=settings.image_format, **save_options)
+        data = out.getvalue()
+
+        extension, mime_type = FORMATS[settings.image_format]
+        logger.info(
+            f"Preprocessed screenshot for {urlparse(url).netloc}: {len(image_bytes)} -> {len(data)} bytes, "
+            f"{original_size[0]}x{original_size[1]} -> {img.width}x{img.height} {settings.image_format} "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms."
+        )
+        return data, extension, mime_type
+
+    @staticmethod
+    def _crop_box(
+        size: tuple[int, int],
+        settings: PreprocessSettings,
+        focus_box: Optional[tuple[int, int, int, int]],
+    ) -> Optional[tuple[int, int, int, int]]:
+        width, height = size
+        if settings.crop == "focus" and focus_box is not None:
+            # Product pages lay out image, title and buy box side by side, so the
+            # focus region is a full-width band around the title/price rows.
+            _, top, _, bottom = focus_box
+            top = max(0, top - settings.focus_padding)
+            bottom = min(height, bottom + settings.focus_padding)
+            top, bottom = _grow(top, bottom, int(height * settings.focus_min_fraction), height)
+            if bottom > top:
+                return 0, top, width, bottom
+
+        if settings.crop in ("fold", "focus") and height > settings.fold_height:
+            return 0, 0, width, settings.fold_height
+        return None
+
+
+def _grow(start: int, end: int, minimum: int, limit: int) -> tuple[int, int]:
+    """Widens [start, end) around its centre to at least `minimum`, staying within [0, limit)."""
+    if end - start >= minimum:
+        return start, end
+    start = min(max(0, (start + end - minimum) // 2), max(0, limit - minimum))
+    return start, min(limit, start + minimum)
@@ -1,20 +1,49 @@
+import asyncio
 from abc import ABC, abstractmethod
-from .data_models import AiProductInfo, EnrichedProductInfo # Import the new models
+from typing import Optional
+from .data_models import AiProductInfo, EnrichedProductInfo, FetchMode, FetchResult # Import the new models
 
 class FetcherInterface(ABC):
     @abstractmethod
-    async def fetch(self, url: str, headless: bool) -> str:
-        """Asynchronously fetches content and returns a path (for images) or the content itself (for HTML)."""
+    async def fetch(self, url: str, headless: bool, mode: Optional[FetchMode] = None) -> str | FetchResult:
+        """
+        Asynchronously fetches content. Browser fetchers return the screenshot in memory as a
+        FetchResult, HTML fetchers return the content itself. An empty string means failure.
+        Browser fetchers may honour `mode` (User-Agent, stealth); when given, its `headless` wins.
+        """
+        pass
+
+    async def close(self):
+        """Releases any resources held across fetches. Optional for simple fetchers."""
         pass
 
 class ParserInterface(ABC):
     @abstractmethod
-    async def parse(self, content_path_or_html: str, user_message: str) -> AiProductInfo:
-        """Asynchronously parses content (from a file path or a string) and returns structured data."""
+    async def parse(self, content: str | FetchResult, user_message: str, use_cache: bool = True) -> AiProductInfo:
+        """
+        Asynchronously parses content (an in-memory capture, a file path or a string) and returns structured data.
+        With `use_cache` False the parser must look at the content afresh, e.g. for a price re-check.
+        """
         pass
 
+    async def parse_many(self, contents: list[str | FetchResult], user_message: str) -> list[AiProductInfo]:
+        """Parses several captures from one message, in order. Parsers that can batch requests override this."""
+        return list(await asyncio.gather(*(self.parse(content, user_message) for content in contents)))
+
 class WriterInterface(ABC):
     @abstractmethod
-    async def write(self, data: EnrichedProductInfo):
-        """Asynchronously writes data to the destination."""
-        pass
\ No newline at end of file
+    async def write(self, data: EnrichedProductInfo) -> bool:
+        """Asynchronously writes data to the destination. Returns True if the record was stored."""
+        pass
+
+    async def update(self, data: EnrichedProductInfo) -> bool:
+        """Replaces the stored record for the same source URL. Writers that can't update in place just write."""
+        return await self.write(data)
+
+    async def find_fresh(self, url: str) -> Optional[AiProductInfo]:
+        """The product data already stored for this URL if it is recent enough to reuse. Most writers can't tell."""
+        return None
+
+    async def close(self):
+        """Flushes any buffered data and releases resources. Optional for simple writers."""
+        pass
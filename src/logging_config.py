@@ -1,31 +1,115 @@
-import logging
 import os
 import sys
+import json
+import queue
+import atexit
+import logging
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# The job whose work is running in this context. Log records pick it up, so one
+# job's fetch, parse and write lines can be found together.
+job_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("job_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(name)s]%(job)s - %(message)s"
+
+
+@contextmanager
+def job_context(job_id: Optional[int]) -> Iterator[None]:
+    """Tags every log record made in this context (tasks, pipeline stages and threads it awaits) with `job_id`."""
+    token = job_id_var.set(job_id)
+    try:
+        yield
+    finally:
+        job_id_var.reset(token)
+
+
+class JobIdFilter(logging.Filter):
+    """Copies the current job id onto each record. Runs in the thread that logged, where the job's context is."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job_id = job_id_var.get()
+        record.job = f" [job {record.job_id}]" if record.job_id is not None else ""
+        return True
 
-def setup_logging():
-    """Configures the root logger for the entire application."""
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "job_id", None) is not None:
+            entry["job_id"] = record.job_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def parse_levels(spec: str) -> dict[str, str]:
+    """Parses per-logger levels like "src.worker=WARNING,discord=ERROR"."""
+    levels = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, level = part.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(
+    level: str = "INFO",
+    logger_levels: Optional[dict[str, str]] = None,
+    json_format: bool = False,
+    max_bytes: int = 20 * 1024 * 1024,
+    backup_count: int = 5,
+    rotate_when: Optional[str] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Configures the root logger for the entire application.
+
+    Loggers only put records on an in-memory queue; a background thread
+    formats them and writes logs/app.log and stdout, so log I/O never runs
+    on the event loop. The file rotates at `max_bytes`, or on a schedule
+    such as "midnight" when `rotate_when` is given, keeping `backup_count`
+    old files.
+    """
     # Create logs directory if it doesn't exist
     os.makedirs("logs", exist_ok=True)
 
     # Define the logging format
-    log_format = logging.Formatter(
-        "%(asctime)s - %(levelname)s - [%(name)s] - %(message)s"
-    )
+    log_format = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
 
-    # 1. Configure logging to a file (the ship's logbook)
-    file_handler = logging.FileHandler("logs/app.log")
+    # 1. Logging to a file (the ship's logbook), rotated so it can't grow forever
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            "logs/app.log", when=rotate_when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            "logs/app.log", maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
     file_handler.setFormatter(log_format)
-    file_handler.setLevel(logging.INFO)
 
-    # 2. Configure logging to the console (the ship's intercom)
+    # 2. Logging to the console (the ship's intercom)
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(log_format)
-    stream_handler.setLevel(logging.INFO)
 
-    # 3. Get the root logger and add our handlers.
-    # We configure the root logger so that any logger created with
-    # logging.getLogger(__name__) will inherit this configuration.
+    # 3. The root logger only enqueues. We configure the root logger so that any
+    # logger created with logging.getLogger(__name__) inherits this configuration.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(JobIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Drain whatever is still queued when the process exits.
+    atexit.register(listener.stop)
+
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(stream_handler)
\ No newline at end of file
+    root_logger.setLevel(level.upper())
+    root_logger.addHandler(queue_handler)
+    for name, logger_level in (logger_levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+    return listener
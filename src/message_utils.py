@@ -0,0 +1,24 @@
+import re
+from typing import Optional
+
+# Phrases people use in Discord to ask for a quantity, e.g. "need 5", "qty: 10", "x4", "3 pcs".
+QUANTITY_PATTERNS = [
+    re.compile(r"\b(?:qty|quantity|need|want|order|buy)\s*[:=\-]?\s*(\d{1,5})\b", re.IGNORECASE),
+    re.compile(r"\b(\d{1,5})\s*(?:pcs|pc|pieces|piece|nos|units|unit|x)\b", re.IGNORECASE),
+    re.compile(r"(?:^|\s)x\s*(\d{1,5})\b", re.IGNORECASE),
+]
+
+
+def extract_quantity(message: str) -> Optional[int]:
+    """
+    Pulls a requested quantity out of a user's message without calling the LLM.
+    URLs are ignored so digits inside links are never mistaken for a quantity.
+    """
+    text = " ".join(word for word in message.split() if "://" not in word)
+    for pattern in QUANTITY_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            quantity = int(match.group(1))
+            if quantity > 0:
+                return quantity
+    return None
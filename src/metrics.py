@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the span histogram buckets. Covers a quick cache hit up to a slow headed retry.
+SPAN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# Prefix for every exported Prometheus metric.
+METRIC_PREFIX = "discprod"
+
+# Durations of the spans recorded so far for the job running in this context (see job_timings()).
+_job_timings: contextvars.ContextVar[Optional[dict[str, float]]] = contextvars.ContextVar("job_timings", default=None)
+
+
+class Histogram:
+    """Fixed-bucket histogram, Prometheus style (cumulative buckets are computed on export)."""
+    def __init__(self, buckets: tuple[float, ...] = SPAN_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimates a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= target and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return round(lower + (upper - lower) * (target - seen) / bucket_count, 3)
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and span histograms. Thread-safe, so the blocking
+    fetch/parse/write code running in worker threads can record directly.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        # Callbacks that get every raw span duration, e.g. for exact percentiles in benchmarks.
+        self._span_listeners: list[Callable[[str, float], None]] = []
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Times a block as `span_seconds{span=name}` and adds it to the current job's timings."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - started)
+
+    def record_span(self, name: str, seconds: float):
+        self.observe("span_seconds", seconds, span=name)
+        for listener in self._span_listeners:
+            listener(name, seconds)
+        timings = _job_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    def add_span_listener(self, listener: Callable[[str, float], None]):
+        self._span_listeners.append(listener)
+
+    def remove_span_listener(self, listener: Callable[[str, float], None]):
+        self._span_listeners.remove(listener)
+
+    def reset(self):
+        """Clears every counter and histogram and restarts the uptime clock."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._started = time.time()
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counter_total(self, name: str) -> float:
+        """Sum of a counter over all its label values."""
+        with self._lock:
+            return sum(value for (counter, _), value in self._counters.items() if counter == name)
+
+    def render_prometheus(self) -> str:
+        """The registry in the Prometheus text exposition format."""
+        lines: list[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            last_name = None
+            for (name, labels), value in counters:
+                metric = f"{METRIC_PREFIX}_{name}"
+                if name != last_name:
+                    lines.append(f"# TYPE {metric} counter")
+                    last_name = name
+                lines.append(f"{metric}{_labels(labels)} {value:g}")
+
+            last_name = None
+            for (name, labels), histogram in histograms:
+                metric = f"{METRIC_PREFIX}_{name}"
+                if name != last_name:
+                    lines.append(f"# TYPE {metric} histogram")
+                    last_name = name
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_uptime_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_uptime_seconds {time.time() - self._started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """A compact JSON-friendly overview: throughput, rates and span percentiles."""
+        uptime = time.time() - self._started
+        jobs = self.counter_total("jobs_total")
+        with self._lock:
+            spans = {
+                dict(labels).get("span", name): {
+                    "count": histogram.count,
+                    "mean": round(histogram.sum / histogram.count, 3) if histogram.count else None,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                }
+                for (name, labels), histogram in self._histograms.items()
+                if name == "span_seconds"
+            }
+            errors = {
+                dict(labels)["stage"]: value for (name, labels), value in self._counters.items() if name == "errors_total"
+            }
+            cache_hits = {
+                dict(labels)["cache"]: value for (name, labels), value in self._counters.items() if name == "cache_hits_total"
+            }
+        return {
+            "uptime_seconds": round(uptime),
+            "jobs": jobs,
+            "jobs_per_second": round(jobs / uptime, 4) if uptime else 0.0,
+            "captcha_rate": round(self.counter_total("captchas_total") / jobs, 3) if jobs else 0.0,
+            "cache_hits": cache_hits,
+            "errors_by_stage": errors,
+            "spans": spans,
+        }
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+# The registry every module records into.
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def job_timings() -> Iterator[dict[str, float]]:
+    """Collects the spans recorded while this job runs, including in threads and pipeline stages it awaits."""
+    timings: dict[str, float] = {}
+    token = _job_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _job_timings.reset(token)
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text format) and /summary (JSON) on a local port."""
+    def __init__(self, registry: MetricsRegistry = metrics, host: str = "127.0.0.1", port: int = 9108):
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/summary", self._summary)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        logger.info(f"Metrics endpoint listening on http://{self._host}:{self._port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self._registry.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def _summary(self, request: web.Request) -> web.Response:
+        return web.json_response(self._registry.summary())
+
+
+async def summary_reporter(
+    interval: float = 60.0,
+    path: Optional[str] = os.path.join("logs", "metrics_summary.json"),
+    registry: MetricsRegistry = metrics,
+):
+    """Logs a one-line summary every `interval` seconds and keeps the latest one on disk as JSON."""
+    while True:
+        await asyncio.sleep(interval)
+        summary = registry.summary()
+        logger.info(
+            f"Metrics: {summary['jobs']:g} jobs ({summary['jobs_per_second']}/s), captcha rate {summary['captcha_rate']}, "
+            f"cache hits {summary['cache_hits']}, errors {summary['errors_by_stage']}"
+        )
+        if path:
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(summary, f, indent=2)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics summary to {path}: {e}")
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+from .data_models import AiProductInfo, WorkItem
+
+logger = logging.getLogger(__name__)
+
+# How many batches' sent counts are remembered. A batch is one Discord message, so this is plenty.
+MAX_TRACKED_BATCHES = 1000
+
+
+class ParseBatcher:
+    """
+    Collects the screenshots of URLs that came from the same Discord message
+    and hands them to `run_batch` together, so one multi-image request
+    replaces one request per URL.
+
+    A group is sent as soon as it holds every screenshot the message is still
+    expected to produce that can be in flight alongside it (or `max_images`), or `max_wait` seconds after its
+    first screenshot arrived, so a slow or failed fetch never holds the
+    others back for long. Each caller still gets its own result.
+    """
+    def __init__(
+        self,
+        run_batch: Callable[[list[Any], str], Awaitable[list[AiProductInfo]]],
+        max_images: int = 10,
+        max_wait: float = 3.0,
+    ):
+        self._run_batch = run_batch
+        self._max_images = max(1, max_images)
+        self._max_wait = max_wait
+        # batch id -> the group being collected: {"contents", "futures", "message", "timer"}
+        self._groups: dict[str, dict] = {}
+        # batch id -> screenshots already sent, so a message's last group knows when it is full.
+        self._sent: OrderedDict[str, int] = OrderedDict()
+        logger.info(f"ParseBatcher initialized (up to {self._max_images} images per request, {max_wait:.1f}s wait).")
+
+    async def parse(self, item: WorkItem, content: Any) -> AiProductInfo:
+        """Adds one screenshot to its message's group and waits for that screenshot's result."""
+        future = asyncio.get_running_loop().create_future()
+        group = self._groups.get(item.batch_id)
+        if group is None:
+            group = self._groups[item.batch_id] = {
+                "contents": [], "futures": [], "message": item.message_content,
+                "timer": asyncio.get_running_loop().call_later(self._max_wait, self._send, item.batch_id),
+            }
+        group["contents"].append(content)
+        group["futures"].append(future)
+
+        expected = max(1, item.batch_size - self._sent.get(item.batch_id, 0))
+        if item.batch_capacity is not None:
+            # Siblings held back by their host's limit only start after this job is done,
+            # so waiting for them would just cost the timer.
+            expected = min(expected, max(1, item.batch_capacity))
+        if len(group["contents"]) >= min(expected, self._max_images):
+            self._send(item.batch_id)
+        return await future
+
+    def _send(self, batch_id: str):
+        group = self._groups.pop(batch_id, None)
+        if group is None:
+            return # Already sent because it filled up before the timer fired
+        group["timer"].cancel()
+        self._sent[batch_id] = self._sent.get(batch_id, 0) + len(group["contents"])
+        self._sent.move_to_end(batch_id)
+        while len(self._sent) > MAX_TRACKED_BATCHES:
+            self._sent.popitem(last=False)
+        # The request serves several jobs, so it runs in a context of its own.
+        asyncio.get_running_loop().create_task(self._run(batch_id, group), context=contextvars.Context())
+
+    async def _run(self, batch_id: str, group: dict):
+        futures = group["futures"]
+        logger.info(f"Parsing {len(futures)} screenshots from message {batch_id} together.")
+        try:
+            results = await self._run_batch(group["contents"], group["message"])
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
@@ -1,35 +1,67 @@
 import asyncio
 import logging
-import PIL.Image
+import mimetypes
+from typing import Optional
 import google.genai as genai
 from google.genai import types
 from .interfaces import ParserInterface
-from .data_models import AiProductInfo # Import the new model
+from .data_models import AiProductInfo, FetchResult # Import the new model
+from .governor import ApiGovernor
+from .message_utils import extract_quantity
+from .metrics import metrics
+from .perceptual_cache import PerceptualHashCache
+from .url_tools import normalize_url
 
 logger = logging.getLogger(__name__)
 
 class GeminiImageParser(ParserInterface):
     """
-    A parser that takes a file path to an image, sends it to a multimodal
-    LLM, and parses the response.
+    A parser that takes a screenshot (in memory, or a file path), sends it to
+    a multimodal LLM, and parses the response.
+    One parser (and one genai client, with its pooled keep-alive connections)
+    is shared by every job, and calls go through the SDK's async API instead
+    of holding a thread each.
     """
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        hash_cache: Optional[PerceptualHashCache] = None,
+        client: Optional[genai.Client] = None,
+        governor: Optional[ApiGovernor] = None,
+    ):
         if not api_key:
             raise ValueError("AI Studio API key cannot be empty.")
-        self._client = genai.Client(api_key=api_key)
+        self._client = client or genai.Client(api_key=api_key)
+        # Quota, retries and circuit breaking for every Gemini call.
+        self._governor = governor or ApiGovernor("gemini")
+        # Optional cache of results for visually near-identical screenshots.
+        self._hash_cache = hash_cache
         # The system instruction now focuses on its role, not the output format.
         self._system_instruction = """You are an expert visual data extraction bot for electronics components and e-commerce websites."""
         logger.info("GeminiImageParser initialized with and structured output and CAPTCHA detection prompt.")
 
-    async def parse(self, content_path_or_html: str, user_message: str) -> AiProductInfo: # Update return type
-        """Parses an image and user message, returning a structured ProductInfo object."""
-        image_path = content_path_or_html
-        return await asyncio.to_thread(self._blocking_parse, image_path, user_message)
-
-    def _blocking_parse(self, image_path: str, user_message: str) -> AiProductInfo: # Update return type
+    async def parse(self, content: str | FetchResult, user_message: str, use_cache: bool = True) -> AiProductInfo: # Update return type
+        """
+        Parses an image and user message, returning a structured ProductInfo object.
+        Without `use_cache` the perceptual cache is skipped: a changed price is only a few
+        pixels, well within its match distance.
+        """
+        # Used in log lines: the page URL for in-memory captures, otherwise the file.
+        image_path = self._describe(content)
         logger.info(f"Parser starting structured extraction for {image_path}")
         try:
-            img = PIL.Image.open(image_path)
+            image_bytes, mime_type = await self._load(content)
+            image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+
+            # --- PERCEPTUAL CACHE: skip the API call for screenshots we've already seen ---
+            image_hash = None
+            page = self._cache_page(content) if use_cache else None
+            if page:
+                # Hashing decodes the image, so it stays off the event loop.
+                image_hash, cached = await asyncio.to_thread(self._cache_lookup, image_bytes, page)
+                if cached is not None:
+                    return self._from_cache(cached, user_message)
+
             # The prompt now includes the user's message for context.
             prompt = f"""
             Analyze the following e-commerce product page screenshot and the user's message.
@@ -39,17 +71,21 @@ class GeminiImageParser(ParserInterface):
 
             User's message: "{user_message}"
             """
-            logger.info(f"Sending {image_path} to Gemini API...")
-            response = self._client.models.generate_content(
-                model="gemini-2.0-flash",
-                # Contents now contains the text prompt AND the image
-                contents=[prompt, img],
-                # Contents now contains the text prompt AND the image
-                config={
-                    "response_mime_type": "application/json",
-                    "response_schema": AiProductInfo, # Use the AI-specific schema
-                }
-            )
+            logger.info(f"Sending {image_path} ({len(image_bytes)} bytes, {mime_type}) to Gemini API...")
+            with metrics.span("llm_call"):
+                response = await self._governor.call(
+                    self._client.aio.models.generate_content,
+                    usage=self._tokens_used,
+                    model="gemini-2.0-flash",
+                    # Contents now contains the text prompt AND the image
+                    contents=[prompt, image_part],
+                    # Contents now contains the text prompt AND the image
+                    config={
+                        "response_mime_type": "application/json",
+                        "response_schema": AiProductInfo, # Use the AI-specific schema
+                    }
+                )
+            metrics.inc("llm_calls_total")
                 
             # The SDK automatically parses the JSON into our Pydantic object.
             parsed_result = response.parsed
@@ -74,10 +110,13 @@ class GeminiImageParser(ParserInterface):
 
             parsed_object: AiProductInfo = parsed_result
             logger.info(f"LLM returned structured data for {image_path}")
+            if image_hash is not None:
+                await asyncio.to_thread(self._hash_cache.store, image_hash, parsed_object, page)
             return parsed_object
 
         except Exception as e:
             logger.error(f"Structured parsing failed for {image_path}: {e}", exc_info=True)
+            metrics.inc("llm_errors_total")
             # --- PROVIDE ALL REQUIRED FIELDS ---
             return AiProductInfo(
                 is_captcha=False,
@@ -93,4 +132,128 @@ class GeminiImageParser(ParserInterface):
                 estimated_delivery=None,
                 platform=None,
                 quantity_required=None
-            )
\ No newline at end of file
+            )
+
+    async def parse_many(self, contents: list[str | FetchResult], user_message: str) -> list[AiProductInfo]:
+        """
+        Parses the screenshots of one multi-URL message with a single
+        multi-image request that returns a list of AiProductInfo in order.
+        Perceptual-cache hits are answered locally. If the batched answer
+        can't be used, each screenshot falls back to its own parse() call, so
+        one bad page never fails the others.
+        """
+        if len(contents) == 1:
+            return [await self.parse(contents[0], user_message)]
+        results: list[Optional[AiProductInfo]] = [None] * len(contents)
+        # (index, image bytes, mime type, perceptual hash) of the captures that need the model.
+        pending: list[tuple[int, bytes, str, Optional[int]]] = []
+        try:
+            for index, content in enumerate(contents):
+                image_bytes, mime_type = await self._load(content)
+                image_hash = None
+                page = self._cache_page(content)
+                if page:
+                    image_hash, cached = await asyncio.to_thread(self._cache_lookup, image_bytes, page)
+                    if cached is not None:
+                        results[index] = self._from_cache(cached, user_message)
+                        continue
+                pending.append((index, image_bytes, mime_type, image_hash))
+            parsed = await self._generate_many(contents, pending, user_message) if pending else []
+        except Exception as e:
+            logger.warning(f"Batched parse of {len(contents)} screenshots failed ({e}). Parsing them one at a time.")
+            parsed = None
+
+        if parsed is None:
+            singles = await asyncio.gather(*(
+                self.parse(content, user_message) for index, content in enumerate(contents) if results[index] is None
+            ))
+            missing = [index for index, result in enumerate(results) if result is None]
+            for index, result in zip(missing, singles):
+                results[index] = result
+            return results
+
+        for (index, _, _, image_hash), result in zip(pending, parsed):
+            results[index] = result
+            if image_hash is not None:
+                await asyncio.to_thread(self._hash_cache.store, image_hash, result, self._cache_page(contents[index]))
+        return results
+
+    async def _generate_many(
+        self, contents: list, pending: list[tuple[int, bytes, str, Optional[int]]], user_message: str
+    ) -> list[AiProductInfo]:
+        """One structured-output request for several screenshots. Raises if the answer doesn't line up."""
+        prompt = f"""
+        Analyze each of the following {len(pending)} e-commerce product page screenshots and the user's message.
+        Return a JSON array with exactly one object per screenshot, in the order given.
+        Extract all the fields defined in the provided JSON schema for each one.
+        Prioritize detecting if a page is a CAPTCHA.
+        If the user's message mentions a quantity (e.g., "we need 5 of these"), extract it.
+
+        User's message: "{user_message}"
+        """
+        parts: list = [prompt]
+        for number, (index, image_bytes, mime_type, _) in enumerate(pending, start=1):
+            parts.append(f"Screenshot {number}: {self._describe(contents[index])}")
+            parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
+        logger.info(f"Sending {len(pending)} screenshots to Gemini API in one request...")
+        with metrics.span("llm_call"):
+            response = await self._governor.call(
+                self._client.aio.models.generate_content,
+                usage=self._tokens_used,
+                units=len(pending),
+                model="gemini-2.0-flash",
+                contents=parts,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": list[AiProductInfo],
+                },
+            )
+        metrics.inc("llm_calls_total")
+        metrics.inc("llm_batched_images_total", len(pending))
+        parsed = response.parsed
+        if not isinstance(parsed, list) or len(parsed) != len(pending) or not all(isinstance(p, AiProductInfo) for p in parsed):
+            raise ValueError(f"expected {len(pending)} ProductInfo objects, got {type(parsed).__name__} {parsed!r:.200}")
+        logger.info(f"LLM returned structured data for {len(parsed)} screenshots in one request")
+        return parsed
+
+    @staticmethod
+    def _describe(content: str | FetchResult) -> str:
+        return content.url if isinstance(content, FetchResult) else content
+
+    async def _load(self, content: str | FetchResult) -> tuple[bytes, str]:
+        """
+        The capture's bytes and MIME type. The screenshot may already be cropped
+        and re-encoded by the fetcher's preprocessor, so its bytes are sent
+        as-is instead of letting the SDK decode and re-encode them.
+        """
+        if isinstance(content, FetchResult):
+            return content.image, content.mime_type
+        image_bytes = await asyncio.to_thread(self._read_file, content)
+        return image_bytes, mimetypes.guess_type(content)[0] or "image/png"
+
+    @staticmethod
+    def _from_cache(cached: AiProductInfo, user_message: str) -> AiProductInfo:
+        metrics.inc("cache_hits_total", cache="perceptual")
+        if cached.is_captcha:
+            return cached
+        # The page is the same but the request isn't; refresh the quantity.
+        return cached.model_copy(update={"quantity_required": extract_quantity(user_message)})
+
+    @staticmethod
+    def _tokens_used(response) -> Optional[int]:
+        return response.usage_metadata.total_token_count if response.usage_metadata else None
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _cache_page(self, content: str | FetchResult) -> Optional[str]:
+        """The page a capture's cache entries belong to. Captures of unknown pages (files) skip the cache."""
+        if self._hash_cache is None or not isinstance(content, FetchResult):
+            return None
+        return normalize_url(content.url)
+
+    def _cache_lookup(self, image_bytes: bytes, page: str) -> tuple[int, Optional[AiProductInfo]]:
+        image_hash = self._hash_cache.hash(image_bytes)
+        return image_hash, self._hash_cache.lookup(image_hash, page)
@@ -0,0 +1,146 @@
+import io
+import os
+import time
+import sqlite3
+import logging
+import threading
+import PIL.Image
+from typing import Optional
+from urllib.parse import urlparse
+from .data_models import AiProductInfo
+
+logger = logging.getLogger(__name__)
+
+
+def dhash(image_bytes: bytes, hash_size: int = 16) -> int:
+    """
+    Difference hash of an image: shrink to (hash_size + 1) x hash_size greyscale
+    and set one bit per pixel that is brighter than its right-hand neighbour.
+    Near-identical screenshots end up a small Hamming distance apart.
+    """
+    img = PIL.Image.open(io.BytesIO(image_bytes))
+    img.draft("L", (hash_size * 8, hash_size * 8)) # Lets JPEG decoding skip most of the work
+    pixels = img.convert("L").resize((hash_size + 1, hash_size), PIL.Image.Resampling.BOX).tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class PerceptualHashCache:
+    """
+    Remembers the AiProductInfo produced for each screenshot, keyed by its
+    perceptual hash and the page it was taken of. A new screenshot of the
+    same page within `max_distance` bits of a cached one reuses that result,
+    so re-posted products don't cost another LLM call. Listings built on one
+    store template can look nearly identical, so a product result is never
+    applied to another page; a CAPTCHA result is shared across its host, so
+    the same wall is recognized anywhere on the site. Entries are persisted
+    to SQLite and kept in memory for the Hamming-distance scan.
+    """
+    def __init__(
+        self,
+        path: str = os.path.join("logs", "phash_cache.sqlite3"),
+        max_distance: int = 6,
+        hash_size: int = 16,
+        ttl_seconds: float = 24 * 3600,
+        max_entries: int = 5000,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._max_distance = max_distance
+        self._hash_size = hash_size
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.captcha_hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS screenshots ("
+            "hash TEXT NOT NULL, hash_size INTEGER NOT NULL, result_json TEXT NOT NULL, stored_at REAL NOT NULL, page TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(screenshots)")}
+        if "page" not in columns: # Caches created before results were scoped to their page
+            self._conn.execute("ALTER TABLE screenshots ADD COLUMN page TEXT")
+        # Rows without a page can't be scoped, so they are never reused.
+        self._conn.execute("DELETE FROM screenshots WHERE page IS NULL")
+        # Drop expired rows and anything beyond the newest `max_entries`.
+        self._conn.execute("DELETE FROM screenshots WHERE stored_at < ?", (time.time() - self._ttl,))
+        self._conn.execute(
+            "DELETE FROM screenshots WHERE rowid NOT IN (SELECT rowid FROM screenshots ORDER BY stored_at DESC LIMIT ?)",
+            (max_entries,),
+        )
+        self._conn.commit()
+
+        # (hash, stored_at, page, result) in insertion order, oldest first.
+        self._entries: list[tuple[int, float, str, AiProductInfo]] = []
+        rows = self._conn.execute(
+            "SELECT hash, stored_at, page, result_json FROM screenshots WHERE hash_size = ? ORDER BY stored_at",
+            (hash_size,),
+        ).fetchall()
+        for hash_hex, stored_at, page, result_json in rows[-max_entries:]:
+            try:
+                self._entries.append((int(hash_hex, 16), stored_at, page, AiProductInfo.model_validate_json(result_json)))
+            except ValueError:
+                continue
+        logger.info(f"PerceptualHashCache loaded {len(self._entries)} entries (max distance {max_distance} bits).")
+
+    def hash(self, image_bytes: bytes) -> int:
+        return dhash(image_bytes, self._hash_size)
+
+    def lookup(self, image_hash: int, page: str) -> Optional[AiProductInfo]:
+        """
+        Returns the result of the closest cached screenshot within range that
+        was taken of `page` (a canonical URL), or a CAPTCHA on its host, if any.
+        """
+        cutoff = time.time() - self._ttl
+        host = urlparse(page).netloc
+        with self._lock:
+            best: Optional[AiProductInfo] = None
+            best_distance = self._max_distance + 1
+            for cached_hash, stored_at, cached_page, result in self._entries:
+                if stored_at < cutoff:
+                    continue
+                if cached_page != page and not (result.is_captcha and urlparse(cached_page).netloc == host):
+                    continue
+                distance = (cached_hash ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = result, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if best.is_captcha:
+                self.captcha_hits += 1
+        logger.info(f"Perceptual cache hit at distance {best_distance} (captcha={best.is_captcha}). {self.stats()}")
+        return best
+
+    def store(self, image_hash: int, result: AiProductInfo, page: str):
+        now = time.time()
+        with self._lock:
+            self._entries.append((image_hash, now, page, result))
+            if len(self._entries) > self._max_entries:
+                del self._entries[: len(self._entries) - self._max_entries]
+            self._conn.execute(
+                "INSERT INTO screenshots (hash, hash_size, result_json, stored_at, page) VALUES (?, ?, ?, ?, ?)",
+                (format(image_hash, "x"), self._hash_size, result.model_dump_json(), now, page),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "captcha_hits": self.captcha_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import contextvars
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    """
+    One stage of the processing pipeline: a bounded input queue served by its
+    own pool of `concurrency` worker tasks. Jobs from many WorkItems flow
+    through each stage independently, so e.g. browsers, LLM calls and sheet
+    writes overlap across jobs while each keeps its own limit.
+    """
+    def __init__(self, name: str, concurrency: int, queue_size: int = 0):
+        if concurrency < 1:
+            raise ValueError(f"Stage '{name}' needs at least one worker.")
+        self.name = name
+        self.concurrency = concurrency
+        # Each entry is (async function, its arguments, the caller's context, future the caller is waiting on).
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+        self._busy = 0
+
+    async def run(self, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Queues `func(*args)` on this stage and waits for its result."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        # put() waits when the queue is full, pushing back on the stage before us.
+        await self._queue.put((func, args, contextvars.copy_context(), future))
+        return await future
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "busy": self._busy, "concurrency": self.concurrency}
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _ensure_started(self):
+        if not self._workers:
+            # Workers outlive the job that happened to start them, so they get a clean context.
+            self._workers = [
+                asyncio.create_task(self._work(), name=f"{self.name}-worker-{i}", context=contextvars.Context())
+                for i in range(self.concurrency)
+            ]
+            logger.info(f"Pipeline stage '{self.name}' started with {self.concurrency} workers.")
+
+    async def _work(self):
+        while True:
+            func, args, context, future = await self._queue.get()
+            if future.cancelled():
+                self._queue.task_done()
+                continue
+            self._busy += 1
+            try:
+                # Run in the caller's context so per-job context variables (timings, job ids) follow the job.
+                result = await asyncio.create_task(func(*args), context=context)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                # The stage is stopping; don't leave the caller waiting forever.
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Installed once per document. It records the time of the last DOM mutation, counts
+# finished requests and reports what the page looks like right now, so Python can
+# decide when to shoot. Requests are counted with a PerformanceObserver because the
+# resource timing buffer stops at 250 entries by default, after which a busy page's
+# count would look settled.
+READINESS_PROBE_SCRIPT = """
+if (!window.__dpsProbe) {
+    window.__dpsProbe = {lastMutation: performance.now(), resources: performance.getEntriesByType('resource').length};
+    new MutationObserver(function () {
+        window.__dpsProbe.lastMutation = performance.now();
+    }).observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+    performance.setResourceTimingBufferSize(10000);
+    try {
+        window.__dpsProbe.resources = 0;
+        // buffered: true replays the entries recorded before the probe was installed.
+        new PerformanceObserver(function (list) {
+            window.__dpsProbe.resources += list.getEntries().length;
+        }).observe({type: 'resource', buffered: true});
+    } catch (e) {
+        window.__dpsProbe.observer = false; // Fall back to the (now larger) buffer
+    }
+}
+
+function visibleBox(selectors) {
+    for (const selector of selectors) {
+        for (const el of document.querySelectorAll(selector)) {
+            const rect = el.getBoundingClientRect();
+            const style = window.getComputedStyle(el);
+            if (rect.width > 0 && rect.height > 0 && rect.top < window.innerHeight && rect.bottom > 0
+                    && style.visibility !== 'hidden' && style.display !== 'none'
+                    && (el.innerText || '').trim().length > 0) {
+                return [rect.left, rect.top, rect.right, rect.bottom];
+            }
+        }
+    }
+    return null;
+}
+
+return {
+    readyState: document.readyState,
+    resources: window.__dpsProbe.observer === false
+        ? performance.getEntriesByType('resource').length : window.__dpsProbe.resources,
+    sinceMutationMs: performance.now() - window.__dpsProbe.lastMutation,
+    titleBox: visibleBox(arguments[0]),
+    priceBox: visibleBox(arguments[1]),
+};
+"""
+
+TITLE_SELECTORS = [
+    "#productTitle", "[itemprop='name']", ".product-title", ".product_title", ".product-name", "h1",
+]
+PRICE_SELECTORS = [
+    ".a-price .a-offscreen", ".a-price", "[itemprop='price']", ".product-price", ".price", "[class*='price']",
+]
+
+
+@dataclass
+class ReadinessResult:
+    """What the readiness engine decided and why."""
+    ready: bool
+    elapsed: float
+    reason: str
+    # Union of the visible title and price boxes in CSS pixels (left, top, right, bottom).
+    focus_box: Optional[tuple[int, int, int, int]] = None
+
+
+class DomainSettleTracker:
+    """
+    Learns how long pages on each domain take to settle, as an exponentially
+    weighted moving average, and persists it to a small JSON file.
+    """
+    def __init__(self, path: Optional[str] = os.path.join("logs", "settle_times.json"), alpha: float = 0.3):
+        self._path = path
+        self._alpha = alpha
+        self._lock = threading.Lock()
+        self._settle_times: dict[str, float] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._settle_times = {k: float(v) for k, v in json.load(f).items()}
+                logger.info(f"Loaded learned settle times for {len(self._settle_times)} domains.")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load settle times from {path}: {e}")
+
+    def get(self, domain: str) -> Optional[float]:
+        with self._lock:
+            return self._settle_times.get(domain)
+
+    def record(self, domain: str, elapsed: float):
+        with self._lock:
+            previous = self._settle_times.get(domain)
+            learned = elapsed if previous is None else self._alpha * elapsed + (1 - self._alpha) * previous
+            self._settle_times[domain] = round(learned, 3)
+            snapshot = dict(self._settle_times)
+        if self._path:
+            try:
+                tmp_path = f"{self._path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(snapshot, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self._path)
+            except OSError as e:
+                logger.warning(f"Could not persist settle times to {self._path}: {e}")
+
+
+class PageReadinessWaiter:
+    """
+    Decides when a page is ready to be screenshotted instead of sleeping for a
+    fixed time. A page is ready once the document has loaded, no new network
+    resources have appeared for `network_idle` seconds, the DOM has been quiet
+    for `dom_quiet` seconds and a product title or price is visible.
+
+    Once the domain's learned settle time (or `hint_grace` for new domains) has
+    passed, the page is also accepted if it is idle but shows no title/price,
+    or if it shows them but never goes fully quiet. `max_wait` is a hard
+    ceiling. `human_jitter` is an optional extra (min, max) pause after
+    readiness, kept separate from the readiness logic.
+    """
+    def __init__(
+        self,
+        settle_tracker: Optional[DomainSettleTracker] = None,
+        max_wait: float = 12.0,
+        poll_interval: float = 0.25,
+        network_idle: float = 0.5,
+        dom_quiet: float = 0.5,
+        hint_grace: float = 3.0,
+        human_jitter: Optional[tuple[float, float]] = None,
+    ):
+        self._tracker = settle_tracker or DomainSettleTracker()
+        self._max_wait = max_wait
+        self._poll_interval = poll_interval
+        self._network_idle = network_idle
+        self._dom_quiet = dom_quiet
+        self._hint_grace = hint_grace
+        self._human_jitter = human_jitter
+
+    def wait(self, driver, url: str) -> ReadinessResult:
+        """Blocks until the page in `driver` is ready or the deadline passes."""
+        domain = urlparse(url).netloc.lower()
+        learned = self._tracker.get(domain)
+        # Pages without visible product hints are accepted after the usual settle time for the domain.
+        hint_deadline = min(learned, self._max_wait) if learned is not None else self._hint_grace
+
+        start = time.monotonic()
+        last_resource_count = -1
+        last_resource_change = start
+        result: Optional[ReadinessResult] = None
+
+        while True:
+            now = time.monotonic()
+            elapsed = now - start
+            try:
+                probe = driver.execute_script(READINESS_PROBE_SCRIPT, TITLE_SELECTORS, PRICE_SELECTORS) or {}
+            except Exception as e:
+                # A navigation in progress can make the script fail; just try again.
+                logger.debug(f"Readiness probe failed for {url}: {e}")
+                probe = {}
+
+            resource_count = probe.get("resources", -1)
+            if resource_count != last_resource_count:
+                last_resource_count = resource_count
+                last_resource_change = now
+
+            loaded = probe.get("readyState") == "complete"
+            network_idle = now - last_resource_change >= self._network_idle
+            dom_quiet = probe.get("sinceMutationMs", 0) / 1000 >= self._dom_quiet
+            boxes = [box for box in (probe.get("titleBox"), probe.get("priceBox")) if box]
+
+            if loaded and network_idle and dom_quiet:
+                if boxes:
+                    result = ReadinessResult(True, elapsed, "idle with product details visible", _union(boxes))
+                elif elapsed >= hint_deadline:
+                    result = ReadinessResult(True, elapsed, "idle without product details")
+            elif loaded and boxes and elapsed >= hint_deadline:
+                # Carousels and timers can keep the DOM busy forever; the details are what matter.
+                result = ReadinessResult(True, elapsed, "product details visible, page still busy", _union(boxes))
+            if result is None and elapsed >= self._max_wait:
+                result = ReadinessResult(False, elapsed, "max wait reached", _union(boxes) if boxes else None)
+            if result is not None:
+                break
+            time.sleep(self._poll_interval)
+
+        self._tracker.record(domain, result.elapsed)
+        logger.info(f"Page ready for {domain} after {result.elapsed:.2f}s ({result.reason}).")
+
+        if self._human_jitter:
+            time.sleep(random.uniform(*self._human_jitter))
+        return result
+
+
+def _union(boxes: list) -> tuple[int, int, int, int]:
+    return (
+        int(min(box[0] for box in boxes)), int(min(box[1] for box in boxes)),
+        int(max(box[2] for box in boxes)), int(max(box[3] for box in boxes)),
+    )
@@ -0,0 +1,319 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+import aiohttp
+from .data_models import EnrichedProductInfo, WorkItem
+from .durable_queue import DurableWorkQueue
+from .metrics import metrics
+from .sheet_index import AVAILABILITY_COLUMN, PRICE_COLUMN, QUANTITY_COLUMN, URL_COLUMN, USER_COLUMN, cell, to_number
+from .structured_data import extract_product_fields, is_complete, to_product_info
+from .writers import GoogleSheetWriter
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TrackedProduct:
+    """One product row the re-checker keeps current, and what it knew at its last check."""
+    url: str
+    user_name: str
+    quantity: Optional[int]
+    price: Optional[float]
+    availability: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fingerprint: Optional[str]
+    # Seconds between checks: shrinks when the page changes, grows while it doesn't.
+    interval: float
+    # Cheap GETs that failed in a row (e.g. a site that turns away plain HTTP clients).
+    failures: int = 0
+
+
+@dataclass
+class ConditionalResponse:
+    """A conditional GET's answer. `html` is None when the server said 304 Not Modified."""
+    html: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class RecheckStore:
+    """
+    The products being kept current, persisted to a local SQLite file. Each
+    has its own next check time, so the walk always starts with the rows that
+    are most overdue.
+    """
+    def __init__(self, path: str = os.path.join("logs", "recheck.sqlite3")):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            "url TEXT PRIMARY KEY, user_name TEXT NOT NULL, quantity INTEGER, price REAL, availability TEXT, "
+            "etag TEXT, last_modified TEXT, fingerprint TEXT, interval REAL NOT NULL, next_check_at REAL NOT NULL, "
+            "checks INTEGER NOT NULL DEFAULT 0, changes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(products)")}
+        if "failures" not in columns: # Stores created before failed fetches were escalated
+            self._conn.execute("ALTER TABLE products ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS products_due ON products (next_check_at)")
+        logger.info(f"RecheckStore ready at {path} ({self.count()} products tracked).")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def track(self, rows: list[tuple[str, str, Optional[int], Optional[float], Optional[str]]], interval: float) -> int:
+        """
+        Adds (url, user, quantity, price, availability) rows not tracked yet. Their
+        first checks are spread over one interval so a big sheet isn't fetched at
+        once. Returns how many were new.
+        """
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO products (url, user_name, quantity, price, availability, interval, next_check_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*row, interval, now + random.uniform(0, interval)) for row in rows],
+            )
+            return self._conn.total_changes - before
+
+    def due(self, limit: int) -> list[TrackedProduct]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, user_name, quantity, price, availability, etag, last_modified, fingerprint, interval, failures "
+                "FROM products WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [TrackedProduct(*row) for row in rows]
+
+    def record(self, product: TrackedProduct, changed: bool):
+        """Saves what a check learned and schedules the next one `product.interval` from now."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE products SET price = ?, availability = ?, etag = ?, last_modified = ?, fingerprint = ?, "
+                "interval = ?, failures = ?, next_check_at = ?, checks = checks + 1, changes = changes + ? WHERE url = ?",
+                (
+                    product.price, product.availability, product.etag, product.last_modified, product.fingerprint,
+                    product.interval, product.failures, time.time() + product.interval, int(changed), product.url,
+                ),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PriceRechecker:
+    """
+    Keeps the price and availability of rows already in the sheet current.
+
+    Every `sync_interval` it reads the sheet and starts tracking new rows.
+    Due products are checked most-overdue first, as cheaply as possible:
+    a conditional GET (ETag / Last-Modified) that the server can answer with
+    304, then the price and availability in the page's structured markup.
+    Only a page whose markup shows a change costs more: with complete markup
+    its price and availability are taken straight from it, otherwise a
+    re-check job goes on the work queue for the full screenshot + LLM
+    pipeline. Either way only the row's price, availability, total and
+    timestamp are updated in place.
+
+    A page without price or availability markup gives no cheap signal (its
+    text changes with every recommendation and timestamp), so each of its
+    checks is a re-check job. So is every `escalate_after_failures`-th cheap
+    GET that fails in a row, for sites that turn plain HTTP clients away.
+
+    Pages that change get checked more often (down to `min_interval`), pages
+    that don't less often (up to `max_interval`).
+    """
+    def __init__(
+        self,
+        store: RecheckStore,
+        writer: GoogleSheetWriter,
+        work_queue: DurableWorkQueue,
+        min_interval: float = 6 * 3600,
+        max_interval: float = 7 * 24 * 3600,
+        sync_interval: float = 3600,
+        batch_size: int = 20,
+        concurrency: int = 4,
+        poll_interval: float = 60,
+        timeout: float = 15,
+        escalate_after_failures: int = 3,
+    ):
+        self._store = store
+        self._writer = writer
+        self._queue = work_queue
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._sync_interval = sync_interval
+        self._batch_size = batch_size
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._poll_interval = poll_interval
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._escalate_after_failures = escalate_after_failures
+        self._session: Optional[aiohttp.ClientSession] = None
+        logger.info(
+            f"PriceRechecker initialized (every {min_interval / 3600:g}-{max_interval / 3600:g}h per product, "
+            f"sheet sync every {sync_interval / 60:g} min)."
+        )
+
+    async def run(self):
+        """The re-check loop. Runs forever."""
+        last_sync = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_sync >= self._sync_interval:
+                    await self._sync()
+                    last_sync = time.monotonic()
+                due = await asyncio.to_thread(self._store.due, self._batch_size)
+                if due:
+                    await asyncio.gather(*(self._check(product) for product in due))
+                    continue # More may be due already
+            except Exception as e:
+                logger.error(f"Re-check pass failed: {e}", exc_info=True)
+            await asyncio.sleep(self._poll_interval)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _sync(self):
+        rows = await self._writer.read_rows()
+        tracked = [
+            (
+                row[URL_COLUMN], cell(row, USER_COLUMN) or "recheck", _to_int(cell(row, QUANTITY_COLUMN)),
+                to_number(cell(row, PRICE_COLUMN)), cell(row, AVAILABILITY_COLUMN),
+            )
+            for row in rows if cell(row, URL_COLUMN).startswith("http")
+        ]
+        added = await asyncio.to_thread(self._store.track, tracked, self._min_interval)
+        if added:
+            logger.info(f"Re-checker now tracks {added} more products from the sheet.")
+
+    async def _check(self, product: TrackedProduct):
+        async with self._concurrency:
+            outcome = await self._check_once(product)
+        metrics.inc("rechecks_total", outcome=outcome)
+        logger.info(f"Re-checked {product.url}: {outcome} (next check in {product.interval / 3600:.1f}h).")
+
+    async def _check_once(self, product: TrackedProduct) -> str:
+        """Checks one product, records the result and returns what happened."""
+        response = await self._conditional_get(product)
+        if response is None:
+            product.failures += 1
+            if product.failures < self._escalate_after_failures:
+                await asyncio.to_thread(self._store.record, product, False)
+                return "fetch_failed"
+            product.failures = 0
+            await self._escalate(product)
+            await asyncio.to_thread(self._store.record, product, False)
+            return "escalated_after_failures"
+        product.failures = 0
+        if response.html is None:
+            return await self._unchanged(product, "not_modified")
+
+        product.etag, product.last_modified = response.etag, response.last_modified
+        fields = extract_product_fields(response.html, product.url)
+        fingerprint = _fingerprint(fields)
+        if fingerprint is None:
+            # Nothing cheap to compare; let the browser and the LLM look on every scheduled check.
+            product.fingerprint = None
+            await self._escalate(product)
+            await asyncio.to_thread(self._store.record, product, False)
+            return "escalated_no_markup"
+        if product.fingerprint is None:
+            # First look at this page's markup: compare it with what the sheet says.
+            changed = _differs(fields, product)
+        else:
+            changed = fingerprint != product.fingerprint
+        product.fingerprint = fingerprint
+        if not changed:
+            return await self._unchanged(product, "unchanged")
+
+        product.interval = max(self._min_interval, product.interval / 2)
+        if is_complete(fields):
+            ai_result = to_product_info(fields, _message(product))
+            updated = await self._writer.update(EnrichedProductInfo(
+                ai_data=ai_result,
+                processed_timestamp=datetime.now(timezone.utc).isoformat(),
+                requesting_user=product.user_name,
+                source_url=product.url,
+            ))
+            if updated:
+                product.price, product.availability = ai_result.price_per_unit, ai_result.availability
+            outcome = "updated_from_markup" if updated else "update_failed"
+        else:
+            await self._escalate(product)
+            product.price, product.availability = fields.get("price_per_unit"), fields.get("availability")
+            outcome = "escalated"
+        await asyncio.to_thread(self._store.record, product, True)
+        return outcome
+
+    async def _escalate(self, product: TrackedProduct):
+        """Queues a re-check job: the browser and the LLM look at the page, and the worker updates the row."""
+        await self._queue.put(WorkItem(url=product.url, message_content=_message(product), user_name=product.user_name, recheck=True))
+
+    async def _unchanged(self, product: TrackedProduct, outcome: str) -> str:
+        product.interval = min(self._max_interval, product.interval * 1.5)
+        await asyncio.to_thread(self._store.record, product, False)
+        return outcome
+
+    async def _conditional_get(self, product: TrackedProduct) -> Optional[ConditionalResponse]:
+        """GETs the page, letting the server answer 304 if it hasn't changed since the last check."""
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        }
+        if product.etag:
+            headers["If-None-Match"] = product.etag
+        if product.last_modified:
+            headers["If-Modified-Since"] = product.last_modified
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+        try:
+            with metrics.span("recheck_fetch"):
+                async with self._session.get(product.url, headers=headers) as response:
+                    if response.status == 304:
+                        return ConditionalResponse(None, product.etag, product.last_modified)
+                    response.raise_for_status()
+                    return ConditionalResponse(
+                        await response.text(errors="replace"),
+                        response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"),
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Re-check fetch failed for {product.url}: {e}")
+            return None
+
+
+def _fingerprint(fields: dict) -> Optional[str]:
+    """What a change is judged by: the price and availability in the markup, or None if it has neither."""
+    if fields.get("price_per_unit") is None and not fields.get("availability"):
+        return None
+    return f"{fields.get('price_per_unit')}|{fields.get('availability')}"
+
+
+def _message(product: TrackedProduct) -> str:
+    return f"qty {product.quantity}" if product.quantity else ""
+
+
+def _differs(fields: dict, product: TrackedProduct) -> bool:
+    price = fields.get("price_per_unit")
+    if price is not None and product.price is not None and abs(float(price) - product.price) > 0.005:
+        return True
+    availability = fields.get("availability")
+    return bool(availability and product.availability and availability.lower() != product.availability.lower())
+
+
+def _to_int(value: str) -> Optional[int]:
+    number = to_number(value)
+    return int(number) if number is not None else None
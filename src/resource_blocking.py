@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# URL patterns (Network.setBlockedURLs syntax, "*" is a wildcard) for each kind of
+# request a product screenshot doesn't need. Images are never blocked by default,
+# so the product photo stays, and first-party scripts and XHRs (price widgets) load.
+BLOCK_CATEGORIES = {
+    "ads": [
+        "*doubleclick.net*", "*googlesyndication.com*", "*googleadservices.com*", "*amazon-adsystem.com*",
+        "*adnxs.com*", "*criteo.com*", "*criteo.net*", "*taboola.com*", "*outbrain.com*", "*adsrvr.org*",
+    ],
+    "trackers": [
+        "*google-analytics.com*", "*googletagmanager.com*", "*connect.facebook.net*", "*facebook.com/tr*",
+        "*hotjar.com*", "*clarity.ms*", "*segment.io*", "*segment.com/analytics*", "*mixpanel.com*",
+        "*newrelic.com*", "*nr-data.net*", "*scorecardresearch.com*", "*bat.bing.com*", "*moengage.com*",
+        "*clevertap*", "*webengage.com*",
+    ],
+    "chat": [
+        "*intercom.io*", "*intercomcdn.com*", "*zopim.com*", "*zdassets.com*", "*tawk.to*",
+        "*livechatinc.com*", "*drift.com*", "*crisp.chat*", "*freshchat.com*", "*haptik.ai*",
+    ],
+    "video_embeds": ["*youtube.com/embed*", "*youtube-nocookie.com*", "*player.vimeo.com*", "*jwplayer.com*"],
+    "media": ["*.mp4*", "*.webm*", "*.m3u8*", "*.mpd*", "*.mp3*", "*.ogg*"],
+    "fonts": ["*.woff2*", "*.woff*", "*.ttf*", "*.otf*", "*fonts.googleapis.com*", "*fonts.gstatic.com*"],
+}
+
+
+@dataclass(frozen=True)
+class BlockingRules:
+    """Which requests a page load skips. Entries are category names from BLOCK_CATEGORIES or raw URL patterns."""
+    block: tuple[str, ...] = tuple(BLOCK_CATEGORIES)
+    # Categories or patterns to keep even though `block` lists them, e.g. "fonts" for a
+    # site whose prices are drawn with an icon font.
+    allow: tuple[str, ...] = ()
+
+    def patterns(self) -> list[str]:
+        allowed = set(self._expand(self.allow))
+        return [pattern for pattern in self._expand(self.block) if pattern not in allowed]
+
+    @staticmethod
+    def _expand(entries: tuple[str, ...]) -> list[str]:
+        patterns: list[str] = []
+        for entry in entries:
+            patterns.extend(BLOCK_CATEGORIES.get(entry, [entry]))
+        return patterns
+
+
+@dataclass
+class ResourceStats:
+    """Requests one page load made and skipped, read from Chrome's network log."""
+    loaded_requests: int = 0
+    loaded_bytes: int = 0
+    blocked_requests: int = 0
+    blocked_by_type: dict[str, int] = field(default_factory=dict)
+    # Blocked requests priced at the average size of loaded requests of the same type.
+    estimated_saved_bytes: int = 0
+
+
+class ResourceBlocker:
+    """
+    Keeps ads, trackers, chat widgets, video, media and web fonts out of the
+    browser's page loads with the DevTools `Network.setBlockedURLs` command,
+    so pages settle sooner and Chrome holds less in memory. Rules can be
+    overridden per domain like the image preprocessor's settings.
+
+    With `collect_stats` (which needs the driver pool's performance log),
+    each fetch reports how many requests were blocked and how many bytes
+    that likely saved.
+    """
+    def __init__(
+        self,
+        default: Optional[BlockingRules] = None,
+        per_domain: Optional[dict[str, BlockingRules]] = None,
+        collect_stats: bool = True,
+    ):
+        self._default = default or BlockingRules()
+        self._per_domain = per_domain or {}
+        self._collect_stats = collect_stats
+        self._lock = threading.Lock()
+        # Resource type -> (requests loaded, bytes loaded), for pricing the ones we block.
+        self._sizes: dict[str, list[int]] = {}
+        logger.info(
+            f"ResourceBlocker initialized ({len(self._default.patterns())} blocked URL patterns, "
+            f"{len(self._per_domain)} domain overrides, stats {'on' if collect_stats else 'off'})."
+        )
+
+    @classmethod
+    def from_json_file(cls, path: str, default: Optional[BlockingRules] = None, collect_stats: bool = True) -> "ResourceBlocker":
+        """Loads per-domain overrides, e.g. {"amazon.in": {"allow": ["fonts"]}, "example.com": {"block": []}}."""
+        default = default or BlockingRules()
+        with open(path) as f:
+            overrides = json.load(f)
+        per_domain = {
+            domain.lower(): replace(default, **{key: tuple(value) for key, value in values.items()})
+            for domain, values in overrides.items()
+        }
+        return cls(default, per_domain, collect_stats)
+
+    def rules_for(self, url: str) -> BlockingRules:
+        host = urlparse(url).netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        # "amazon.in" also matches subdomains such as "m.amazon.in".
+        for domain, rules in self._per_domain.items():
+            if host == domain or host.endswith(f".{domain}"):
+                return rules
+        return self._default
+
+    @contextmanager
+    def applied(self, driver, url: str) -> Iterator[None]:
+        """Blocks the rules' URLs for the page load inside the block, then lifts the block and reports the savings."""
+        patterns = self.rules_for(url).patterns()
+        if self._collect_stats:
+            self._read_network_log(driver) # Drop whatever the previous page left in the log
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        try:
+            yield
+        finally:
+            try:
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            except Exception as e:
+                # A driver that would keep blocking on the next site must not be reused.
+                logger.warning(f"Could not lift resource blocking, discarding the driver: {e}")
+                driver.quit()
+            else:
+                if self._collect_stats:
+                    self._report(url, self._read_network_log(driver))
+
+    def _read_network_log(self, driver) -> list[dict]:
+        """Drains Chrome's performance log, keeping only the network events."""
+        try:
+            entries = driver.get_log("performance")
+        except Exception as e:
+            logger.warning(f"Chrome performance log unavailable ({e}). Turning resource stats off.")
+            self._collect_stats = False
+            return []
+        events = []
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            if message.get("method", "").startswith("Network."):
+                events.append(message)
+        return events
+
+    def _report(self, url: str, events: list[dict]):
+        stats = self._summarize(events)
+        metrics.inc("fetch_loaded_bytes_total", stats.loaded_bytes)
+        metrics.inc("fetch_saved_bytes_estimate_total", stats.estimated_saved_bytes)
+        for resource_type, count in stats.blocked_by_type.items():
+            metrics.inc("fetch_blocked_requests_total", count, type=resource_type)
+        metrics.observe("fetch_page_bytes", stats.loaded_bytes)
+        logger.info(
+            f"Page load for {url}: {stats.loaded_requests} requests ({stats.loaded_bytes / 1024:.0f} KB) loaded, "
+            f"{stats.blocked_requests} blocked (~{stats.estimated_saved_bytes / 1024:.0f} KB saved)."
+        )
+
+    def _summarize(self, events: list[dict]) -> ResourceStats:
+        stats = ResourceStats()
+        types: dict[str, str] = {}
+        loaded: list[tuple[str, int]] = []
+        blocked: list[str] = []
+        for event in events:
+            params = event.get("params", {})
+            method = event["method"]
+            if method == "Network.requestWillBeSent":
+                types[params["requestId"]] = params.get("type", "Other")
+            elif method == "Network.loadingFinished":
+                loaded.append((types.get(params["requestId"], "Other"), int(params.get("encodedDataLength", 0))))
+            elif method == "Network.loadingFailed" and params.get("blockedReason") == "inspector":
+                blocked.append(params.get("type") or types.get(params["requestId"], "Other"))
+
+        with self._lock:
+            for resource_type, size in loaded:
+                stats.loaded_requests += 1
+                stats.loaded_bytes += size
+                totals = self._sizes.setdefault(resource_type, [0, 0])
+                totals[0] += 1
+                totals[1] += size
+            for resource_type in blocked:
+                stats.blocked_requests += 1
+                stats.blocked_by_type[resource_type] = stats.blocked_by_type.get(resource_type, 0) + 1
+                count, size = self._sizes.get(resource_type, (0, 0))
+                if count:
+                    stats.estimated_saved_bytes += size // count
+        return stats
@@ -0,0 +1,66 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional
+from .data_models import AiProductInfo
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    A TTL cache of AiProductInfo results keyed by canonical product URL,
+    persisted to a local SQLite file so it survives restarts.
+    """
+    def __init__(self, path: str = os.path.join("logs", "result_cache.sqlite3"), ttl_seconds: float = 24 * 3600):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        # One shared connection, guarded by the lock, used from worker threads.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "canonical_url TEXT PRIMARY KEY, result_json TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            # Drop anything that expired while the bot was down.
+            self._conn.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self._ttl,))
+            self._conn.commit()
+        logger.info(f"ResultCache ready at {path} with a TTL of {ttl_seconds:.0f}s.")
+
+    async def get(self, canonical_url: str) -> Optional[AiProductInfo]:
+        return await asyncio.to_thread(self._blocking_get, canonical_url)
+
+    async def put(self, canonical_url: str, result: AiProductInfo):
+        await asyncio.to_thread(self._blocking_put, canonical_url, result)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _blocking_get(self, canonical_url: str) -> Optional[AiProductInfo]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result_json, stored_at FROM results WHERE canonical_url = ?", (canonical_url,)
+            ).fetchone()
+        if row is None:
+            return None
+        result_json, stored_at = row
+        if time.time() - stored_at > self._ttl:
+            return None
+        try:
+            return AiProductInfo.model_validate_json(result_json)
+        except ValueError as e:
+            logger.warning(f"Discarding unreadable cache entry for {canonical_url}: {e}")
+            return None
+
+    def _blocking_put(self, canonical_url: str, result: AiProductInfo):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (canonical_url, result_json, stored_at) VALUES (?, ?, ?)",
+                (canonical_url, result.model_dump_json(), time.time()),
+            )
+            self._conn.commit()
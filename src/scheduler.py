@@ -0,0 +1,244 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlparse
+from .concurrency import AdaptiveConcurrency
+from .data_models import WorkItem, JobResult
+from .url_tools import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HostLimits:
+    """Concurrency and rate limits for one host."""
+    concurrency: int = 1
+    rate_per_minute: float = 6.0
+    # How many requests may go out back-to-back before the rate applies.
+    burst: int = 2
+
+
+class TokenBucket:
+    """Classic token bucket; `wait_time()` says how long until a token is available."""
+    def __init__(self, rate_per_minute: float, burst: int):
+        self._rate = rate_per_minute / 60.0
+        self._capacity = float(max(1, burst))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        self._refill()
+        if self._tokens >= 1 or self._rate <= 0:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self._capacity
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+
+@dataclass
+class _HostState:
+    limits: HostLimits
+    bucket: TokenBucket
+    # Pending items per Discord user, and the order users take turns in.
+    pending: dict[str, deque] = field(default_factory=dict)
+    users: deque = field(default_factory=deque)
+    active: int = 0
+    paused_until: float = 0.0
+    captcha_strikes: int = 0
+    # Pending plus running items per Discord message batch id.
+    batches: dict[str, int] = field(default_factory=dict)
+
+    def has_pending(self) -> bool:
+        return bool(self.users)
+
+    def pop_next(self) -> WorkItem:
+        """Takes the oldest item of the next user in line, then sends that user to the back."""
+        user = self.users.popleft()
+        items = self.pending[user]
+        item = items.popleft()
+        if items:
+            self.users.append(user)
+        else:
+            del self.pending[user]
+        return item
+
+
+class DomainScheduler:
+    """
+    Sits between the work queue and the worker. Jobs are grouped by host and
+    dispatched round-robin across hosts, and round-robin across Discord users
+    within a host. Each host has its own concurrency cap and token-bucket
+    rate, and a host that shows CAPTCHAs is paused with exponential backoff.
+    With an AdaptiveConcurrency controller the global limit is resized at
+    runtime instead of staying at `max_concurrent_jobs`.
+    """
+    def __init__(
+        self,
+        run_job: Callable[[WorkItem], Awaitable[JobResult]],
+        max_concurrent_jobs: int,
+        default_limits: Optional[HostLimits] = None,
+        host_limits: Optional[dict[str, HostLimits]] = None,
+        captcha_backoff_base: float = 60.0,
+        captcha_backoff_max: float = 900.0,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+    ):
+        self._run_job = run_job
+        self._max_concurrent = max_concurrent_jobs
+        self._default_limits = default_limits or HostLimits()
+        self._host_limits = host_limits or {}
+        self._backoff_base = captcha_backoff_base
+        self._backoff_max = captcha_backoff_max
+        self._concurrency = concurrency
+
+        self._hosts: dict[str, _HostState] = {}
+        # Host keys in round-robin order; the head is the next host to try.
+        self._rotation: deque[str] = deque()
+        self._running = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+        logger.info(
+            f"DomainScheduler initialized (global limit {'adaptive' if concurrency else max_concurrent_jobs}, default per-host {self._default_limits}, "
+            f"{len(self._host_limits)} host overrides)."
+        )
+
+    async def submit(self, item: WorkItem):
+        """Queues a work item under its host."""
+        canonical = await canonicalize_url(item.url)
+        host = urlparse(canonical).netloc
+        state = self._hosts.get(host)
+        if state is None:
+            limits = self._host_limits.get(host, self._default_limits)
+            state = _HostState(limits=limits, bucket=TokenBucket(limits.rate_per_minute, limits.burst))
+            self._hosts[host] = state
+            self._rotation.append(host)
+
+        if item.user_name not in state.pending:
+            state.pending[item.user_name] = deque()
+            state.users.append(item.user_name)
+        state.pending[item.user_name].append(item)
+        if item.batch_id:
+            state.batches[item.batch_id] = state.batches.get(item.batch_id, 0) + 1
+        logger.info(f"Scheduled {item.url} under host {host} ({self.pending_count()} pending).")
+        self._wakeup.set()
+
+    def pending_count(self) -> int:
+        return sum(len(items) for state in self._hosts.values() for items in state.pending.values())
+
+    async def run(self):
+        """The dispatch loop. Runs forever."""
+        logger.info("DomainScheduler dispatch loop started.")
+        while True:
+            self._wakeup.clear()
+            wait = self._dispatch_ready()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch_ready(self) -> Optional[float]:
+        """Starts every job that may run now. Returns how long until another one might, or None."""
+        self._forget_idle_hosts()
+        next_wait: Optional[float] = None
+        while True:
+            limit = self._concurrency.limit if self._concurrency else self._max_concurrent
+            if self._running >= limit:
+                if self._concurrency and self._has_ready_host():
+                    self._concurrency.mark_saturated()
+                return None
+            picked = None
+            now = time.monotonic()
+            for _ in range(len(self._rotation)):
+                host = self._rotation[0]
+                self._rotation.rotate(-1)
+                state = self._hosts[host]
+                if not state.has_pending() or state.active >= state.limits.concurrency:
+                    continue
+                wait = max(state.paused_until - now, state.bucket.wait_time())
+                if wait > 0:
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+                picked = (host, state)
+                break
+            if picked is None:
+                return next_wait
+
+            host, state = picked
+            state.bucket.take()
+            state.active += 1
+            self._running += 1
+            item = state.pop_next()
+            if item.batch_id:
+                item.batch_capacity = min(limit, self._batch_capacity(item.batch_id))
+            task = asyncio.create_task(self._run(host, state, item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _batch_capacity(self, batch_id: str) -> int:
+        """How many of a batch's queued and running jobs its hosts' concurrency caps let run at once."""
+        return sum(
+            min(state.batches.get(batch_id, 0), state.limits.concurrency) for state in self._hosts.values()
+        )
+
+    def _has_ready_host(self) -> bool:
+        """True if some host could start a job right now if the global limit allowed it."""
+        now = time.monotonic()
+        return any(
+            state.has_pending() and state.active < state.limits.concurrency
+            and state.paused_until <= now and state.bucket.wait_time() <= 0
+            for state in self._hosts.values()
+        )
+
+    def _forget_idle_hosts(self):
+        """
+        Drops hosts with nothing pending or running so the rotation doesn't grow
+        forever. Hosts in CAPTCHA backoff or with a partly drained bucket are
+        kept, so forgetting a host never resets its limits.
+        """
+        for host in list(self._rotation):
+            state = self._hosts[host]
+            if not state.has_pending() and state.active == 0 and state.captcha_strikes == 0 and state.bucket.is_full():
+                del self._hosts[host]
+                self._rotation.remove(host)
+
+    async def _run(self, host: str, state: _HostState, item: WorkItem):
+        started = time.monotonic()
+        result: Optional[JobResult] = None
+        try:
+            result = await self._run_job(item)
+            self._record(host, state, result)
+        except Exception as e:
+            logger.error(f"Scheduled job for {item.url} raised: {e}", exc_info=True)
+        finally:
+            if self._concurrency:
+                self._concurrency.record(result, time.monotonic() - started)
+            state.active -= 1
+            self._running -= 1
+            if item.batch_id:
+                state.batches[item.batch_id] -= 1
+                if not state.batches[item.batch_id]:
+                    del state.batches[item.batch_id]
+            self._wakeup.set()
+
+    def _record(self, host: str, state: _HostState, result: JobResult):
+        if result.captcha_seen:
+            state.captcha_strikes += 1
+            backoff = min(self._backoff_max, self._backoff_base * 2 ** (state.captcha_strikes - 1))
+            state.paused_until = time.monotonic() + backoff
+            logger.warning(f"CAPTCHA on {host} (strike {state.captcha_strikes}). Pausing host for {backoff:.0f}s.")
+        elif state.captcha_strikes:
+            logger.info(f"{host} served a job without a CAPTCHA. Clearing its backoff.")
+            state.captcha_strikes = 0
@@ -0,0 +1,194 @@
+import io
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+import PIL.Image
+import PIL.features
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Formats the store can transcode to: PIL format name -> file extension.
+STORE_FORMATS = {"WEBP": "webp", "AVIF": "avif", "JPEG": "jpg", "PNG": "png"}
+
+
+class ScreenshotStore:
+    """
+    Keeps screenshots for debugging without letting them fill the disk.
+
+    Captures are stored once per content hash, so identical captures share a
+    file, and are transcoded (WebP by default) on a single background thread.
+    A SQLite index records every capture's URL, time, hash, job and outcome.
+    Once the files exceed `max_bytes`, the least recently used are evicted,
+    and anything unused for `max_age_seconds` is dropped as well.
+
+    save() and record_outcome() only queue work, so they never block the caller.
+    """
+    def __init__(
+        self,
+        directory: str = os.path.join("logs", "screenshots"),
+        max_bytes: int = 500 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 3600,
+        image_format: str = "WEBP",
+        quality: int = 70,
+    ):
+        image_format = image_format.upper()
+        if image_format not in STORE_FORMATS:
+            raise ValueError(f"Unsupported screenshot format '{image_format}'. Use one of {sorted(STORE_FORMATS)}.")
+        if image_format == "AVIF" and not PIL.features.check("avif"):
+            logger.warning("This Pillow build has no AVIF support. Storing screenshots as WEBP instead.")
+            image_format = "WEBP"
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_age = max_age_seconds
+        self._format = image_format
+        self._quality = quality
+        # One background thread does the hashing, transcoding and index writes, so they stay in order.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-store")
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "hash TEXT PRIMARY KEY, path TEXT NOT NULL, bytes INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captures ("
+            "id TEXT PRIMARY KEY, url TEXT NOT NULL, captured_at REAL NOT NULL, hash TEXT NOT NULL, "
+            "job_id INTEGER, outcome TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS captures_url ON captures (url, captured_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs").fetchone()[0]
+        self.deduplicated = 0
+        self.evicted = 0
+        logger.info(
+            f"ScreenshotStore at {directory}: {self._total_bytes / 1e6:.1f} MB used of {max_bytes / 1e6:.0f} MB, "
+            f"stored as {image_format}."
+        )
+
+    def save(self, url: str, image: bytes, job_id: Optional[int] = None) -> str:
+        """Queues a capture for storage and returns its capture id."""
+        capture_id = uuid.uuid4().hex
+        self._executor.submit(self._blocking_save, capture_id, url, image, job_id)
+        return capture_id
+
+    def record_outcome(self, capture_ids: list[str], outcome: str):
+        """Queues the job outcome for the given captures (runs after their save)."""
+        if capture_ids:
+            self._executor.submit(self._blocking_record_outcome, capture_ids, outcome)
+
+    def find(self, url_fragment: str = "", limit: int = 20) -> list[dict]:
+        """Recent captures whose URL contains `url_fragment`, newest first. `path` is None once evicted."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.id, c.url, c.captured_at, c.hash, c.job_id, c.outcome, b.path FROM captures c "
+                "LEFT JOIN blobs b ON b.hash = c.hash WHERE c.url LIKE ? ORDER BY c.captured_at DESC LIMIT ?",
+                (f"%{url_fragment}%", limit),
+            ).fetchall()
+        columns = ("id", "url", "captured_at", "hash", "job_id", "outcome", "path")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def stats(self) -> dict:
+        return {
+            "megabytes": round(self._total_bytes / 1e6, 1),
+            "deduplicated": self.deduplicated,
+            "evicted": self.evicted,
+        }
+
+    def close(self):
+        """Finishes queued work and closes the index."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+    # --- Background work (runs on the store's own thread) ---
+
+    def _blocking_save(self, capture_id: str, url: str, image: bytes, job_id: Optional[int]):
+        try:
+            content_hash = hashlib.sha256(image).hexdigest()
+            now = time.time()
+            with self._lock:
+                known = self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            if known:
+                self.deduplicated += 1
+                with self._lock:
+                    self._conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (now, content_hash))
+            else:
+                path, size = self._write_blob(content_hash, image)
+                with self._lock:
+                    self._conn.execute(
+                        "INSERT INTO blobs (hash, path, bytes, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                        (content_hash, path, size, now, now),
+                    )
+                self._total_bytes += size
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO captures (id, url, captured_at, hash, job_id) VALUES (?, ?, ?, ?, ?)",
+                    (capture_id, url, now, content_hash, job_id),
+                )
+                self._conn.commit()
+            self._evict()
+        except Exception as e:
+            logger.warning(f"Could not store screenshot of {url}: {e}")
+
+    def _write_blob(self, content_hash: str, image: bytes) -> tuple[str, int]:
+        """Transcodes a capture and writes it under a two-level hash directory."""
+        with PIL.Image.open(io.BytesIO(image)) as img:
+            if img.format == self._format:
+                data = image
+            else:
+                buffer = io.BytesIO()
+                converted = img.convert("RGB") if self._format in ("JPEG", "AVIF") else img
+                converted.save(buffer, self._format, quality=self._quality)
+                data = buffer.getvalue()
+        folder = os.path.join(self._directory, content_hash[:2])
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{content_hash}.{STORE_FORMATS[self._format]}")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path, len(data)
+
+    def _blocking_record_outcome(self, capture_ids: list[str], outcome: str):
+        with self._lock:
+            self._conn.executemany("UPDATE captures SET outcome = ? WHERE id = ?", [(outcome, i) for i in capture_ids])
+            self._conn.commit()
+
+    def _evict(self):
+        """Drops blobs unused for max_age, then the least recently used until under budget."""
+        cutoff = time.time() - self._max_age
+        with self._lock:
+            expired = self._conn.execute("SELECT hash, path, bytes FROM blobs WHERE last_used < ?", (cutoff,)).fetchall()
+            victims = list(expired)
+            remaining = self._total_bytes - sum(size for _, _, size in expired)
+            if remaining > self._max_bytes:
+                for row in self._conn.execute(
+                    "SELECT hash, path, bytes FROM blobs WHERE last_used >= ? ORDER BY last_used", (cutoff,)
+                ):
+                    if remaining <= self._max_bytes:
+                        break
+                    victims.append(row)
+                    remaining -= row[2]
+            if not victims:
+                return
+            self._conn.executemany("DELETE FROM blobs WHERE hash = ?", [(h,) for h, _, _ in victims])
+            # Index rows outlive their files so the history stays searchable, but not forever.
+            self._conn.execute("DELETE FROM captures WHERE captured_at < ?", (cutoff,))
+            self._conn.commit()
+        for _, path, size in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not delete evicted screenshot {path}: {e}")
+            self._total_bytes -= size
+        self.evicted += len(victims)
+        logger.info(f"Evicted {len(victims)} screenshots. {self.stats()}")
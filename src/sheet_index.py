@@ -0,0 +1,153 @@
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from .data_models import AiProductInfo
+
+logger = logging.getLogger(__name__)
+
+# The sheet's columns (0-based), in GoogleSheetWriter.HEADER order.
+(
+    TIMESTAMP_COLUMN, USER_COLUMN, PLATFORM_COLUMN, ITEM_NAME_COLUMN, MODEL_COLUMN, GENERIC_NAME_COLUMN,
+    CATEGORY_COLUMN, QUANTITY_COLUMN, PRICE_COLUMN, GST_COLUMN, TOTAL_COLUMN, AVAILABILITY_COLUMN,
+    DELIVERY_COLUMN, URL_COLUMN, JOBS_COLUMN,
+) = range(15)
+
+# The first data row, below the header.
+FIRST_ROW = 2
+
+# Day 0 of Sheets date serial numbers, which unformatted reads return for date cells.
+SHEETS_EPOCH = datetime(1899, 12, 30, tzinfo=timezone.utc)
+
+
+def column_letter(column: int) -> str:
+    """The A1 letter of a 0-based column (the sheet has fewer than 26)."""
+    return chr(ord("A") + column)
+
+
+def cell(row: list, column: int) -> str:
+    """A cell as text ("" when the API left it out, as it does for trailing blanks)."""
+    return str(row[column]).strip() if len(row) > column and row[column] is not None else ""
+
+
+def to_number(value) -> Optional[float]:
+    """A numeric cell (possibly formatted with thousands separators), or None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "")) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+class SheetIndex:
+    """
+    An in-memory copy of the sheet's data rows, keyed by product URL and by
+    (platform, model number), so the writer can find a product's row without
+    reading the sheet. Later rows win when a product appears more than once.
+    Not thread-safe; it lives on the event loop with its writer.
+    """
+    def __init__(self):
+        self._rows: list[list] = []
+        self._by_url: dict[str, int] = {}
+        self._by_model: dict[tuple[str, str], int] = {}
+        # Row number -> when this process last wrote it, for rows whose timestamp cell can't be parsed.
+        self._written_at: dict[int, float] = {}
+        self.loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def next_row(self) -> int:
+        """The sheet row number the next new product goes to."""
+        return FIRST_ROW + len(self._rows)
+
+    def replace(self, rows: list[list]):
+        """Replaces the whole index with rows read from FIRST_ROW down."""
+        # Rows may have moved, so what this process wrote where no longer applies.
+        self._rows, self._by_url, self._by_model, self._written_at = [], {}, {}, {}
+        self.extend(rows)
+
+    def extend(self, rows: list[list]):
+        """Adds rows read from `next_row` down (rows someone else appended since the last read)."""
+        for row in rows:
+            self._rows.append(list(row))
+            self._add_keys(FIRST_ROW + len(self._rows) - 1, row)
+        self.loaded_at = time.monotonic()
+
+    def set(self, row_number: int, row: list):
+        """Records a row this process just wrote."""
+        while self.next_row <= row_number:
+            self._rows.append([]) # A row of an earlier batch that failed stays blank
+        self._rows[row_number - FIRST_ROW] = list(row)
+        self._add_keys(row_number, row)
+        self._written_at[row_number] = time.time()
+
+    def find(self, url: str, platform: Optional[str] = None, model_number: Optional[str] = None) -> Optional[int]:
+        """The row number holding this product: by URL, else by platform + model number."""
+        row_number = self._by_url.get(url)
+        if row_number is None and model_number:
+            row_number = self._by_model.get(_model_key(platform, model_number))
+        return row_number
+
+    def row(self, row_number: int) -> list:
+        return list(self._rows[row_number - FIRST_ROW])
+
+    def rows(self) -> list[list]:
+        return [list(row) for row in self._rows]
+
+    def fresh_record(self, url: str, max_age: float) -> Optional[AiProductInfo]:
+        """The product data of the URL's row if it was written within `max_age` seconds, else None."""
+        row_number = self._by_url.get(url)
+        if row_number is None:
+            return None
+        row = self._rows[row_number - FIRST_ROW]
+        written_at = self._written_at.get(row_number) or _parse_timestamp(cell(row, TIMESTAMP_COLUMN))
+        if written_at is None or time.time() - written_at > max_age or not cell(row, ITEM_NAME_COLUMN):
+            return None
+        gst = cell(row, GST_COLUMN).lower()
+        return AiProductInfo(
+            is_captcha=False,
+            item_name=cell(row, ITEM_NAME_COLUMN),
+            model_number=cell(row, MODEL_COLUMN) or None,
+            generic_name=cell(row, GENERIC_NAME_COLUMN) or None,
+            category=cell(row, CATEGORY_COLUMN) or None,
+            price_per_unit=to_number(cell(row, PRICE_COLUMN)),
+            is_gst_included=True if gst == "true" else False if gst == "false" else None,
+            total_cost=to_number(cell(row, TOTAL_COLUMN)),
+            availability=cell(row, AVAILABILITY_COLUMN) or None,
+            estimated_delivery=cell(row, DELIVERY_COLUMN) or None,
+            platform=cell(row, PLATFORM_COLUMN) or None,
+            quantity_required=None,
+        )
+
+    def _add_keys(self, row_number: int, row: list):
+        url = cell(row, URL_COLUMN)
+        if url:
+            self._by_url[url] = row_number
+        model_number = cell(row, MODEL_COLUMN)
+        if model_number:
+            self._by_model[_model_key(cell(row, PLATFORM_COLUMN), model_number)] = row_number
+
+
+def _model_key(platform: Optional[str], model_number: str) -> tuple[str, str]:
+    # The same model on two sites is two listings with their own prices.
+    return (platform or "").strip().lower(), model_number.strip().lower()
+
+
+def _parse_timestamp(value: str) -> Optional[float]:
+    """
+    Unix time of a timestamp cell: the ISO text the writer stores, or a date
+    serial number if Sheets turned it into a date. None if it is neither.
+    """
+    serial = to_number(value)
+    if serial is not None:
+        return (SHEETS_EPOCH + timedelta(days=serial)).timestamp()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Any, Optional
+from urllib.parse import quote
+import aiohttp
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+class SheetsApiError(Exception):
+    """A Sheets API call came back with an error status."""
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"Sheets API error {status}: {message}")
+        self.status = status
+        # Seconds the server asked us to wait (Retry-After), if it said.
+        self.retry_after = retry_after
+
+
+class ServiceAccountTokenSource:
+    """
+    Hands out OAuth access tokens for a service account. The token is cached
+    and only refreshed (in a thread, since google-auth is blocking) when it is
+    about to expire, and concurrent callers share a single refresh.
+    """
+    def __init__(self, credentials_path: str, scopes: list[str] = SCOPES):
+        self._credentials = service_account.Credentials.from_service_account_file(credentials_path, scopes=scopes)
+        self._lock = asyncio.Lock()
+
+    async def token(self, force_refresh: bool = False) -> str:
+        if self._credentials.valid and not force_refresh:
+            return self._credentials.token
+        async with self._lock:
+            # Someone else may have refreshed while we waited.
+            if not self._credentials.valid or force_refresh:
+                await asyncio.to_thread(self._credentials.refresh, Request())
+                logger.info("Refreshed Google service account token.")
+            return self._credentials.token
+
+
+class AsyncSheetsClient:
+    """
+    A small async client for the Sheets values API over one keep-alive
+    aiohttp connection pool. Meant to be created once and shared.
+    """
+    def __init__(self, token_source: ServiceAccountTokenSource, pool_size: int = 10, timeout: float = 30.0):
+        self._tokens = token_source
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def get_values(self, spreadsheet_id: str, range_: str, value_render_option: str = "FORMATTED_VALUE") -> dict:
+        return await self._request(
+            "GET", f"{spreadsheet_id}/values/{quote(range_, safe='')}", params={"valueRenderOption": value_render_option},
+        )
+
+    async def batch_get_values(self, spreadsheet_id: str, ranges: list[str], value_render_option: str = "FORMATTED_VALUE") -> dict:
+        """Reads several ranges in one request. The answer's "valueRanges" follow the order of `ranges`."""
+        return await self._request(
+            "GET", f"{spreadsheet_id}/values:batchGet",
+            params=[("ranges", range_) for range_ in ranges] + [("valueRenderOption", value_render_option)],
+        )
+
+    async def update_values(self, spreadsheet_id: str, range_: str, rows: list[list], value_input_option: str = "USER_ENTERED") -> dict:
+        return await self._request(
+            "PUT", f"{spreadsheet_id}/values/{quote(range_, safe='')}",
+            params={"valueInputOption": value_input_option}, body={"values": rows},
+        )
+
+    async def append_values(self, spreadsheet_id: str, range_: str, rows: list[list], value_input_option: str = "USER_ENTERED") -> dict:
+        return await self._request(
+            "POST", f"{spreadsheet_id}/values/{quote(range_, safe='')}:append",
+            params={"valueInputOption": value_input_option}, body={"values": rows},
+        )
+
+    async def batch_update_values(self, spreadsheet_id: str, data: list[dict], value_input_option: str = "USER_ENTERED") -> dict:
+        """Writes several ranges in one request. `data` holds {"range": ..., "values": [[...]]} entries."""
+        return await self._request(
+            "POST", f"{spreadsheet_id}/values:batchUpdate",
+            body={"valueInputOption": value_input_option, "data": data},
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _request(self, method: str, path: str, params: Optional[dict | list] = None, body: Any = None) -> dict:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+
+        for attempt in range(2):
+            # A 401 usually means the cached token was revoked or expired early; refresh once.
+            token = await self._tokens.token(force_refresh=attempt > 0)
+            async with self._session.request(
+                method, f"{SHEETS_API}/{path}", params=params, json=body,
+                headers={"Authorization": f"Bearer {token}"},
+            ) as response:
+                if response.status == 401 and attempt == 0:
+                    continue
+                payload = await response.json(content_type=None)
+                if response.status >= 400:
+                    message = (payload or {}).get("error", {}).get("message", response.reason)
+                    retry_after = response.headers.get("Retry-After", "")
+                    raise SheetsApiError(response.status, message, float(retry_after) if retry_after.isdigit() else None)
+                return payload or {}
+        raise SheetsApiError(401, "Unauthorized after refreshing the access token.")
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import logging
+import importlib
+import threading
+from types import ModuleType
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# The heavy modules behind the fetch and parse stages: Selenium, google-genai and PIL.
+# Only processes that run jobs import them, and only once the rest of the bot is up.
+PROCESSING_MODULES = (
+    "src.driver_pool",
+    "src.readiness",
+    "src.image_preprocessing",
+    "src.resource_blocking",
+    "src.fetchers",
+    "src.fetch_strategy",
+    "src.screenshot_store",
+    "src.perceptual_cache",
+    "src.result_cache",
+    "src.parsers",
+    "src.parse_batcher",
+    "src.concurrency",
+    "src.scheduler",
+    "src.worker",
+)
+
+
+class StartupReport:
+    """
+    Records how long startup takes: the import time of each lazily loaded
+    module and when milestones such as Discord's first on_ready or the first
+    completed job happen, measured from process start. Each milestone is
+    logged once, and the whole report is kept in logs/startup_report.json
+    so slow restarts show up.
+    """
+    def __init__(self, path: Optional[str] = os.path.join("logs", "startup_report.json")):
+        self._started = time.perf_counter()
+        self._path = path
+        self._lock = threading.Lock()
+        self.imports: dict[str, float] = {}
+        self.milestones: dict[str, float] = {}
+
+    def load(self, name: str) -> ModuleType:
+        """Imports a module, recording how long it took (modules it shares with earlier loads are not counted again)."""
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.imports.setdefault(name, round(elapsed, 3))
+        return module
+
+    def preload(self, names: Iterable[str] = PROCESSING_MODULES):
+        """Imports a group of modules (blocking; run it in a thread to keep the event loop free)."""
+        started = time.perf_counter()
+        for name in names:
+            self.load(name)
+        logger.info(f"Loaded processing modules in {time.perf_counter() - started:.2f}s.")
+
+    def mark(self, milestone: str):
+        """Records the first time `milestone` is reached; later calls are ignored."""
+        with self._lock:
+            if milestone in self.milestones:
+                return
+            self.milestones[milestone] = round(time.perf_counter() - self._started, 3)
+        logger.info(f"Startup: {milestone} after {self.milestones[milestone]:.2f}s.")
+        self._save()
+
+    def report(self) -> dict:
+        with self._lock:
+            slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+            return {"milestones": dict(self.milestones), "imports": dict(slowest)}
+
+    def _save(self):
+        if not self._path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.report(), f, indent=2)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logger.warning(f"Could not write startup report to {self._path}: {e}")
+
+
+# Created when the process starts, so milestones count from (nearly) the first import.
+startup = StartupReport()
@@ -0,0 +1,225 @@
+import re
+import json
+import logging
+from html.parser import HTMLParser
+from typing import Any, Optional
+from urllib.parse import urlparse
+from .data_models import AiProductInfo
+from .message_utils import extract_quantity
+
+logger = logging.getLogger(__name__)
+
+# With these filled in from markup, a record is good enough to skip the screenshot + LLM path.
+REQUIRED_FIELDS = ("item_name", "price_per_unit")
+
+# Microdata properties we read; container props like "offers" are skipped.
+MICRODATA_PROPS = {"name", "model", "mpn", "sku", "category", "price", "lowprice", "availability"}
+
+# schema.org availability URLs -> the wording the LLM would use.
+AVAILABILITY_LABELS = {
+    "instock": "In Stock",
+    "outofstock": "Out of Stock",
+    "preorder": "Pre-order",
+    "backorder": "Backorder",
+    "limitedavailability": "Limited Availability",
+    "soldout": "Sold Out",
+    "discontinued": "Discontinued",
+    "instoreonly": "In Store Only",
+    "onlineonly": "In Stock",
+}
+
+
+class _MarkupCollector(HTMLParser):
+    """Collects JSON-LD blocks, <meta> tags and microdata itemprops in one pass."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.json_ld: list[str] = []
+        self.meta: dict[str, str] = {}
+        self.itemprops: dict[str, str] = {}
+        self._in_json_ld = False
+        self._json_ld_chunks: list[str] = []
+        # Itemprops without a content attribute take the text of their element.
+        self._open_itemprop: Optional[str] = None
+        self._itemprop_text: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {name.lower(): (value or "") for name, value in attrs}
+        if tag == "script" and attributes.get("type", "").lower() == "application/ld+json":
+            self._in_json_ld = True
+            self._json_ld_chunks = []
+        elif tag == "meta":
+            key = attributes.get("property") or attributes.get("name") or attributes.get("itemprop")
+            if key and "content" in attributes:
+                self.meta.setdefault(key.lower(), attributes["content"].strip())
+
+        itemprop = attributes.get("itemprop", "").lower()
+        if itemprop in MICRODATA_PROPS and itemprop not in self.itemprops:
+            value = attributes.get("content") or attributes.get("href")
+            if value:
+                self.itemprops[itemprop] = value.strip()
+            elif tag not in ("meta", "link"):
+                self._open_itemprop = itemprop
+                self._itemprop_text = []
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._in_json_ld:
+            self._in_json_ld = False
+            self.json_ld.append("".join(self._json_ld_chunks))
+        elif self._open_itemprop:
+            text = " ".join("".join(self._itemprop_text).split())
+            if text:
+                self.itemprops.setdefault(self._open_itemprop, text)
+            self._open_itemprop = None
+
+    def handle_data(self, data):
+        if self._in_json_ld:
+            self._json_ld_chunks.append(data)
+        elif self._open_itemprop:
+            self._itemprop_text.append(data)
+
+
+def extract_product_fields(html: str, url: str) -> dict[str, Any]:
+    """
+    Deterministically extracts AiProductInfo fields from schema.org JSON-LD,
+    OpenGraph/product meta tags and microdata, in that order of preference.
+    Only fields that were actually found are returned.
+    """
+    collector = _MarkupCollector()
+    try:
+        collector.feed(html)
+        collector.close()
+    except Exception as e:
+        logger.warning(f"Could not parse HTML markup for {url}: {e}")
+
+    fields: dict[str, Any] = {}
+    for product in _json_ld_products(collector.json_ld):
+        _merge(fields, _fields_from_json_ld(product))
+
+    meta = collector.meta
+    _merge(fields, {
+        "item_name": meta.get("og:title") or meta.get("twitter:title"),
+        "price_per_unit": _to_price(meta.get("product:price:amount") or meta.get("og:price:amount")),
+        "availability": _availability(meta.get("product:availability") or meta.get("og:availability")),
+        "platform": meta.get("og:site_name"),
+    })
+
+    props = collector.itemprops
+    _merge(fields, {
+        "item_name": props.get("name"),
+        "model_number": props.get("model") or props.get("mpn") or props.get("sku"),
+        "category": props.get("category"),
+        "price_per_unit": _to_price(props.get("price") or props.get("lowprice")),
+        "availability": _availability(props.get("availability")),
+    })
+
+    if "platform" not in fields and fields:
+        host = urlparse(url).netloc.lower()
+        fields["platform"] = host[4:] if host.startswith("www.") else host
+    return fields
+
+
+def is_complete(fields: dict[str, Any]) -> bool:
+    return all(fields.get(name) is not None for name in REQUIRED_FIELDS)
+
+
+def to_product_info(fields: dict[str, Any], user_message: str) -> AiProductInfo:
+    """Builds a full AiProductInfo from extracted fields; everything else is left empty."""
+    values: dict[str, Any] = {name: None for name in AiProductInfo.model_fields}
+    values.update(fields)
+    values["is_captcha"] = False
+    values["quantity_required"] = extract_quantity(user_message)
+    return AiProductInfo(**values)
+
+
+def fill_missing(result: AiProductInfo, fields: dict[str, Any]) -> AiProductInfo:
+    """Overlays markup values on an LLM result; markup wins because it is exact."""
+    # Failed or blocked results stay as they are so the worker still sees the failure.
+    if result.is_captcha or not fields or "ERROR" in (result.item_name or ""):
+        return result
+    return result.model_copy(update={name: value for name, value in fields.items() if value is not None})
+
+
+# --- Internal helpers ---
+
+def _json_ld_products(blocks: list[str]):
+    for block in blocks:
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            continue
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+            elif isinstance(node, dict):
+                node_type = node.get("@type")
+                types = node_type if isinstance(node_type, list) else [node_type]
+                if "Product" in types or "ProductGroup" in types:
+                    yield node
+                elif "@graph" in node:
+                    stack.append(node["@graph"])
+
+
+def _fields_from_json_ld(product: dict) -> dict[str, Any]:
+    offers = product.get("offers") or {}
+    if isinstance(offers, list):
+        offers = offers[0] if offers else {}
+    if not isinstance(offers, dict):
+        offers = {}
+    price_spec = offers.get("priceSpecification")
+    if isinstance(price_spec, list):
+        price_spec = price_spec[0] if price_spec else None
+
+    price = offers.get("price") or offers.get("lowPrice")
+    if price is None and isinstance(price_spec, dict):
+        price = price_spec.get("price")
+
+    category = product.get("category")
+    if isinstance(category, dict):
+        category = category.get("name")
+
+    return {
+        "item_name": _text(product.get("name")),
+        "model_number": _text(product.get("model") or product.get("mpn") or product.get("sku")),
+        "category": _text(category),
+        "price_per_unit": _to_price(price),
+        "availability": _availability(offers.get("availability")),
+    }
+
+
+def _merge(fields: dict[str, Any], found: dict[str, Any]):
+    for name, value in found.items():
+        if value not in (None, "") and name not in fields:
+            fields[name] = value
+
+
+def _text(value: Any) -> Optional[str]:
+    if isinstance(value, dict):
+        value = value.get("name")
+    if isinstance(value, (str, int, float)):
+        text = " ".join(str(value).split())
+        return text or None
+    return None
+
+
+def _to_price(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    # Drop currency symbols and thousands separators: "₹1,299.00" -> 1299.0
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", str(value))
+    if not match:
+        return None
+    try:
+        return float(match.group(0).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _availability(value: Any) -> Optional[str]:
+    if not value or not isinstance(value, str):
+        return None
+    key = value.rstrip("/").rsplit("/", 1)[-1].replace(" ", "").replace("_", "").lower()
+    return AVAILABILITY_LABELS.get(key, value.strip())
@@ -0,0 +1,104 @@
+import re
+import asyncio
+import logging
+import requests
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+# Hosts whose links are only redirects to the real product page.
+SHORT_LINK_HOSTS = {
+    "amzn.to", "amzn.in", "amzn.eu", "a.co", "fkrt.it", "fkrt.co", "bit.ly", "tinyurl.com", "rb.gy", "t.co",
+}
+
+# Query parameters that only track where a click came from, on any site. Exact names and prefixes.
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "srsltid",
+}
+TRACKING_PREFIXES = ("utm_", "_branch")
+
+# Short, generic names that some storefronts use to pick a variant ("th", "sr", ...), so
+# they are only dropped on the sites where they are known to track. Keyed by a host fragment.
+HOST_TRACKING_PARAMS = {
+    "amazon.": {
+        "ref", "ref_", "tag", "psc", "qid", "sr", "keywords", "crid", "sprefix", "th", "smid", "linkcode",
+        "linkid", "camp", "creative", "creativeasin", "ascsubtag", "_encoding", "content-id", "dib",
+        "dib_tag", "social_share",
+    },
+    "flipkart.": {
+        "affid", "affextparam1", "affextparam2", "srno", "otracker", "otracker1", "ppt", "ppn", "ssid", "cmpid",
+    },
+    "aliexpress.": {"spm", "scm", "algo_pvid", "algo_exp_id", "pdp_npi", "pdp_ext_f", "gatewayadapt"},
+}
+HOST_TRACKING_PREFIXES = {"amazon.": ("pd_rd_", "pf_rd_", "ref_")}
+
+# Amazon product pages are uniquely identified by their ASIN.
+AMAZON_ASIN_PATTERN = re.compile(r"/(?:dp|gp/product|gp/aw/d|exec/obidos/asin)/([A-Z0-9]{10})(?:[/?]|$)", re.IGNORECASE)
+
+# Resolved short links, so a link pasted twice only costs one redirect lookup.
+_short_link_cache: dict[str, str] = {}
+_SHORT_LINK_CACHE_SIZE = 1024
+
+
+def normalize_url(url: str) -> str:
+    """
+    Deterministically rewrites a product URL into its canonical form: lowercase
+    host without 'www.', no fragment, no tracking parameters, sorted query and
+    Amazon paths collapsed to https://<host>/dp/<ASIN>. Other URLs keep their
+    scheme, so http-only links still work from the sheet.
+    """
+    parsed = urlparse(url.strip())
+    scheme = (parsed.scheme or "https").lower()
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parsed.path or "/"
+
+    if "amazon." in host:
+        match = AMAZON_ASIN_PATTERN.search(path)
+        if match:
+            # Everything else in an Amazon URL (slug, ref, query) is noise.
+            return urlunparse(("https", host, f"/dp/{match.group(1).upper()}", "", "", ""))
+
+    params, prefixes = set(TRACKING_PARAMS), TRACKING_PREFIXES
+    for fragment, names in HOST_TRACKING_PARAMS.items():
+        if fragment in host:
+            params |= names
+            prefixes += HOST_TRACKING_PREFIXES.get(fragment, ())
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=False)
+        if key.lower() not in params and not key.lower().startswith(prefixes)
+    ]
+    # Some trackers are appended to the path itself, e.g. ".../ref=sr_1_3".
+    path = re.sub(r"/ref=[^/]*$", "", path)
+    if len(path) > 1:
+        path = path.rstrip("/")
+    return urlunparse((scheme, host, path, "", urlencode(sorted(query)), ""))
+
+
+def _blocking_resolve(url: str) -> str:
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=5)
+        if response.status_code >= 400:
+            # Some shorteners refuse HEAD, so fall back to a streamed GET.
+            response = requests.get(url, allow_redirects=True, timeout=5, stream=True)
+            response.close()
+        return response.url
+    except requests.RequestException as e:
+        logger.warning(f"Could not resolve short link {url}: {e}")
+        return url
+
+
+async def canonicalize_url(url: str) -> str:
+    """Resolves known short-link hosts, then normalizes the result."""
+    host = urlparse(url).netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host in SHORT_LINK_HOSTS:
+        if url not in _short_link_cache:
+            if len(_short_link_cache) >= _SHORT_LINK_CACHE_SIZE:
+                _short_link_cache.pop(next(iter(_short_link_cache)))
+            _short_link_cache[url] = await asyncio.to_thread(_blocking_resolve, url)
+            logger.info(f"Resolved short link {url} -> {_short_link_cache[url]}")
+        url = _short_link_cache[url]
+    return normalize_url(url)
@@ -1,11 +1,31 @@
+import time
 import asyncio
 import logging
 from datetime import datetime, timezone
-from .data_models import WorkItem, AiProductInfo, EnrichedProductInfo
+from urllib.parse import urlparse
+from .data_models import WorkItem, AiProductInfo, EnrichedProductInfo, FetchMode, FetchResult, JobOutcome, JobResult
+from .fetch_strategy import DomainFetchStrategy
 from .interfaces import FetcherInterface, ParserInterface, WriterInterface
+from .logging_config import job_context
+from .message_utils import extract_quantity
+from .metrics import job_timings, metrics
+from .parse_batcher import ParseBatcher
+from .pipeline import PipelineStage
+from .result_cache import ResultCache
+from .screenshot_store import ScreenshotStore
+from .structured_data import extract_product_fields, is_complete, to_product_info, fill_missing
+from .url_tools import canonicalize_url
 
 logger = logging.getLogger(__name__)
 
+# The stage each failed outcome is charged to in the error metrics.
+OUTCOME_STAGES = {
+    JobOutcome.FETCH_FAILED: "fetch",
+    JobOutcome.PARSE_FAILED: "parse",
+    JobOutcome.WRITE_FAILED: "write",
+    JobOutcome.ERROR: "worker",
+}
+
 class ProcessingWorker:
     def __init__(
         self,
@@ -13,72 +33,241 @@ class ProcessingWorker:
         parser_class,  # Pass the class
         writer_class,  # Pass the class
         component_config: dict, # Pass all the config needed to init them
-        max_concurrent_jobs: int
+        max_concurrent_jobs: int,
+        stage_concurrency: dict[str, int] | None = None,
     ):
         self._fetcher_class = fetcher_class
         self._parser_class = parser_class
         self._writer_class = writer_class
         self._config = component_config
-        # Only allows `max_concurrent_jobs` to run at once.
+        # Every component is built once and shared across jobs: the fetcher so its warm
+        # Chrome drivers are reused, the parser so one Gemini client and its connection
+        # pool serve every job, and the writer so rows from many jobs can be batched.
+        self._fetcher: FetcherInterface = fetcher_class(**component_config.get("fetcher_options", {}))
+        self._parser: ParserInterface = parser_class(
+            api_key=component_config["api_key"], **component_config.get("parser_options", {})
+        )
+        # A writer built elsewhere (shared with the re-checker) is used as is and closed by its owner.
+        self._owns_writer = component_config.get("writer") is None
+        self._writer: WriterInterface = component_config.get("writer") or writer_class(
+            credentials_path=component_config["creds_path"],
+            spreadsheet_id=component_config["sheet_id"],
+            sheet_name=component_config["sheet_name"],
+            **component_config.get("writer_options", {}),
+        )
+        # Optional plain-HTTP fetcher for the structured-data fast path. None disables it.
+        self._html_fetcher: FetcherInterface | None = component_config.get("html_fetcher")
+        # Optional cache of AI results keyed by canonical URL. None disables caching.
+        self._result_cache: ResultCache | None = component_config.get("result_cache")
+        # Optional store that keeps captures for debugging. None keeps nothing.
+        self._screenshot_store: ScreenshotStore | None = component_config.get("screenshot_store")
+        # Optional learned per-domain fetch modes. None means headless first, headed on CAPTCHA.
+        self._fetch_strategy: DomainFetchStrategy | None = component_config.get("fetch_strategy")
+        # Only allows `max_concurrent_jobs` to be in flight across all stages at once.
         self._semaphore = asyncio.Semaphore(max_concurrent_jobs)
-        logger.info(f"ProcessingWorker initialized to create per-job component instances with a concurrency limit of {max_concurrent_jobs} jobs.")
 
-    async def process_url(self, item: WorkItem):
-        # async with will wait here if the semaphore is full (e.g., if 3 jobs are already running)
+        # --- PIPELINE STAGES ---
+        # Browsers are CPU/RAM-bound while Gemini and Sheets are network-bound, so each
+        # stage gets its own worker pool and bounded queue instead of one shared limit.
+        # "write" counts rows in flight; the writer itself batches them into few requests.
+        concurrency = {"fetch": 2, "parse": 8, "write": 20, **(stage_concurrency or {})}
+        self._stages = {
+            name: PipelineStage(name, workers, queue_size=workers * 2) for name, workers in concurrency.items()
+        }
+        # Optional grouping of one message's screenshots into multi-image parse requests.
+        # The group's request still runs on the parse stage, so it counts against its limit.
+        batch_options = component_config.get("parse_batch")
+        self._parse_batcher: ParseBatcher | None = ParseBatcher(
+            lambda contents, message: self._stages["parse"].run(self._parser.parse_many, contents, message),
+            **batch_options,
+        ) if batch_options else None
+        logger.info(f"ProcessingWorker initialized with a limit of {max_concurrent_jobs} jobs in flight and stage workers {concurrency}.")
+
+    async def process_url(self, item: WorkItem) -> JobResult:
+        # async with will wait here if the semaphore is full (max_concurrent_jobs already in flight)
         # before starting a new one.
-        async with self._semaphore:
-            # --- PER-JOB INSTANTIATION ---
-            # Every job gets its own fresh set of tools. No sharing!
-            fetcher: FetcherInterface = self._fetcher_class()
-            parser: ParserInterface = self._parser_class(api_key=self._config["api_key"])
-            writer: WriterInterface = self._writer_class(
-                credentials_path=self._config["creds_path"],
-                spreadsheet_id=self._config["sheet_id"],
-                sheet_name=self._config["sheet_name"],
-            )
-            # --- END INSTANTIATION ---
-
-            logger.info(f"Worker starting job for URL: {item.url}")
-            try:
-                # --- ATTEMPT 1: Default Headless Fetch ---
-                logger.info(f"Attempt 1 (Headless) for URL: {item.url}")
-                content_path = await fetcher.fetch(item.url, headless=True)
-                if not content_path:
-                    logger.warning(f"Fetching failed for {item.url}. Aborting job.")
-                    return
-
-                ai_result = await parser.parse(content_path, item.message_content)
-
-                # --- DECISION POINT: Now using the boolean flag ---
-                if ai_result.is_captcha:
-                    logger.warning(f"CAPTCHA detected on first attempt for {item.url}. Retrying in headed mode.")
-
-                    # --- ATTEMPT 2: Headed Fetch Fallback ---
-                    content_path = await fetcher.fetch(item.url, headless=False)
-                    if not content_path:
-                        logger.error(f"Headed fallback fetch also failed for {item.url}. Aborting job.")
-                        return
-                    
-                    # Re-parse the new screenshot
-                    ai_result = await parser.parse(content_path, item.message_content)
-
-                # --- FINAL CHECK AND WRITE ---
+        # Every log line of this job, across its stages and threads, carries its job id.
+        with job_context(item.job_id):
+            async with self._semaphore:
+                # Queue wait covers the durable queue, the scheduler and this semaphore.
+                if item.enqueued_at:
+                    metrics.record_span("queue_wait", max(0.0, time.time() - item.enqueued_at))
+                with job_timings() as timings, metrics.span("job"):
+                    result = await self._process(item)
+                self._record_job(item, result, timings)
+                return result
+
+    async def _process(self, item: WorkItem) -> JobResult:
+        parser, writer = self._parser, self._writer
+
+        logger.info(f"Worker starting job for URL: {item.url}")
+        result = JobResult(JobOutcome.ERROR)
+        # Ids of the screenshots kept for this job, tagged with its outcome at the end.
+        captures: list[str] = []
+        try:
+            # Tracking parameters and short links would otherwise defeat the cache.
+            canonical_url = await canonicalize_url(item.url)
+
+            # --- CACHE CHECK: Identical products skip the fetch and parse entirely ---
+            # Re-checks exist to see what the page says now, so they never read the cache.
+            # A fresh row already in the sheet is the cheapest answer; writing then just adds this request to it.
+            cached = await writer.find_fresh(canonical_url) if not item.recheck else None
+            if cached is not None:
+                logger.info(f"Sheet already holds a fresh row for {canonical_url}. Skipping fetch and parse.")
+                metrics.inc("cache_hits_total", cache="sheet")
+            elif self._result_cache and not item.recheck:
+                cached = await self._result_cache.get(canonical_url)
+                if cached is not None:
+                    logger.info(f"Result cache hit for {canonical_url}. Skipping fetch and parse.")
+                    metrics.inc("cache_hits_total", cache="result")
+            if cached is not None:
+                # Only the requester-specific fields are refreshed.
+                ai_result = cached.model_copy(update={"quantity_required": extract_quantity(item.message_content)})
+            else:
+                # --- TIER 1: Structured markup (JSON-LD / OpenGraph / microdata) ---
+                markup_fields = {}
+                if self._html_fetcher:
+                    html = await self._html_fetcher.fetch(item.url)
+                    markup_fields = extract_product_fields(html, item.url) if html else {}
+
+                if is_complete(markup_fields):
+                    logger.info(f"Structured data complete for {item.url}. Skipping screenshot and LLM.")
+                    metrics.inc("cache_hits_total", cache="structured_data")
+                    ai_result = to_product_info(markup_fields, item.message_content)
+                else:
+                    # --- TIER 2: Screenshot + LLM for whatever the markup didn't give us ---
+                    started = time.monotonic()
+                    ai_result = await self._screenshot_and_parse(parser, item, canonical_url, result, captures)
+                    result.browser_seconds = time.monotonic() - started
+                    if ai_result is None:
+                        result.outcome = JobOutcome.FETCH_FAILED
+                        return result
+                    ai_result = fill_missing(ai_result, markup_fields)
+
+                # --- FINAL CHECK ---
                 if "ERROR" in (ai_result.item_name or ""):
                     logger.warning(f"Parsing failed for {item.url} with result: {ai_result}. Aborting job.")
-                    return
-                
-                # Enrich the data with info the LLM can't know
-                final_record = EnrichedProductInfo(
-                    ai_data=ai_result,
-                    processed_timestamp=datetime.now(timezone.utc).isoformat(),
-                    requesting_user=item.user_name,
-                    source_url=item.url # We can add sanitization here later
-                )
-
-                await writer.write(final_record)
+                    result.outcome = JobOutcome.PARSE_FAILED
+                    return result
+
+                # Only real product pages are worth remembering.
+                if self._result_cache and not ai_result.is_captcha:
+                    await self._result_cache.put(canonical_url, ai_result)
+            
+            # Enrich the data with info the LLM can't know
+            final_record = EnrichedProductInfo(
+                ai_data=ai_result,
+                processed_timestamp=datetime.now(timezone.utc).isoformat(),
+                requesting_user=item.user_name,
+                source_url=canonical_url,
+                job_id=item.job_id,
+            )
+
+            with metrics.span("sheet_write"):
+                written = await self._stages["write"].run(writer.update if item.recheck else writer.write, final_record)
+            if written:
                 logger.info(f"Successfully processed and wrote structured data for: {item.url}")
+                result.outcome = JobOutcome.SUCCESS
+            else:
+                logger.error(f"Sheet write failed for {item.url}.")
+                result.outcome = JobOutcome.WRITE_FAILED
+
+        except Exception as e:
+            logger.error(f"An unhandled exception occurred while processing {item.url}: {e}", exc_info=True)
+        finally:
+            if self._screenshot_store:
+                self._screenshot_store.record_outcome(captures, result.outcome.value)
+            logger.info(f"Worker finished job for: {item.url} ({result.outcome.value}). Stages: {self._format_stage_stats()}")
+        return result
+
+    async def _screenshot_and_parse(
+        self, parser: ParserInterface, item: WorkItem, canonical_url: str, result: JobResult, captures: list[str]
+    ) -> AiProductInfo | None:
+        """Runs the browser + LLM stages, with one retry in another mode on CAPTCHA. Returns None if fetching failed."""
+        fetch, parse = self._stages["fetch"], self._stages["parse"]
+        domain = urlparse(canonical_url).netloc
+        strategy = self._fetch_strategy
+
+        # --- ATTEMPT 1: The mode most likely to get through (headless unless we've learned otherwise) ---
+        mode = strategy.choose(domain) if strategy else FetchMode(headless=True)
+        logger.info(f"Attempt 1 ({mode.key}) for URL: {item.url}")
+        fetched = await fetch.run(self._fetcher.fetch, item.url, mode.headless, mode)
+        if not fetched:
+            logger.warning(f"Fetching failed for {item.url}. Aborting job.")
+            return None
+        self._keep_screenshot(fetched, item, captures)
+
+        ai_result = await self._parse(parser, item, fetched)
+        await self._record_fetch_mode(domain, mode, ai_result)
+
+        # --- DECISION POINT: Now using the boolean flag ---
+        if ai_result.is_captcha:
+            result.captcha_seen = True
+            retry_mode = strategy.fallback(domain, mode) if strategy else FetchMode(headless=False)
+            if retry_mode is None:
+                return ai_result
+            logger.warning(f"CAPTCHA detected on first attempt for {item.url}. Retrying in {retry_mode.key}.")
+
+            # --- ATTEMPT 2: Fallback fetch in a more robust mode ---
+            with metrics.span("retry"):
+                fetched = await fetch.run(self._fetcher.fetch, item.url, retry_mode.headless, retry_mode)
+                if not fetched:
+                    logger.error(f"Fallback fetch also failed for {item.url}. Aborting job.")
+                    return None
+                self._keep_screenshot(fetched, item, captures)
+
+                # Re-parse the new screenshot
+                ai_result = await parse.run(parser.parse, fetched, item.message_content, not item.recheck)
+            await self._record_fetch_mode(domain, retry_mode, ai_result)
+        return ai_result
+
+    async def _record_fetch_mode(self, domain: str, mode: FetchMode, ai_result: AiProductInfo):
+        """Tells the fetch strategy how `mode` did. A failed parse says nothing about the mode, so it isn't recorded."""
+        if not self._fetch_strategy:
+            return
+        if not ai_result.is_captcha and "ERROR" in (ai_result.item_name or ""):
+            logger.info(f"Parse failed ({ai_result.item_name}); not counting it for {mode.key} on {domain}.")
+            return
+        await self._fetch_strategy.record(domain, mode, ai_result.is_captcha)
+
+    async def _parse(self, parser: ParserInterface, item: WorkItem, fetched) -> AiProductInfo:
+        """Parses a first-attempt screenshot, together with the rest of its message's when batching is on."""
+        if self._parse_batcher and item.batch_id and item.batch_size > 1:
+            with metrics.span("parse_batch"):
+                return await self._parse_batcher.parse(item, fetched)
+        return await self._stages["parse"].run(parser.parse, fetched, item.message_content, not item.recheck)
+
+    def _keep_screenshot(self, fetched, item: WorkItem, captures: list[str]):
+        """Hands an in-memory capture to the screenshot store; the disk work happens in the background."""
+        if self._screenshot_store and isinstance(fetched, FetchResult):
+            captures.append(self._screenshot_store.save(item.url, fetched.image, item.job_id))
+
+    @staticmethod
+    def _record_job(item: WorkItem, result: JobResult, timings: dict[str, float]):
+        metrics.inc("jobs_total", outcome=result.outcome.value)
+        if result.captcha_seen:
+            metrics.inc("captchas_total")
+        if result.outcome != JobOutcome.SUCCESS:
+            metrics.inc("errors_total", stage=OUTCOME_STAGES[result.outcome])
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        logger.info(f"Timings for {item.url}: {breakdown}")
+
+    def stage_stats(self) -> dict[str, dict]:
+        """Queue depth, busy workers and concurrency for each pipeline stage."""
+        return {name: stage.stats() for name, stage in self._stages.items()}
+
+    def _format_stage_stats(self) -> str:
+        return ", ".join(
+            f"{name} {stats['busy']}/{stats['concurrency']} busy, {stats['queued']} queued"
+            for name, stats in self.stage_stats().items()
+        )
 
-            except Exception as e:
-                logger.error(f"An unhandled exception occurred while processing {item.url}: {e}", exc_info=True)
-            finally:
-                logger.info(f"Worker finished job for: {item.url}")
\ No newline at end of file
+    async def close(self):
+        """Flushes buffered writes and closes shared fetchers. Call once at shutdown."""
+        if self._owns_writer:
+            await self._writer.close()
+        for stage in self._stages.values():
+            await stage.stop()
+        await self._fetcher.close()
+        if self._html_fetcher:
+            await self._html_fetcher.close()
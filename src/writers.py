@@ -1,78 +1,435 @@
 # src/writers.py
+import time
 import asyncio
 import logging
+import contextvars
+from typing import Optional
 from .interfaces import WriterInterface
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from .data_models import EnrichedProductInfo # Import the new model
+from .data_models import AiProductInfo, EnrichedProductInfo # Import the new model
+from .metrics import metrics
+from .governor import ApiGovernor, is_transient_error
+from .sheet_index import (
+    AVAILABILITY_COLUMN, ITEM_NAME_COLUMN, JOBS_COLUMN, PRICE_COLUMN, QUANTITY_COLUMN, TIMESTAMP_COLUMN, TOTAL_COLUMN,
+    URL_COLUMN, USER_COLUMN, SheetIndex, cell, column_letter, to_number,
+)
+from .sheets_client import SCOPES, AsyncSheetsClient, ServiceAccountTokenSource, SheetsApiError
 
 logger = logging.getLogger(__name__)
 
+# The cells a job owns in an existing row, as (first, last) column spans: timestamp and
+# requesters, quantity and price, total and availability, and the ids of the jobs counted
+# in. Names, model number, category and the rest are left to whoever curates the sheet.
+OWNED_SPANS = (
+    (TIMESTAMP_COLUMN, USER_COLUMN), (QUANTITY_COLUMN, PRICE_COLUMN),
+    (TOTAL_COLUMN, AVAILABILITY_COLUMN), (JOBS_COLUMN, JOBS_COLUMN),
+)
+# Job ids remembered per row; redeliveries come within hours, so the newest few are enough.
+MAX_JOB_IDS = 20
+
 class GoogleSheetWriter(WriterInterface):
-    SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+    """
+    Buffers rows from many jobs and upserts them into the sheet in batches.
+    Calls go through a shared AsyncSheetsClient (one keep-alive connection
+    pool and one cached OAuth token for the process).
+
+    The sheet's rows are kept in an in-memory SheetIndex, loaded once and then
+    topped up by reading only the rows added since (every `refresh_interval`
+    seconds, and before new rows are placed), with a full reload every
+    `reload_interval`. A product that already has a row (same URL, or same
+    platform and model number) is updated there, with the new requester and
+    quantity added, instead of piling up duplicate rows. Only the cells a job
+    owns (OWNED_SPANS) are written into an existing row, and each row lists
+    the job ids counted into it, so a redelivered job isn't counted twice.
+
+    Every flush is one values.batchUpdate request, preceded by a read of the
+    target rows' URL cells: if someone deleted or moved rows by hand, the
+    index is reloaded and the batch re-planned rather than overwriting
+    another product. A batch is flushed when `batch_size` rows are waiting,
+    when `flush_interval` seconds have passed, or on close().
+    """
+    SCOPES = SCOPES
 
-    def __init__(self, credentials_path: str, spreadsheet_id: str, sheet_name: str):
-        # We only store the configuration, not the live service object.
+    def __init__(
+        self,
+        credentials_path: str,
+        spreadsheet_id: str,
+        sheet_name: str,
+        batch_size: int = 20,
+        flush_interval: float = 2.0,
+        sheets_client: Optional[AsyncSheetsClient] = None,
+        governor: Optional[ApiGovernor] = None,
+        refresh_interval: float = 60.0,
+        reload_interval: float = 3600.0,
+        fresh_for: float = 0.0,
+    ):
         self._credentials_path = credentials_path
         self._spreadsheet_id = spreadsheet_id
         self._sheet_name = sheet_name
-        logger.info(f"GoogleSheetWriter configured for sheet: {self._spreadsheet_id}")
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+
+        # Callers should inject the process-wide client; otherwise the writer builds and owns one.
+        self._owns_client = sheets_client is None
+        self._client = sheets_client or AsyncSheetsClient(ServiceAccountTokenSource(credentials_path, self.SCOPES))
+        # Quota, retries and circuit breaking for every Sheets call.
+        self._governor = governor or ApiGovernor("sheets")
+
+        self._index = SheetIndex()
+        self._index_loaded = False
+        self._refresh_interval = refresh_interval
+        self._reload_interval = reload_interval
+        self._last_reload = 0.0
+        # Rows younger than this are served to the worker by find_fresh(). 0 disables it.
+        self._fresh_for = fresh_for
+
+        # Records waiting to be flushed: (record, refresh-only?, future its job is awaiting).
+        self._buffer: list[tuple[EnrichedProductInfo, bool, asyncio.Future]] = []
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        logger.info(f"GoogleSheetWriter configured for sheet: {self._spreadsheet_id} (batch_size={batch_size}, flush_interval={flush_interval}s)")
 
     # The header row for our sheet
     HEADER = [
         "Timestamp", "User", "Platform", "Item Name", "Model Number",
         "Generic Name", "Category", "Quantity", "Unit Price", "GST Included?",
-        "Total Cost", "Availability", "Est. Delivery", "URL"
+        "Total Cost", "Availability", "Est. Delivery", "URL", "Job IDs"
     ]
+    LAST_COLUMN = column_letter(JOBS_COLUMN)
+
+    async def write(self, data: EnrichedProductInfo) -> bool:
+        """
+        Buffers a record and waits until the batch containing it has been
+        flushed. If the product already has a row, the requester and quantity
+        are added to it and its product details refreshed.
+        """
+        return await self._enqueue(data, refresh=False)
+
+    async def update(self, data: EnrichedProductInfo) -> bool:
+        """
+        Refreshes the price, availability, total and timestamp of the URL's row
+        in place. Everything else (names, model, requesters, quantity) is left as
+        it is, since a re-check's source may be less careful than the original
+        (appends if the URL has no row).
+        """
+        return await self._enqueue(data, refresh=True)
 
-    async def write(self, data: EnrichedProductInfo): # Update input type
-        """Asynchronously writes a ProductInfo object to the sheet."""
-        await asyncio.to_thread(self._blocking_write, data)
-    
-    def _blocking_write(self, data: EnrichedProductInfo): # Update input type
+    async def find_fresh(self, url: str) -> Optional[AiProductInfo]:
         """
-        Contains the synchronous, blocking Google Sheets API call.
-        CRITICALLY, it now creates its own service object for thread safety.
+        The product data of the URL's row if it was written within `fresh_for`
+        seconds, from memory. The index is refreshed first when it is due and
+        no flush is running.
         """
+        if not self._fresh_for:
+            return None
+        if not self._index_loaded or time.monotonic() - self._index.loaded_at >= self._refresh_interval:
+            # A flush can hold the lock through minutes of backoff. Rather than wait, answer from
+            # the index as it is; the flush refreshes it anyway, and a miss only costs a fetch.
+            if self._flush_lock.locked():
+                return self._index.fresh_record(url, self._fresh_for) if self._index_loaded else None
+            async with self._flush_lock:
+                try:
+                    await self._refresh_index()
+                except Exception as e:
+                    logger.warning(f"Could not refresh the sheet index: {e}")
+        return self._index.fresh_record(url, self._fresh_for)
+
+    async def read_rows(self) -> list[list]:
+        """Every data row in the sheet (below the header), from the index after reading any new rows."""
+        async with self._flush_lock:
+            await self._refresh_index(force=True)
+            return self._index.rows()
+
+    async def close(self):
+        """Stops the background flusher and writes out anything still buffered."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self._flush()
+        if self._owns_client:
+            await self._client.close()
+
+    async def _enqueue(self, data: EnrichedProductInfo, refresh: bool) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((data, refresh, future))
+        logger.info(f"Buffered row for '{data.ai_data.item_name}' ({len(self._buffer)} waiting).")
+
+        if self._flush_task is None or self._flush_task.done():
+            # The flusher serves every job, so it must not inherit this job's log context.
+            self._flush_task = asyncio.create_task(self._flush_loop(), context=contextvars.Context())
+        if len(self._buffer) >= self._batch_size:
+            self._flush_now.set()
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self._flush()
+
+    async def _flush(self):
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                results = await self._upsert([(record, refresh) for record, refresh, _ in batch])
+            except Exception as e:
+                logger.error(f"Flushing {len(batch)} rows to Google Sheet failed: {e}", exc_info=True)
+                results = [False] * len(batch)
+            for (_, _, future), ok in zip(batch, results):
+                if not future.done():
+                    future.set_result(ok)
+
+    async def _upsert(self, batch: list[tuple[EnrichedProductInfo, bool]]) -> list[bool]:
+        """Writes a batch with one batchUpdate, falling back to one request per row. Returns one flag per record."""
+        await self._refresh_index()
+        for attempt in range(3):
+            planned, targets, expected = self._plan(batch)
+            stale = await self._changed_rows(expected)
+            if not stale or attempt == 2:
+                break
+            # Rows below the index's end only mean someone appended; anything else means rows moved.
+            moved = any(n < self._index.next_row for n in stale)
+            logger.warning(
+                f"{len(stale)} target rows no longer hold what the sheet index expects (first: row {min(stale)}). "
+                f"{'Reloading the index' if moved else 'Reading the new rows'} and planning again."
+            )
+            await self._refresh_index(force=True, reload=moved)
+
+        results = [False] * len(batch)
+        appended = [i for i, n in enumerate(targets) if n in stale]
+        if appended:
+            # The sheet kept changing under us: add these as rows of their own rather than risk overwriting others.
+            for n in stale:
+                planned.pop(n, None)
+            # Records for the same product still share one row, as they would have in the planned one.
+            rows: dict[str, list] = {}
+            for i in appended:
+                record, refresh = batch[i]
+                existing = rows.get(record.source_url)
+                rows[record.source_url] = (
+                    self._to_row(record) if existing is None else self._merge(existing, record, add_request=not refresh)
+                )
+            ok = await self._append(list(rows.values()))
+            for i in appended:
+                results[i] = ok
+
+        new_rows = sum(1 for n in planned if n >= self._index.next_row)
+        written: set[int] = set()
+        if planned:
+            try:
+                await self._batch_update(planned)
+                written = set(planned)
+                logger.info(
+                    f"Write successful: {len(planned) - new_rows} rows updated and {new_rows} added in one request "
+                    f"({len(batch)} records)."
+                )
+            except SheetsApiError as e:
+                # Transient errors were already retried by the governor; splitting the batch would only add load.
+                if len(planned) == 1 or is_transient_error(e):
+                    logger.error(f"Writing {len(planned)} rows to Google Sheet failed: {e}")
+                else:
+                    logger.warning(f"Batch write of {len(planned)} rows failed ({e}). Retrying rows one at a time.")
+                    # Isolate the bad row(s) so one failure doesn't sink the whole batch.
+                    for row_number, row in planned.items():
+                        try:
+                            await self._batch_update({row_number: row})
+                            written.add(row_number)
+                        except SheetsApiError as e:
+                            logger.error(f"Writing row {row_number} for '{row[ITEM_NAME_COLUMN]}' failed: {e}")
+
+        for row_number in written:
+            self._index.set(row_number, planned[row_number])
+        for i, row_number in enumerate(targets):
+            if i not in appended:
+                results[i] = row_number in written
+        return results
+
+    def _plan(self, batch: list[tuple[EnrichedProductInfo, bool]]) -> tuple[dict[int, list], list[int], dict[int, str]]:
+        """
+        The rows to write (row number -> contents), each record's row number,
+        and the URL each target row should hold right now ("" for new rows).
+        """
+        # Records for the same product in one batch merge into one row.
+        planned: dict[int, list] = {}
+        targets: list[int] = []
+        expected: dict[int, str] = {}
+        next_row = self._index.next_row
+        for record, refresh in batch:
+            ai = record.ai_data
+            row_number = self._index.find(record.source_url, ai.platform, ai.model_number)
+            if row_number is None:
+                row_number = next((n for n, row in planned.items() if row[URL_COLUMN] == record.source_url), None)
+            if row_number is None:
+                row_number, next_row = next_row, next_row + 1
+                planned[row_number] = self._to_row(record)
+                expected[row_number] = ""
+            else:
+                if row_number not in expected:
+                    expected[row_number] = cell(self._index.row(row_number), URL_COLUMN) if row_number < self._index.next_row else ""
+                existing = planned.get(row_number) or self._index.row(row_number)
+                planned[row_number] = self._merge(existing, record, add_request=not refresh)
+            targets.append(row_number)
+        return planned, targets, expected
+
+    async def _changed_rows(self, expected: dict[int, str]) -> set[int]:
+        """Reads the URL cell of every target row and returns the rows that don't hold the expected URL."""
+        ranges = [f"{self._sheet_name}!{column_letter(URL_COLUMN)}{n}" for n in expected]
+        response = await self._governor.call(
+            self._client.batch_get_values, self._spreadsheet_id, ranges, value_render_option="UNFORMATTED_VALUE"
+        )
+        value_ranges = response.get("valueRanges", [])
+        changed = set()
+        for index, (row_number, url) in enumerate(expected.items()):
+            values = value_ranges[index].get("values", []) if index < len(value_ranges) else []
+            if cell(values[0] if values else [], 0) != url:
+                changed.add(row_number)
+        return changed
+
+    async def _batch_update(self, rows: dict[int, list]):
+        """One batchUpdate: whole rows for new products, only the owned cells of existing ones."""
+        new_rows = 0
+        data = []
+        for n, row in sorted(rows.items()):
+            if n >= self._index.next_row:
+                new_rows += 1
+                data.append({"range": f"{self._sheet_name}!A{n}:{self.LAST_COLUMN}{n}", "values": [row]})
+                continue
+            for first, last in OWNED_SPANS:
+                data.append({
+                    "range": f"{self._sheet_name}!{column_letter(first)}{n}:{column_letter(last)}{n}",
+                    "values": [row[first:last + 1]],
+                })
+        metrics.inc("sheets_requests_total")
+        with metrics.span("sheets_write"):
+            await self._governor.call(self._client.batch_update_values, self._spreadsheet_id, data)
+        metrics.inc("sheet_rows_total", new_rows)
+        metrics.inc("sheet_rows_updated_total", len(rows) - new_rows)
+
+    async def _append(self, rows: list[list]) -> bool:
+        """Appends rows below whatever the sheet holds. Their row numbers are unknown, so the index is reloaded next time."""
         try:
-            # Each thread creates its own credentials and service object. No sharing.
-            creds = service_account.Credentials.from_service_account_file(
-                self._credentials_path, scopes=self.SCOPES
+            metrics.inc("sheets_requests_total")
+            with metrics.span("sheets_write"):
+                await self._governor.call(
+                    self._client.append_values, self._spreadsheet_id, f"{self._sheet_name}!A1:{self.LAST_COLUMN}", rows
+                )
+        except SheetsApiError as e:
+            logger.error(f"Appending {len(rows)} rows to Google Sheet failed: {e}")
+            return False
+        metrics.inc("sheet_rows_total", len(rows))
+        self._last_reload = float("-inf")
+        return True
+
+    async def _refresh_index(self, force: bool = False, reload: bool = False):
+        """
+        Loads the index on first use (writing the header if the sheet has
+        none, or an older, shorter one), reloads it every `reload_interval`
+        or when asked to, and otherwise reads only the rows below the last
+        known one. Without `force` it skips reading if the index is younger
+        than `refresh_interval`. Cells are read unformatted, so prices come
+        back as numbers rather than currency text.
+        """
+        now = time.monotonic()
+        if reload or not self._index_loaded or now - self._last_reload >= self._reload_interval:
+            response = await self._governor.call(
+                self._client.get_values, self._spreadsheet_id, f"{self._sheet_name}!A1:{self.LAST_COLUMN}",
+                value_render_option="UNFORMATTED_VALUE",
+            )
+            values = response.get("values", [])
+            if not values or len(values[0]) < len(self.HEADER):
+                logger.info("Header missing or incomplete in sheet. Writing the header.")
+                await self._governor.call(self._client.update_values, self._spreadsheet_id, f"{self._sheet_name}!A1", [self.HEADER])
+            self._index.replace(values[1:])
+            self._index_loaded, self._last_reload = True, now
+            logger.info(f"Loaded the sheet index: {len(self._index)} rows.")
+        elif force or now - self._index.loaded_at >= self._refresh_interval:
+            response = await self._governor.call(
+                self._client.get_values, self._spreadsheet_id,
+                f"{self._sheet_name}!A{self._index.next_row}:{self.LAST_COLUMN}", value_render_option="UNFORMATTED_VALUE",
             )
-            service = build("sheets", "v4", credentials=creds)
-            sheet = service.spreadsheets()
-
-            # --- Check for Header and Add if Missing ---
-            current_header = sheet.values().get(spreadsheetId=self._spreadsheet_id, range=f"{self._sheet_name}!A1:N1").execute()
-            if not current_header.get('values'):
-                logger.info("Header not found in sheet. Writing new header.")
-                sheet.values().update(
-                    spreadsheetId=self._spreadsheet_id,
-                    range=f"{self._sheet_name}!A1",
-                    valueInputOption="USER_ENTERED",
-                    body={'values': [self.HEADER]}
-                ).execute()
-
-            # --- Unpack the data from our two sources ---
-            ai = data.ai_data
-            new_row = [
-                data.processed_timestamp, data.requesting_user, ai.platform,
-                ai.item_name, ai.model_number, ai.generic_name,
-                ai.category, ai.quantity_required, ai.price_per_unit,
-                str(ai.is_gst_included) if ai.is_gst_included is not None else "N/A",
-                ai.total_cost, ai.availability, ai.estimated_delivery,
-                data.source_url
-            ]
-            
-            logger.info(f"Writing structured data for '{ai.item_name}' to Google Sheet...")
-            sheet.values().append(
-                spreadsheetId=self._spreadsheet_id,
-                range=self._sheet_name,
-                valueInputOption="USER_ENTERED",
-                body={'values': [new_row]}
-            ).execute()
-            logger.info("Write successful.")
-            
-        except Exception as e:
-            logger.error(f"An unexpected error occurred in _blocking_write for '{data.ai_data.item_name}': {e}", exc_info=True)
\ No newline at end of file
+            added = response.get("values", [])
+            self._index.extend(added)
+            if added:
+                logger.info(f"Sheet index picked up {len(added)} rows added elsewhere.")
+
+    @staticmethod
+    def _merge(existing: list, record: EnrichedProductInfo, add_request: bool) -> list:
+        """
+        The existing row with the cells the record owns brought up to date:
+        the new timestamp, price and availability (where it has them) and the
+        total. A new request also adds its requester and quantity, unless the
+        row already lists its job id (a redelivered job). Other cells stay as
+        they are on the sheet.
+        """
+        new = GoogleSheetWriter._to_row(record)
+        merged = list(existing) + [""] * (len(new) - len(existing))
+        for column in (TIMESTAMP_COLUMN, PRICE_COLUMN, AVAILABILITY_COLUMN):
+            if new[column] is not None:
+                merged[column] = new[column]
+
+        users = [user.strip() for user in cell(merged, USER_COLUMN).split(",") if user.strip()]
+        quantity = to_number(merged[QUANTITY_COLUMN])
+        jobs = cell(merged, JOBS_COLUMN).split()
+        job = new[JOBS_COLUMN]
+        if add_request and job and job in jobs:
+            logger.info(f"Job {record.job_id} is already counted in the row for {record.source_url}; not adding it again.")
+        elif add_request:
+            if new[USER_COLUMN] and new[USER_COLUMN] not in users:
+                users.append(new[USER_COLUMN])
+            added = to_number(new[QUANTITY_COLUMN])
+            if added is not None:
+                quantity = (quantity or 0) + added
+            if job:
+                jobs = (jobs + [job])[-MAX_JOB_IDS:]
+        merged[USER_COLUMN] = ", ".join(users)
+        merged[QUANTITY_COLUMN] = int(quantity) if quantity is not None else ""
+        merged[JOBS_COLUMN] = " ".join(jobs)
+
+        price = to_number(merged[PRICE_COLUMN])
+        if price is not None and quantity is not None:
+            merged[TOTAL_COLUMN] = round(price * quantity, 2)
+        elif new[TOTAL_COLUMN] is not None:
+            merged[TOTAL_COLUMN] = new[TOTAL_COLUMN]
+        return merged
+
+    @staticmethod
+    def _to_row(data: EnrichedProductInfo) -> list:
+        # --- Unpack the data from our two sources ---
+        ai = data.ai_data
+        return [
+            data.processed_timestamp, data.requesting_user, ai.platform,
+            ai.item_name, ai.model_number, ai.generic_name,
+            ai.category, ai.quantity_required, ai.price_per_unit,
+            str(ai.is_gst_included) if ai.is_gst_included is not None else "N/A",
+            ai.total_cost, ai.availability, ai.estimated_delivery,
+            data.source_url,
+            # "#" keeps Sheets from reading the id as a number.
+            f"#{data.job_id}" if data.job_id is not None else "",
+        ]
+
+
+class BrokerResultWriter(WriterInterface):
+    """
+    Used by worker processes in broker mode: hands each finished row to the
+    broker, whose single GoogleSheetWriter batches rows from every worker.
+    The sheet settings are accepted for interface parity and ignored.
+    """
+    def __init__(self, credentials_path: Optional[str] = None, spreadsheet_id: Optional[str] = None,
+                 sheet_name: Optional[str] = None, broker=None):
+        if broker is None:
+            raise ValueError("BrokerResultWriter needs the worker's RemoteWorkQueue as `broker`.")
+        self._broker = broker
+
+    async def write(self, data: EnrichedProductInfo) -> bool:
+        return await self._broker.write_result(data)
+
+    async def update(self, data: EnrichedProductInfo) -> bool:
+        return await self._broker.write_result(data, update=True)